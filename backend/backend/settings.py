@@ -41,12 +41,15 @@ INSTALLED_APPS = [
     'django_filters',       # 实现产品筛选需要的库
     'rest_framework',
     'corsheaders',          # 解决跨域问题需要的库
+    'core',                 # 各 app 共用的组件
     'users',
     'products',
 
 ]
 
 MIDDLEWARE = [
+    'core.middleware.InstrumentationMiddleware',    # 请求耗时/SQL/序列化埋点, 放在最外层统计完整耗时
+    'core.middleware.CompressionMiddleware',        # 按 Accept-Encoding 压缩响应(gzip/brotli)
     'corsheaders.middleware.CorsMiddleware',        # 解决跨域问题的中间件
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -81,13 +84,193 @@ WSGI_APPLICATION = 'backend.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/5.1/ref/settings/#databases
 
-DATABASES = {
+# * 通过 DATABASE_PROFILE 环境变量选择数据库配置:
+#   sqlite(默认): 单机部署, 打开 WAL 等 PRAGMA, 读写可以并发, 写锁冲突时等待而不是立即报 "database is locked"
+#   postgres: 服务器数据库, 持久连接 + 健康检查, 设置 DB_POOL_MAX_SIZE 后改用 psycopg 连接池
+DATABASE_PROFILE = os.environ.get('DATABASE_PROFILE', 'sqlite')
+
+if DATABASE_PROFILE == 'postgres':
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.postgresql',
+            'NAME': os.environ.get('DB_NAME', 'django_shop'),
+            'USER': os.environ.get('DB_USER', 'postgres'),
+            'PASSWORD': os.environ.get('DB_PASSWORD', ''),
+            'HOST': os.environ.get('DB_HOST', 'localhost'),
+            'PORT': os.environ.get('DB_PORT', '5432'),
+            'CONN_MAX_AGE': int(os.environ.get('DB_CONN_MAX_AGE', 60)),  # 连接复用时间(秒)
+            'CONN_HEALTH_CHECKS': True,     # 复用连接前检查是否可用, 数据库重启后不会拿到断开的连接
+            'OPTIONS': {},
+        }
+    }
+    if os.environ.get('DB_POOL_MAX_SIZE'):
+        # ! 连接池和持久连接不能同时使用, 需要安装 psycopg[pool]
+        DATABASES['default']['CONN_MAX_AGE'] = 0
+        DATABASES['default']['OPTIONS']['pool'] = {
+            'min_size': int(os.environ.get('DB_POOL_MIN_SIZE', 2)),
+            'max_size': int(os.environ['DB_POOL_MAX_SIZE']),
+            'timeout': 10,
+        }
+    # * 只读副本, 逗号分隔的主机名; 商品目录的 GET 请求会发到这些副本上, 见 core/db.py
+    for index, host in enumerate(filter(None, os.environ.get('DB_REPLICA_HOSTS', '').split(','))):
+        DATABASES[f'replica_{index}'] = {
+            **DATABASES['default'],
+            'HOST': host.strip(),
+            'TEST': {'MIRROR': 'default'},
+        }
+else:
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': os.environ.get('SQLITE_PATH', BASE_DIR / 'db.sqlite3'),
+            'OPTIONS': {
+                # 每个新连接建立时执行
+                'init_command': ';'.join([
+                    'PRAGMA journal_mode=WAL',      # 写入不阻塞读取
+                    'PRAGMA synchronous=NORMAL',    # WAL 模式下只在检查点时 fsync, 断电最多丢失最近的事务
+                    'PRAGMA cache_size=-32000',     # 页缓存 32MB
+                    'PRAGMA mmap_size=134217728',   # 128MB 内存映射读取
+                    'PRAGMA temp_store=MEMORY',
+                ]),
+                'timeout': 20,  # busy timeout(秒), 写锁被占用时等待
+                # ! 事务一开始就拿写锁, 避免两个读事务同时升级为写事务时其中一个直接报 "database is locked"
+                'transaction_mode': 'IMMEDIATE',
+            },
+        }
+    }
+
+DATABASE_ROUTERS = ['core.db.ReplicaRouter']
+
+
+# Cache
+# https://docs.djangoproject.com/en/5.1/topics/cache/
+# * 默认使用进程内缓存, 多进程部署时设置 REDIS_URL 切换到共享的 Redis 缓存
+
+CACHES = {
     'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
     }
 }
 
+if os.environ.get('REDIS_URL'):
+    CACHES['default'] = {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': os.environ['REDIS_URL'],
+    }
+
+# 商品目录响应缓存
+CATALOG_CACHE = {
+    'ALIAS': 'default',     # 使用的缓存后端
+    'TIMEOUT': 300,         # 响应缓存过期时间(秒), 数据变更时通过版本号立即失效
+    # * 数据变更后由后台任务重新生成这些地址的缓存, 例如 ['https://shop.example.com/api/products/'];
+    # 主机名要在 ALLOWED_HOSTS 里, 而且只有共享缓存(Redis)时预热才对 Web 进程有效
+    'WARM_URLS': [],
+    'WARM_DELAY': 5,        # 变更后等待的秒数, 期间的多次变更只预热一次
+}
+
+# 商品搜索后端, 默认使用 SQLite FTS5 全文索引, 可以替换为实现了 products.search.SearchBackend 的其他引擎
+PRODUCT_SEARCH_BACKEND = 'products.search.SQLiteFTS5Backend'
+
+# 商品目录增量同步(products.sync)
+CATALOG_SYNC = {
+    'BATCH_SIZE': 500,          # 每批每种数据默认返回的条数
+    'MAX_BATCH_SIZE': 2000,     # 客户端通过 limit 参数可以设置的最大值
+    'SETTLE_SECONDS': 5,        # 只返回这么久之前的变更, 等待未提交的事务完成
+    'TOMBSTONE_TTL': 30 * 24 * 60 * 60,     # 删除记录保留 30 天, 更早的同步令牌需要重新全量同步
+}
+
+# 商品列表分面统计, 价格区间的边界(元), 区间为 [下限, 上限)
+PRODUCT_FACETS = {
+    'PRICE_BUCKETS': [100, 500, 1000, 5000],
+}
+
+# 库存预留的有效期(秒), 超时未确认的预留由 expire_reservations 命令释放
+STOCK_RESERVATION_TTL = 15 * 60
+
+
+# 响应压缩(core.middleware.CompressionMiddleware), 安装了 brotli 时优先使用 br
+COMPRESSION = {
+    'ENABLED': True,
+    'MIN_SIZE': 1024,           # 小于这个字节数的响应不压缩, 流式响应总是压缩
+    'GZIP_LEVEL': 6,
+    'BROTLI_QUALITY': 4,        # 动态响应用较低的级别, 压缩率接近 gzip -9 而速度更快
+    'HTML_RANDOM_BYTES': 100,   # HTML 响应只用 gzip, 并加入最多这么多字节的随机填充(防 BREACH)
+}
+
+# 媒体文件服务(core.media), 上传的商品图片和头像使用内容寻址的文件名
+MEDIA_SERVING = {
+    'IMMUTABLE_MAX_AGE': 365 * 24 * 60 * 60,    # 内容寻址文件的缓存时间, 内容变化时文件名也会变化
+    'MAX_AGE': 60 * 60,                         # 其他文件的缓存时间, 过期后用 ETag 重新验证
+    'PRECOMPRESS_MIN_SIZE': 1024,               # 上传时为可压缩的文件写入 .gz/.br 预压缩版本的最小字节数
+}
+
+
+# 后台任务队列(core.jobs), 由 python manage.py run_jobs 启动 worker 执行
+JOBS = {
+    'EAGER': False,             # 为 True 时不入队, 在事务提交后直接在当前线程执行(测试、脚本)
+    'CONCURRENCY': 4,           # worker 的线程数/进程数
+    'POLL_INTERVAL': 1.0,       # 队列为空时的轮询间隔(秒)
+    'LEASE_SECONDS': 300,       # worker 超过这么久没有心跳, 它领取的任务重新排队
+    'MAX_ATTEMPTS': 5,          # 默认最多执行次数, 任务可以单独设置
+    'BACKOFF_BASE': 10,         # 重试间隔 10s, 20s, 40s ... (秒)
+    'BACKOFF_MAX': 60 * 60,
+    'RETENTION': 7 * 24 * 60 * 60,  # 已完成任务的保留时间, 失败的任务保留两倍
+}
+
+# 后台列表超过这么多行(估计值)时, 未筛选的列表用估计的行数分页, 不再执行 COUNT(*)(core.admin)
+ADMIN_ESTIMATED_COUNT_THRESHOLD = 100_000
+
+
+# 认证后端, 支持用户名或邮箱登录
+AUTHENTICATION_BACKENDS = [
+    'users.backends.EmailOrUsernameBackend',
+]
+
+# 密码哈希, 第一个用于生成新密码; PBKDF2 迭代次数可以通过环境变量调整, 默认与 Django 一致
+PASSWORD_HASHERS = [
+    'users.hashers.ConfigurablePBKDF2PasswordHasher',
+    'django.contrib.auth.hashers.PBKDF2SHA1PasswordHasher',
+    'django.contrib.auth.hashers.Argon2PasswordHasher',
+    'django.contrib.auth.hashers.BCryptSHA256PasswordHasher',
+    'django.contrib.auth.hashers.ScryptPasswordHasher',
+]
+
+PASSWORD_PBKDF2_ITERATIONS = int(os.environ.get('PASSWORD_PBKDF2_ITERATIONS', 870000))
+
+# 请求埋点, 见 core/instrumentation.py; 指标通过 /metrics 暴露给 Prometheus
+INSTRUMENTATION = {
+    'ENABLED': True,
+    'SAMPLE_RATE': float(os.environ.get('INSTRUMENTATION_SAMPLE_RATE', 1.0)),  # 记录 SQL/序列化耗时的请求比例
+    'SERVER_TIMING': DEBUG,             # 是否输出 Server-Timing 响应头, 生产环境不要暴露给外部
+    'DUPLICATE_QUERY_WARNING': 5,       # 同一请求里重复的 SQL 达到这个数量时记警告日志
+    'METRICS_ALLOWED_IPS': ['127.0.0.1'],
+}
+
+# API 的签名令牌认证, 见 users/tokens.py
+AUTH_TOKENS = {
+    'ACCESS_TTL': 15 * 60,              # access 令牌有效期(秒)
+    'REFRESH_TTL': 14 * 24 * 60 * 60,   # refresh 令牌有效期(秒)
+    'CACHE_ALIAS': 'default',           # 缓存用户对象和吊销列表的缓存后端, 多进程部署时需要共享缓存(Redis)
+    'SESSION_LOGIN': os.environ.get('API_SESSION_LOGIN') == '1',    # 登录接口是否同时建立会话
+}
+
+REST_FRAMEWORK = {
+    # * 安装了 orjson 时用它渲染 JSON, 输出与 DRF 的 JSONRenderer 相同; 换回 rest_framework.renderers.JSONRenderer 即可关闭
+    'DEFAULT_RENDERER_CLASSES': [
+        'core.renderers.FastJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
+    # * 优先使用签名令牌, 不带令牌时退回会话认证(后台管理、可浏览 API)
+    'DEFAULT_AUTHENTICATION_CLASSES': [
+        'users.authentication.SignedTokenAuthentication',
+        'rest_framework.authentication.SessionAuthentication',
+    ],
+    'DEFAULT_THROTTLE_RATES': {
+        'login_ip': '30/min',       # 同一 IP 每分钟最多尝试登录 30 次
+        'login_account': '10/min',  # 同一账号每分钟最多尝试登录 10 次
+    },
+}
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.1/ref/settings/#auth-password-validators
@@ -123,6 +306,14 @@ MEDIA_URL = '/media/'
 
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
+# 上传图片的衍生图, thumb 居中裁剪为固定尺寸, 其余尺寸等比缩放
+IMAGE_VARIANT_SIZES = {
+    'thumb': (200, 200),
+    'small': (480, 480),
+    'large': (1080, 1080),
+}
+IMAGE_VARIANT_FORMATS = ['webp', 'avif']    # Pillow 不支持的格式会被跳过
+
 # Static files (CSS, JavaScript, Images)
 # https://docs.djangoproject.com/en/5.1/howto/static-files/
 
@@ -14,11 +14,16 @@ Including another URLconf
     1. Import the include() function: from django.urls import include, path
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
+from django.conf import settings
 from django.contrib import admin
 from django.urls import path, include
+from core import views as core_views
 
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('api/', include('users.urls')), # 将users包含在api路径下
     path('api/', include('products.urls')),
+    path('api/batch/', core_views.CompoundView.as_view(), name='compound'),     # 复合请求, 一次往返执行多个只读子请求
+    path('metrics', core_views.metrics, name='metrics'),    # Prometheus 指标
+    path(settings.MEDIA_URL.lstrip('/') + '<path:path>', core_views.serve_media, name='media'),  # 上传的图片, 前面有 nginx/CDN 时由它们直接提供
 ]
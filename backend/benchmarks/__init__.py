@@ -0,0 +1,7 @@
+"""
+性能基准测试
+
+在独立的临时数据库上生成测试数据后运行, 不会影响 db.sqlite3。在 backend 目录下执行, 例如:
+
+    python -m benchmarks.async_read --concurrency 50 --requests 2000
+"""
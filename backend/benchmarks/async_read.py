@@ -0,0 +1,99 @@
+"""
+对比商品目录只读接口在 WSGI(DRF 同步视图) 与 ASGI(异步视图) 下的并发吞吐量和延迟
+
+两条路径使用同一份数据, 并关闭响应缓存, 只比较视图本身的开销。
+"""
+import argparse
+import asyncio
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from .environment import setup_django, teardown_django
+
+# (名称, WSGI 路径, ASGI 路径)
+ENDPOINTS = [
+    ('product list', '/api/products/?page_size=20', '/api/async/products/?page_size=20'),
+    ('product list filtered', '/api/products/?is_on_sale=true&ordering=price', '/api/async/products/?is_on_sale=true&ordering=price'),
+    ('product detail', '/api/products/{pk}/', '/api/async/products/{pk}/'),
+    ('category list', '/api/product-categories/', '/api/async/product-categories/'),
+]
+
+
+def summarize(latencies, elapsed):
+    latencies = sorted(latencies)
+    return {
+        'rps': len(latencies) / elapsed,
+        'p50_ms': statistics.median(latencies) * 1000,
+        'p99_ms': latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))] * 1000,
+    }
+
+
+def run_wsgi(path, requests, concurrency):
+    from django.db import connection
+    from django.test import Client
+
+    def worker(count):
+        client, latencies = Client(), []
+        for _ in range(count):
+            start = time.perf_counter()
+            client.get(path)
+            latencies.append(time.perf_counter() - start)
+        connection.close()
+        return latencies
+
+    per_worker = max(1, requests // concurrency)
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(worker, [per_worker] * concurrency))
+    return summarize([latency for result in results for latency in result], time.perf_counter() - start)
+
+
+async def run_asgi(path, requests, concurrency):
+    from django.test import AsyncClient
+
+    client, latencies = AsyncClient(), []
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one():
+        async with semaphore:
+            start = time.perf_counter()
+            await client.get(path)
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one() for _ in range(requests)))
+    return summarize(latencies, time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--products', type=int, default=2000)
+    parser.add_argument('--categories', type=int, default=20)
+    parser.add_argument('--requests', type=int, default=1000)
+    parser.add_argument('--concurrency', type=int, default=20)
+    args = parser.parse_args()
+
+    old_name = setup_django()
+    try:
+        from django.test.utils import override_settings
+        from products.models import Product
+        from .data import generate
+
+        generate(categories=args.categories, products=args.products)
+        pk = Product.objects.values_list('pk', flat=True).first()
+
+        with override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}}):
+            print(f'{"endpoint":<24}{"mode":<6}{"req/s":>10}{"p50 ms":>10}{"p99 ms":>10}')
+            for name, wsgi_path, asgi_path in ENDPOINTS:
+                for mode, result in (
+                    ('wsgi', run_wsgi(wsgi_path.format(pk=pk), args.requests, args.concurrency)),
+                    ('asgi', asyncio.run(run_asgi(asgi_path.format(pk=pk), args.requests, args.concurrency))),
+                ):
+                    print(f'{name:<24}{mode:<6}{result["rps"]:>10.1f}{result["p50_ms"]:>10.2f}{result["p99_ms"]:>10.2f}')
+    finally:
+        teardown_django(old_name)
+
+
+if __name__ == '__main__':
+    main()
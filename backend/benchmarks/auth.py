@@ -0,0 +1,77 @@
+"""
+认证方式负载测试: 会话 vs 签名令牌
+
+对同一个需要登录的接口(用户资料)分别用会话 cookie 和 Bearer 令牌反复请求, 统计每个请求的数据库查询数和吞吐量;
+--concurrency 大于 1 时多个线程同时请求, 模拟并发访问。
+"""
+import argparse
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from .environment import setup_django, teardown_django
+
+
+def count_queries(client, url, headers):
+    from django.db import connection
+    from django.test.utils import CaptureQueriesContext
+
+    with CaptureQueriesContext(connection) as queries:
+        response = client.get(url, headers=headers)
+    assert response.status_code == 200, response.content
+    return [query['sql'] for query in queries.captured_queries]
+
+
+def measure(make_client, url, headers, requests, concurrency):
+    def worker(count):
+        client = make_client()
+        for _ in range(count):
+            client.get(url, headers=headers)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as executor:
+        list(executor.map(worker, [requests // concurrency] * concurrency))
+    return requests / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--concurrency', type=int, default=1)
+    args = parser.parse_args()
+
+    old_name = setup_django()
+    try:
+        from django.contrib.auth.models import User
+        from django.test import Client
+        from django.test.utils import override_settings
+        from users.models import UserProfile
+        from users.views import LoginView
+
+        LoginView.throttle_classes = []
+        with override_settings(PASSWORD_PBKDF2_ITERATIONS=1000):
+            user = User.objects.create_user('bench', 'bench@example.com', 'bench-password', is_staff=True)
+            UserProfile.objects.create(user=user, address='上海')
+            url = f'/api/users/{user.pk}/profile_detail/'
+
+            session_client = Client()
+            session_client.force_login(user)
+            login = Client().post('/api/login/', {'username': 'bench', 'password': 'bench-password'})
+            access = login.json()['tokens']['access']
+
+            modes = [
+                ('session', lambda: session_client, {}),
+                ('token', Client, {'Authorization': f'Bearer {access}'}),
+            ]
+            print(f'{"mode":<10}{"queries/req":>12}{"req/s":>10}')
+            for name, make_client, headers in modes:
+                queries = count_queries(make_client(), url, headers)
+                rate = measure(make_client, url, headers, args.requests, args.concurrency)
+                print(f'{name:<10}{len(queries):>12}{rate:>10.1f}')
+                for sql in queries:
+                    print(f'    {sql[:100]}')
+    finally:
+        teardown_django(old_name)
+
+
+if __name__ == '__main__':
+    main()
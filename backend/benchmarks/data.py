@@ -0,0 +1,57 @@
+import random
+from decimal import Decimal
+
+WORDS = ['手机', '耳机', '笔记本', '平板', '键盘', '鼠标', '显示器', '充电器', '音箱', '相机', '手表', '路由器']
+
+
+PASSWORD = 'bench-password'    # 生成的用户统一使用这个密码
+
+
+def generate(categories=20, products=2000, users=0, seed=0):
+    """用 bulk_create 批量生成商品分类、商品和带资料的用户, 然后重建分类树和搜索索引"""
+    from products import tree
+    from products.models import ProductCategory, Product
+    from products.search import get_search_backend
+
+    rng = random.Random(seed)
+    category_objs = ProductCategory.objects.bulk_create(
+        ProductCategory(name=f'分类{i}', description=f'第{i}个分类') for i in range(categories)
+    )
+    Product.objects.bulk_create(
+        (
+            Product(
+                category=rng.choice(category_objs),
+                name=f'{rng.choice(WORDS)}{i}',
+                description=f'{rng.choice(WORDS)} {rng.choice(WORDS)} 商品描述 {i}',
+                price=Decimal(rng.randint(100, 999999)) / 100,
+                stock=rng.randint(0, 500),
+                is_on_sale=rng.random() < 0.2,
+            )
+            for i in range(products)
+        ),
+        batch_size=1000,
+    )
+    # ! bulk_create 不会触发信号, 需要手动重建分类路径/商品数和全文索引
+    tree.rebuild()
+    get_search_backend().rebuild()
+    if users:
+        generate_users(users)
+
+
+def generate_users(count, prefix='bench'):
+    """批量生成用户和用户资料, 密码只哈希一次, 所有用户共用同一个哈希值"""
+    from django.contrib.auth.hashers import make_password
+    from django.contrib.auth.models import User
+    from users.models import UserProfile
+
+    password = make_password(PASSWORD)
+    User.objects.bulk_create(
+        (User(username=f'{prefix}{i}', email=f'{prefix}{i}@example.com', password=password) for i in range(count)),
+        batch_size=1000,
+    )
+    # 取回新用户的主键, 不依赖数据库是否支持 bulk_create 回填主键
+    user_ids = User.objects.filter(username__startswith=prefix).values_list('pk', flat=True)
+    UserProfile.objects.bulk_create(
+        (UserProfile(user_id=pk, address=f'地址{pk}', phone_number=f'1{pk:010d}') for pk in user_ids),
+        batch_size=1000,
+    )
@@ -0,0 +1,111 @@
+"""
+数据库配置基准: 并发读写下的吞吐量和 "database is locked" 错误数
+
+对比 SQLite 默认配置(回滚日志, DEFERRED 事务)和 settings 里的 SQLite 配置(WAL 等 PRAGMA, IMMEDIATE 事务);
+以 DATABASE_PROFILE=postgres 运行时再加上服务器数据库(持久连接/连接池)的结果。
+写操作是"先读库存再更新"的事务, 这正是 DEFERRED 事务在并发下最容易直接报锁冲突的模式。
+"""
+import argparse
+import copy
+import os
+import random
+import shutil
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from .environment import setup_django, teardown_django
+
+
+def add_sqlite_alias(alias, path, options):
+    from django.db import connections
+
+    settings_dict = copy.deepcopy(connections['default'].settings_dict)
+    settings_dict.update({'ENGINE': 'django.db.backends.sqlite3', 'NAME': path, 'OPTIONS': options})
+    connections.settings[alias] = settings_dict
+    return alias
+
+
+def prepare(alias, products):
+    """在 alias 上建表并写入商品数据"""
+    from django.db import connections
+    from products.models import Product, ProductCategory
+
+    if alias != 'default':
+        with connections[alias].schema_editor() as editor:
+            editor.create_model(ProductCategory)
+            editor.create_model(Product)
+    category = ProductCategory.objects.using(alias).create(name=f'bench-{alias}')
+    Product.objects.using(alias).bulk_create(
+        Product(name=f'商品 {index}', price=1, stock=1000, category=category) for index in range(products)
+    )
+    return list(Product.objects.using(alias).filter(category=category).values_list('pk', flat=True))
+
+
+def run(alias, product_ids, threads, operations, write_ratio):
+    from django.db import OperationalError, connections, transaction
+    from django.db.models import F
+    from products.models import Product
+
+    errors = []
+    lock = threading.Lock()
+
+    def worker(seed):
+        rng = random.Random(seed)
+        try:
+            for _ in range(operations):
+                try:
+                    if rng.random() < write_ratio:
+                        pk = rng.choice(product_ids)
+                        with transaction.atomic(using=alias):
+                            if Product.objects.using(alias).filter(pk=pk).values_list('stock', flat=True).get() > 0:
+                                Product.objects.using(alias).filter(pk=pk).update(stock=F('stock') - 1)
+                    else:
+                        list(Product.objects.using(alias).order_by('-id').values('id', 'name', 'price')[:20])
+                except OperationalError:
+                    with lock:
+                        errors.append(1)
+        finally:
+            connections[alias].close()
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(threads) as executor:
+        list(executor.map(worker, range(threads)))
+    elapsed = time.perf_counter() - start
+    return threads * operations / elapsed, len(errors)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--operations', type=int, default=300, help='每个线程的操作次数')
+    parser.add_argument('--write-ratio', type=float, default=0.2)
+    parser.add_argument('--products', type=int, default=200)
+    args = parser.parse_args()
+
+    old_name = setup_django()
+    tmpdir = tempfile.mkdtemp(prefix='shop-bench-')
+    try:
+        from django.conf import settings
+
+        sqlite_options = settings.DATABASES['default']['OPTIONS'] if settings.DATABASE_PROFILE == 'sqlite' else {}
+        profiles = [
+            ('sqlite default', add_sqlite_alias('bench_sqlite_default', os.path.join(tmpdir, 'default.sqlite3'), {})),
+            ('sqlite tuned', add_sqlite_alias('bench_sqlite_tuned', os.path.join(tmpdir, 'tuned.sqlite3'), sqlite_options)),
+        ]
+        if settings.DATABASE_PROFILE != 'sqlite':
+            profiles.append((settings.DATABASE_PROFILE, 'default'))
+
+        print(f'{"profile":<16}{"ops/s":>10}{"lock errors":>14}')
+        for name, alias in profiles:
+            product_ids = prepare(alias, args.products)
+            rate, errors = run(alias, product_ids, args.threads, args.operations, args.write_ratio)
+            print(f'{name:<16}{rate:>10.1f}{errors:>14}')
+    finally:
+        shutil.rmtree(tmpdir, ignore_errors=True)
+        teardown_django(old_name)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,109 @@
+"""
+端到端接口基准: 用进程内的测试客户端请求商品列表/搜索/筛选/详情以及注册/登录
+
+关闭响应缓存和登录限流, 每个接口记录中位数/p95 耗时和单次请求的 SQL 查询数。
+注册/登录使用较低的 PBKDF2 迭代次数(--iterations), 只衡量接口本身的开销, 密码哈希的成本见 benchmarks.login。
+"""
+import argparse
+import itertools
+import statistics
+import time
+
+from .environment import setup_django, teardown_django
+
+
+def time_requests(send, requests):
+    latencies = []
+    for _ in range(requests):
+        start = time.perf_counter()
+        response = send()
+        latencies.append(time.perf_counter() - start)
+        assert response.status_code < 400, response.content[:200]
+    latencies.sort()
+    return statistics.median(latencies), latencies[int(len(latencies) * 0.95) - 1]
+
+
+def count_queries(send):
+    from django.db import connection
+    from django.test.utils import CaptureQueriesContext
+
+    with CaptureQueriesContext(connection) as queries:
+        send()
+    return len(queries)
+
+
+def endpoints(client):
+    """(名称, 发送一次请求的函数) 列表; 注册每次使用新的用户名"""
+    from products.models import Product
+
+    from .data import PASSWORD
+
+    product = Product.objects.order_by('id').first()
+    serial = itertools.count()
+
+    def register():
+        index = next(serial)
+        return client.post('/api/register/', {
+            'username': f'new{index}', 'email': f'new{index}@example.com',
+            'password': 'Str0ng-passw0rd', 'password2': 'Str0ng-passw0rd',
+        })
+
+    return [
+        ('product_list', lambda: client.get('/api/products/?page_size=20')),
+        ('product_search', lambda: client.get('/api/products/?search=手机')),
+        ('product_filter', lambda: client.get(
+            f'/api/products/?category={product.category_id}&is_on_sale=true&ordering=-price'
+        )),
+        ('product_detail', lambda: client.get(f'/api/products/{product.pk}/')),
+        ('register', register),
+        ('login', lambda: client.post('/api/login/', {'username': 'bench0', 'password': PASSWORD})),
+    ]
+
+
+def run(requests=200, iterations=1000):
+    """返回 {指标名: {'value', 'unit', 'better'}}, 需要事先用 benchmarks.data 生成数据(含用户)"""
+    from django.test import Client
+    from django.test.utils import override_settings
+    from users.views import LoginView
+
+    results = {}
+    throttles, LoginView.throttle_classes = LoginView.throttle_classes, []
+    try:
+        with override_settings(
+            CACHES={'default': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}},
+            PASSWORD_PBKDF2_ITERATIONS=iterations,
+        ):
+            for name, send in endpoints(Client()):
+                send()  # 预热
+                queries = count_queries(send)
+                p50, p95 = time_requests(send, requests)
+                results[f'endpoint.{name}.p50'] = {'value': p50 * 1000, 'unit': 'ms', 'better': 'lower'}
+                results[f'endpoint.{name}.p95'] = {'value': p95 * 1000, 'unit': 'ms', 'better': 'lower'}
+                results[f'endpoint.{name}.queries'] = {'value': queries, 'unit': 'queries', 'better': 'lower'}
+    finally:
+        LoginView.throttle_classes = throttles
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--products', type=int, default=2000)
+    parser.add_argument('--users', type=int, default=200)
+    parser.add_argument('--requests', type=int, default=200)
+    parser.add_argument('--iterations', type=int, default=1000, help='注册/登录使用的 PBKDF2 迭代次数')
+    args = parser.parse_args()
+
+    old_name = setup_django()
+    try:
+        from .data import generate
+
+        generate(products=args.products, users=args.users)
+        print(f'{"benchmark":<36}{"value":>10}  unit')
+        for name, result in run(requests=args.requests, iterations=args.iterations).items():
+            print(f'{name:<36}{result["value"]:>10.2f}  {result["unit"]}')
+    finally:
+        teardown_django(old_name)
+
+
+if __name__ == '__main__':
+    main()
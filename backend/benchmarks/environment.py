@@ -0,0 +1,22 @@
+import os
+
+import django
+
+
+def setup_django():
+    """初始化 Django 并创建临时测试数据库, 返回数据库名"""
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'backend.settings')
+    django.setup()
+
+    from django.conf import settings
+    from django.db import connection
+    from django.test.utils import setup_test_environment
+
+    settings.ALLOWED_HOSTS = ['testserver']
+    setup_test_environment()
+    return connection.creation.create_test_db(verbosity=0, keepdb=False)
+
+
+def teardown_django(old_name):
+    from django.db import connection
+    connection.creation.destroy_test_db(old_name, verbosity=0)
@@ -0,0 +1,63 @@
+"""
+请求埋点的开销: 关闭埋点中间件、按比例采样、全部采样三种情况下商品列表接口的平均耗时
+
+关闭响应缓存, 每轮依次跑三种配置并交替多轮, 减少机器抖动的影响。
+"""
+import argparse
+import time
+
+from .environment import setup_django, teardown_django
+
+
+def measure(path, requests):
+    from django.test import Client
+
+    client = Client()
+    client.get(path)    # 预热
+    start = time.perf_counter()
+    for _ in range(requests):
+        client.get(path)
+    return (time.perf_counter() - start) / requests
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--requests', type=int, default=300, help='每轮每种配置的请求数')
+    parser.add_argument('--rounds', type=int, default=5)
+    parser.add_argument('--sample-rate', type=float, default=0.1)
+    parser.add_argument('--path', default='/api/products/?page_size=20')
+    args = parser.parse_args()
+
+    old_name = setup_django()
+    try:
+        from django.conf import settings
+        from django.test.utils import override_settings
+
+        from .data import generate
+
+        generate()
+        middleware = [name for name in settings.MIDDLEWARE if name != 'core.middleware.InstrumentationMiddleware']
+        configs = [
+            ('off', {'MIDDLEWARE': middleware}),
+            (f'sampled {args.sample_rate:g}', {'INSTRUMENTATION': dict(settings.INSTRUMENTATION, SAMPLE_RATE=args.sample_rate)}),
+            ('full', {'INSTRUMENTATION': dict(settings.INSTRUMENTATION, SAMPLE_RATE=1.0)}),
+        ]
+        results = {name: [] for name, _ in configs}
+        dummy_cache = {'default': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}}
+        with override_settings(CACHES=dummy_cache):
+            for _ in range(args.rounds):
+                for name, overrides in configs:
+                    with override_settings(**overrides):
+                        results[name].append(measure(args.path, args.requests))
+
+        baseline = min(results['off'])
+        print(f'{"config":<16}{"ms/req":>10}{"overhead":>10}')
+        for name, _ in configs:
+            best = min(results[name])
+            print(f'{name:<16}{best * 1000:>10.3f}{(best / baseline - 1) * 100:>9.1f}%')
+    finally:
+        teardown_django(old_name)
+
+
+if __name__ == '__main__':
+    main()
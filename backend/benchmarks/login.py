@@ -0,0 +1,59 @@
+"""
+登录吞吐量基准: 单线程(即每核) 每秒能完成多少次登录
+
+对比 Django 默认 PBKDF2 迭代次数和 --iterations 指定的次数, 也可以用 --hasher 指定其他哈希算法;
+登录限流在基准中关闭, 每次登录都会走完整的密码校验。
+"""
+import argparse
+import time
+
+from .environment import setup_django, teardown_django
+
+
+def measure(client, payload, seconds):
+    count, start = 0, time.perf_counter()
+    while time.perf_counter() - start < seconds:
+        response = client.post('/api/login/', payload, content_type='application/json')
+        assert response.status_code == 200, response.content
+        count += 1
+    return count / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--iterations', type=int, default=100000, help='对比用的 PBKDF2 迭代次数')
+    parser.add_argument('--hasher', help='额外对比的哈希算法, 例如 django.contrib.auth.hashers.ScryptPasswordHasher')
+    parser.add_argument('--seconds', type=float, default=5)
+    args = parser.parse_args()
+
+    old_name = setup_django()
+    try:
+        from django.conf import settings
+        from django.contrib.auth.hashers import PBKDF2PasswordHasher
+        from django.contrib.auth.models import User
+        from django.test import Client
+        from django.test.utils import override_settings
+        from users.views import LoginView
+
+        LoginView.throttle_classes = []     # 关闭登录限流
+        default_iterations = PBKDF2PasswordHasher.iterations
+        configs = [
+            (f'pbkdf2 {default_iterations}', {'PASSWORD_PBKDF2_ITERATIONS': default_iterations}),
+            (f'pbkdf2 {args.iterations}', {'PASSWORD_PBKDF2_ITERATIONS': args.iterations}),
+        ]
+        if args.hasher:
+            configs.append((args.hasher.rsplit('.', 1)[-1], {'PASSWORD_HASHERS': [args.hasher, *settings.PASSWORD_HASHERS]}))
+
+        print(f'{"hasher":<32}{"logins/s":>10}{"ms/login":>10}')
+        for index, (name, overrides) in enumerate(configs):
+            with override_settings(**overrides):
+                User.objects.create_user(f'bench{index}', f'bench{index}@example.com', 'bench-password')
+                for field, value in (('username', f'bench{index}'), ('email', f'bench{index}@example.com')):
+                    rate = measure(Client(), {field: value, 'password': 'bench-password'}, args.seconds)
+                    print(f'{name + " (" + field + ")":<32}{rate:>10.1f}{1000 / rate:>10.2f}')
+    finally:
+        teardown_django(old_name)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,99 @@
+"""
+基准测试报告: 运行序列化微基准和端到端接口基准, 与保存的基线比较, 出现性能回退时以非零状态退出
+
+    python -m benchmarks.report                     # 与 benchmarks/baseline.json 比较
+    python -m benchmarks.report --update-baseline   # 用本次结果覆盖基线
+
+耗时/吞吐量变差超过 --threshold(默认 25%) 算回退; SQL 查询数与机器无关, 只要比基线多就算回退。
+耗时基线与机器相关, 换了运行环境(例如 CI 机器)后应先在该环境上重新生成基线。
+"""
+import argparse
+import json
+import platform
+import sys
+from pathlib import Path
+
+from .environment import setup_django, teardown_django
+
+BASELINE = Path(__file__).with_name('baseline.json')
+
+
+def collect(args):
+    from . import endpoints, serializers
+    from .data import generate
+
+    generate(categories=args.categories, products=args.products, users=args.users)
+    results = serializers.run()
+    results.update(endpoints.run(requests=args.requests))
+    return results
+
+
+def compare(results, baseline, threshold):
+    """返回 [(指标名, 基线值, 本次值, 变化比例, 是否回退)], 变化比例为正表示变差"""
+    rows = []
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        before, after = baseline[name]['value'], result['value']
+        if result['better'] == 'higher':
+            change = (before - after) / before if before else 0.0
+        else:
+            change = (after - before) / before if before else float(after > before)
+        limit = 0 if result['unit'] == 'queries' else threshold
+        rows.append((name, before, after, change, change > limit))
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--baseline', type=Path, default=BASELINE)
+    parser.add_argument('--output', type=Path, help='把本次结果写入 JSON 文件')
+    parser.add_argument('--threshold', type=float, default=0.25, help='耗时/吞吐量允许变差的比例')
+    parser.add_argument('--update-baseline', action='store_true')
+    parser.add_argument('--categories', type=int, default=20)
+    parser.add_argument('--products', type=int, default=2000)
+    parser.add_argument('--users', type=int, default=200)
+    parser.add_argument('--requests', type=int, default=200)
+    args = parser.parse_args()
+
+    old_name = setup_django()
+    try:
+        results = collect(args)
+    finally:
+        teardown_django(old_name)
+
+    report = {
+        'meta': {
+            'python': platform.python_version(), 'machine': platform.machine(),
+            'categories': args.categories, 'products': args.products, 'users': args.users,
+        },
+        'results': results,
+    }
+    if args.output:
+        args.output.write_text(json.dumps(report, indent=2, ensure_ascii=False) + '\n')
+    if args.update_baseline:
+        args.baseline.write_text(json.dumps(report, indent=2, ensure_ascii=False) + '\n')
+        print(f'基线已写入 {args.baseline}')
+        return 0
+    if not args.baseline.exists():
+        print(f'找不到基线文件 {args.baseline}, 先使用 --update-baseline 生成', file=sys.stderr)
+        return 2
+
+    baseline = json.loads(args.baseline.read_text())
+    data_keys = ('categories', 'products', 'users')
+    if any(baseline['meta'].get(key) != report['meta'][key] for key in data_keys):
+        print('警告: 本次的数据规模与基线不同, 比较结果仅供参考', file=sys.stderr)
+
+    rows = compare(results, baseline['results'], args.threshold)
+    print(f'{"benchmark":<36}{"baseline":>12}{"current":>12}{"change":>9}')
+    for name, before, after, change, regressed in rows:
+        print(f'{name:<36}{before:>12.2f}{after:>12.2f}{change * 100:>+8.1f}%{"  REGRESSION" if regressed else ""}')
+    regressions = [row for row in rows if row[-1]]
+    if regressions:
+        print(f'\n{len(regressions)} 项性能回退', file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
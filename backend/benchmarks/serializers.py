@@ -0,0 +1,86 @@
+"""
+序列化微基准: ProductSerializer/UserSerializer 每秒能序列化多少个对象
+
+数据在计时之前全部取好(包括关联商品索引), 只统计序列化本身, 不含数据库查询。
+serializer.compiled_* 是列表接口使用的 CompiledSerializer(输入 .values() 行), render.* 是整页数据的 JSON 渲染。
+"""
+import argparse
+import time
+
+from .environment import setup_django, teardown_django
+
+
+def best_rate(func, objects, repeat, number):
+    """重复 repeat 轮, 每轮调用 number 次, 取最快一轮的对象/秒"""
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(number):
+            func()
+        best = min(best, time.perf_counter() - start)
+    return objects * number / best
+
+
+def run(page_size=20, repeat=5, number=50):
+    """返回 {指标名: {'value', 'unit', 'better'}}, 需要事先用 benchmarks.data 生成数据"""
+    from django.contrib.auth.models import User
+    from django.test import RequestFactory
+    from rest_framework.renderers import JSONRenderer
+    from rest_framework.request import Request
+
+    from core.compiled import CompiledSerializer
+    from core.renderers import FastJSONRenderer
+    from products.related import related_index
+    from products.serializers import ProductSerializer
+    from products.views import ProductViewSet
+    from users.serializers import UserSerializer
+
+    request = Request(RequestFactory().get('/api/products/'))
+    # 列表接口的 queryset 取决于请求参数(稀疏字段集), 视图要带上请求
+    view = ProductViewSet(request=request, action='list', format_kwarg=None, args=(), kwargs={})
+    products = list(view.get_queryset().order_by('-created_at')[:page_size])
+    context = {'request': request, 'related_products': related_index.neighbors_for(products)}
+    users = list(User.objects.prefetch_related('profile').order_by('-date_joined')[:page_size])
+    compiled_product = CompiledSerializer(ProductSerializer, {'request': request})
+    product_rows = list(compiled_product.values(view.get_queryset().order_by('-created_at'))[:page_size])
+    compiled_user = CompiledSerializer(UserSerializer, {'request': request})
+    user_rows = list(compiled_user.values(User.objects.order_by('-date_joined'))[:page_size])
+    page = ProductSerializer(products, many=True, context=context).data
+
+    cases = {
+        'serializer.product_list': (lambda: ProductSerializer(products, many=True, context=context).data, len(products)),
+        'serializer.product_detail': (lambda: ProductSerializer(products[0], context=context).data, 1),
+        'serializer.user_list': (lambda: UserSerializer(users, many=True, context=context).data, len(users)),
+        # 包含 batch_related_products 计算关联商品(索引已经预热)
+        'serializer.compiled_product_list': (lambda: compiled_product.serialize(product_rows), len(product_rows)),
+        'serializer.compiled_user_list': (lambda: compiled_user.serialize(user_rows), len(user_rows)),
+        'render.json_product_list': (lambda: JSONRenderer().render(page), len(page)),
+        'render.fast_json_product_list': (lambda: FastJSONRenderer().render(page), len(page)),
+    }
+    return {
+        name: {'value': best_rate(func, objects, repeat, number), 'unit': 'objects/s', 'better': 'higher'}
+        for name, (func, objects) in cases.items()
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--products', type=int, default=2000)
+    parser.add_argument('--users', type=int, default=200)
+    parser.add_argument('--page-size', type=int, default=20)
+    args = parser.parse_args()
+
+    old_name = setup_django()
+    try:
+        from .data import generate
+
+        generate(products=args.products, users=args.users)
+        print(f'{"benchmark":<40}{"objects/s":>12}')
+        for name, result in run(page_size=args.page_size).items():
+            print(f'{name:<40}{result["value"]:>12.0f}')
+    finally:
+        teardown_django(old_name)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,73 @@
+"""
+客户端冷启动的流量和耗时: 逐页下载商品列表+分类列表, 与增量同步接口的全量同步、少量变更后的增量同步对比
+
+关闭响应缓存; 增量同步前修改 --changed 个商品、删除 1 个商品。
+"""
+import argparse
+import time
+
+from .environment import setup_django, teardown_django
+
+
+def download(client, url, params, follow):
+    """请求 url 并按 follow(data) 返回的下一个参数继续, 返回 (字节数, 请求数, 耗时, 最后一次的数据)"""
+    size = requests = 0
+    start = time.perf_counter()
+    while params is not None:
+        response = client.get(url, params)
+        assert response.status_code == 200, response.content[:200]
+        size += len(response.content)
+        requests += 1
+        data = response.json()
+        params = follow(data)
+    return size, requests, time.perf_counter() - start, data
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--products', type=int, default=2000)
+    parser.add_argument('--changed', type=int, default=20)
+    parser.add_argument('--limit', type=int, default=500, help='增量同步每批的条数')
+    args = parser.parse_args()
+
+    old_name = setup_django()
+    try:
+        from django.conf import settings
+        from django.test import Client
+        from django.test.utils import override_settings
+
+        from products.models import Product
+
+        from .data import generate
+
+        generate(products=args.products)
+        client = Client()
+        dummy_cache = {'default': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}}
+        with override_settings(CACHES=dummy_cache, CATALOG_SYNC=dict(settings.CATALOG_SYNC, SETTLE_SECONDS=0)):
+            pages = iter(range(2, 10 ** 6))
+            listing = download(client, '/api/products/', {'page_size': 100}, lambda data: data['next'] and {'page_size': 100, 'page': next(pages)})
+            categories = download(client, '/api/product-categories/', {}, lambda data: None)
+            full = download(client, '/api/catalog/changes/', {'limit': args.limit},
+                            lambda data: data['has_more'] and {'since': data['next'], 'limit': args.limit} or None)
+
+            for product in Product.objects.order_by('?')[:args.changed]:
+                product.is_on_sale = not product.is_on_sale
+                product.save()
+            Product.objects.order_by('?').first().delete()
+            delta = download(client, '/api/catalog/changes/', {'since': full[3]['next'], 'limit': args.limit},
+                             lambda data: data['has_more'] and {'since': data['next'], 'limit': args.limit} or None)
+
+        print(f'{"scenario":<28}{"KiB":>10}{"requests":>10}{"ms":>10}')
+        rows = [
+            ('list pages + categories', listing[0] + categories[0], listing[1] + categories[1], listing[2] + categories[2]),
+            ('sync: full', *full[:3]),
+            (f'sync: {args.changed} changed, 1 deleted', *delta[:3]),
+        ]
+        for name, size, requests, seconds in rows:
+            print(f'{name:<28}{size / 1024:>10.1f}{requests:>10}{seconds * 1000:>10.1f}')
+    finally:
+        teardown_django(old_name)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,24 @@
+import argparse
+import json
+
+from django.core.cache import cache
+from django.test import TestCase
+
+from products.related import related_index
+
+from . import report
+
+
+class BenchmarkSmokeTests(TestCase):
+    """用很小的数据量跑一遍基准报告, 确保基准代码跟得上视图和序列化器的改动"""
+
+    def setUp(self):
+        cache.clear()
+        related_index.clear()
+
+    def test_report_collects_every_baseline_metric(self):
+        args = argparse.Namespace(categories=3, products=20, users=3, requests=1)
+        results = report.collect(args)
+        baseline = json.loads(report.BASELINE.read_text())
+        self.assertLessEqual(set(baseline['results']), set(results))
+        self.assertTrue(all(result['value'] >= 0 for result in results.values()))
@@ -0,0 +1,57 @@
+"""
+大表的后台管理
+
+Django admin 默认每次打开列表都要 COUNT(*) 两次(筛选后的数量和总数), 几十万行的表上这两条查询比列表本身还慢;
+LargeTableAdmin 不再统计总数, 未筛选的列表用估计的行数分页, 筛选后的列表仍然精确统计(一般能走索引)。
+"""
+from django.conf import settings
+from django.contrib import admin
+from django.core.paginator import Paginator
+from django.db.models import Q
+from django.utils.functional import cached_property
+
+from .db import estimated_count
+from .models import Job
+
+
+def prefix_q(field, prefix):
+    """字段以 prefix 开头, 写成范围查询, 可以走普通的 B 树索引(LIKE 'x%' 在不区分大小写时用不上索引)"""
+    return Q(**{f'{field}__gte': prefix, f'{field}__lt': prefix + '\U0010ffff'})
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    未筛选的大表用估计的行数分页
+
+    估计值不超过 ADMIN_ESTIMATED_COUNT_THRESHOLD 时仍然精确统计, 小表的页码总是准确的。
+    ! 估计值偏大时最后几页可能是空的, 翻页和排序都不受影响。
+    """
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        if not queryset.query.where:
+            estimate = estimated_count(queryset.model, queryset.db)
+            if estimate is not None and estimate > settings.ADMIN_ESTIMATED_COUNT_THRESHOLD:
+                return estimate
+        return queryset.count()
+
+
+class LargeTableAdmin:
+    """大表 ModelAdmin 的公共设置, 放在 admin.ModelAdmin 前面"""
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False  # * 搜索/筛选后不再额外统计总数
+
+
+@admin.register(Job)
+class JobAdmin(LargeTableAdmin, admin.ModelAdmin):
+    """后台任务只读, 状态都由 worker 维护"""
+    list_display = ('id', 'name', 'status', 'attempts', 'max_attempts', 'run_at', 'locked_by', 'finished_at')
+    list_filter = ('status',)   # 走 job_claim_idx
+    sortable_by = ('id',)
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
@@ -0,0 +1,14 @@
+from django.apps import AppConfig
+
+
+class CoreConfig(AppConfig):
+    default_auto_field = 'django.db.models.BigAutoField'
+    name = 'core'
+    verbose_name = '公共组件'
+
+    def ready(self):
+        from django.conf import settings
+        from . import instrumentation
+
+        if settings.INSTRUMENTATION['ENABLED']:
+            instrumentation.install()
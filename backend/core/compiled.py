@@ -0,0 +1,152 @@
+"""
+编译后的只读序列化器
+
+DRF 的 ModelSerializer 对每一行都要构造模型实例, 再逐个字段 get_attribute -> to_representation。
+列表接口只读, 这里把序列化器的字段提前"编译"成 (输出键, .values() 里的键, 转换函数) 的列表,
+查询时直接取 .values() 的 dict 行, 每个字段只做一次字典查找和必要的转换, 输出与原序列化器完全一致。
+
+支持的字段: 普通模型字段、文件/图片字段(输出绝对 URL)、嵌套的只读单个序列化器(外键或反向一对一)、
+外键主键字段, 以及在序列化器上定义了 batch_<字段名>(rows, context) 的 SerializerMethodField;
+其余字段在编译时直接报错, 不会悄悄输出不一致的数据。
+"""
+from django.core.exceptions import FieldDoesNotExist, ImproperlyConfigured
+from django.db import models
+from rest_framework import serializers
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+
+from . import instrumentation
+
+# .values() 得到的值与 to_representation 的输出相同, 不需要再转换的字段
+IDENTITY_FIELDS = (serializers.CharField, serializers.IntegerField, serializers.BooleanField)
+
+
+class CompiledSerializer:
+    """
+    把只读的 ModelSerializer 编译成针对 .values() 行的转换计划
+
+    每个请求编译一次(转换函数里会用到请求生成图片的绝对 URL), 编译的开销与行数无关。
+    """
+
+    def __init__(self, serializer_class, context, prefix=''):
+        serializer = serializer_class(context=context)
+        self.serializer_class = serializer_class
+        self.context = context
+        self.model = serializer_class.Meta.model
+        self.pk_key = prefix + self.model._meta.pk.attname
+        self.value_fields = [self.pk_key]
+        self.plan = []      # [(输出键, .values() 里的键, 转换函数或 None, 嵌套的 CompiledSerializer 或 None)]
+        self.batch = []     # [(输出键, batch 函数)], 整页一起计算
+        for name, field in serializer.fields.items():
+            if not field.write_only:
+                self.compile_field(name, field, prefix)
+        if self.batch:
+            for key in getattr(serializer_class, 'batch_value_fields', []):
+                self.add_value_field(prefix + key)
+
+    def add_value_field(self, key):
+        if key not in self.value_fields:
+            self.value_fields.append(key)
+
+    def compile_field(self, name, field, prefix):
+        if isinstance(field, serializers.SerializerMethodField):
+            resolve = getattr(self.serializer_class, f'batch_{name}', None)
+            if resolve is None:
+                raise ImproperlyConfigured(f'{self.serializer_class.__name__}.{name} 需要定义 batch_{name} 才能编译')
+            self.plan.append((name, None, None, None))
+            self.batch.append((name, resolve))
+            return
+        if len(field.source_attrs) != 1:
+            raise ImproperlyConfigured(f'{self.serializer_class.__name__}.{name}: 不支持 source="{field.source}"')
+        try:
+            model_field = self.model._meta.get_field(field.source)
+        except FieldDoesNotExist:
+            raise ImproperlyConfigured(f'{self.serializer_class.__name__}.{name} 不是模型字段, 无法编译')
+
+        key = prefix + field.source
+        if isinstance(field, serializers.BaseSerializer):
+            if isinstance(field, serializers.ListSerializer):
+                raise ImproperlyConfigured(f'{self.serializer_class.__name__}.{name}: 不支持 many=True 的嵌套序列化器')
+            nested = CompiledSerializer(type(field), self.context, prefix=key + '__')
+            for value_field in nested.value_fields:
+                self.add_value_field(value_field)
+            # 关联对象不存在时 DRF 输出 None, 用关联对象的主键判断
+            self.plan.append((name, nested.pk_key, None, nested))
+            return
+        if isinstance(field, serializers.PrimaryKeyRelatedField):
+            converter = None    # .values() 里外键字段本身就是主键
+        elif isinstance(field, serializers.RelatedField):
+            raise ImproperlyConfigured(f'{self.serializer_class.__name__}.{name}: 不支持 {type(field).__name__}')
+        elif isinstance(field, serializers.FileField):
+            converter = self.file_converter(field, model_field)
+        elif isinstance(field, IDENTITY_FIELDS) and not isinstance(model_field, models.ForeignKey):
+            converter = None
+        else:
+            converter = field.to_representation     # Decimal、日期时间、JSON 等, 直接复用字段自己的转换
+        self.add_value_field(key)
+        self.plan.append((name, key, converter, None))
+
+    def file_converter(self, field, model_field):
+        """与 FileField.to_representation 一致, 只是输入是文件名而不是 FieldFile"""
+        storage = model_field.storage
+        request = self.context.get('request')
+        if not getattr(field, 'use_url', api_settings.UPLOADED_FILES_USE_URL):
+            return lambda name: name or None
+
+        def convert(name):
+            if not name:
+                return None
+            url = storage.url(name)
+            return request.build_absolute_uri(url) if request is not None else url
+        return convert
+
+    def values(self, queryset):
+        """
+        把 queryset 转成只取需要字段的 .values() 查询
+
+        排序用到的字段和 extra select(例如搜索相关度)也一并保留, 游标分页要用它们生成下一页的游标。
+        """
+        ordering = [name.lstrip('-') for name in queryset.query.order_by if isinstance(name, str) and name != '?']
+        fields = dict.fromkeys([*self.value_fields, *ordering, *queryset.query.extra_select])
+        return queryset.prefetch_related(None).values(*fields)
+
+    def to_representation(self, row, batched=None):
+        data = {}
+        for name, key, converter, nested in self.plan:
+            if key is None:
+                data[name] = batched[name][row[self.pk_key]]
+                continue
+            value = row[key]
+            if value is None:
+                data[name] = None
+            elif nested is not None:
+                data[name] = nested.to_representation(row)
+            else:
+                data[name] = value if converter is None else converter(value)
+        return data
+
+    def serialize(self, rows):
+        # * 不经过 BaseSerializer.data, 请求埋点的序列化耗时在这里单独记录
+        with instrumentation.timing_serializer(instrumentation.current()):
+            rows = list(rows)
+            batched = {name: resolve(rows, self.context) for name, resolve in self.batch}
+            return [self.to_representation(row, batched) for row in rows]
+
+
+class CompiledListMixin:
+    """
+    list 接口使用 CompiledSerializer, 输出与 serializer_class 完全一致
+
+    分页、过滤、排序都沿用视图原来的配置, 分页器拿到的是 dict 行而不是模型实例。
+    """
+    compiled_list = True    # 关闭后退回 DRF 原来的序列化流程
+
+    def list(self, request, *args, **kwargs):
+        if not self.compiled_list:
+            return super().list(request, *args, **kwargs)
+        compiled = CompiledSerializer(self.get_serializer_class(), self.get_serializer_context())
+        queryset = compiled.values(self.filter_queryset(self.get_queryset()))
+        page = self.paginate_queryset(queryset)
+        if page is not None:
+            return self.get_paginated_response(compiled.serialize(page))
+        return Response(compiled.serialize(queryset))
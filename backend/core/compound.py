@@ -0,0 +1,96 @@
+"""
+复合请求: 一次 HTTP 请求执行多个只读子请求
+
+    POST /api/batch/
+    {"requests": [{"id": "products", "path": "/api/products/?category=3"},
+                  {"id": "me", "path": "/api/users/me/"}]}
+
+    -> {"responses": [{"id": "products", "status": 200, "body": {...}}, {"id": "me", "status": 200, "body": {...}}]}
+
+客户端启动时要同时拉取商品、分类和当前用户资料, 合并成一次往返。子请求在当前线程里直接调用目标视图,
+复用同一个数据库连接, 认证只在外层做一次(子请求通过 DRF 的强制认证拿到同一个用户和令牌), 权限、节流、缓存仍由各个视图自己处理。
+
+! 子请求不经过中间件, 指标里只记为一次 /api/batch/ 请求; 只支持 GET, 也不能嵌套复合请求。
+! 子请求去掉了 If-None-Match 等条件请求头, 复合响应里总是完整的数据。
+"""
+import copy
+import json
+from urllib.parse import urlsplit
+
+from asgiref.sync import async_to_sync, iscoroutinefunction
+from django.core.exceptions import PermissionDenied
+from django.http import Http404, QueryDict
+from django.urls import Resolver404, resolve
+from django.utils.datastructures import MultiValueDict
+from rest_framework.response import Response
+
+# 不带到子请求里的请求头: 请求体相关的, 以及会让子请求返回 304 的条件请求头
+DROPPED_META_PREFIXES = ('CONTENT_', 'HTTP_IF_')
+
+
+class CompoundRequestError(ValueError):
+    """子请求不合法(不是本站路径、嵌套复合请求或流式响应), 这一项返回 400"""
+
+
+def sub_request(request, path):
+    """
+    以外层请求为模板构造 GET 子请求, 返回 (子请求, URL 匹配结果)
+
+    request 是外层的 DRF Request, 子请求保留主机、协议、Cookie 等请求环境, 并带上外层已经认证好的用户和令牌。
+    """
+    url = urlsplit(path)
+    if url.scheme or url.netloc:
+        raise CompoundRequestError('只能请求本站的相对路径.')
+    try:
+        match = resolve(url.path)
+    except Resolver404:
+        raise Http404
+
+    http_request = request._request
+    sub = copy.copy(http_request)
+    sub.META = {key: value for key, value in http_request.META.items() if not key.startswith(DROPPED_META_PREFIXES)}
+    sub.META.update(REQUEST_METHOD='GET', PATH_INFO=url.path, QUERY_STRING=url.query)
+    sub.method = 'GET'
+    sub.path = sub.path_info = url.path
+    sub.GET = QueryDict(url.query)
+    sub._post, sub._files = QueryDict(), MultiValueDict()
+    sub._body = b''
+    sub.resolver_match = match
+    sub.user = request.user
+    if request.user.is_authenticated:
+        # * DRF 看到这两个属性时直接使用, 不会再次执行认证(校验令牌签名、查询吊销记录和用户);
+        # 匿名请求照常走认证类, 需要登录的接口才能像直接请求一样返回 401 和 WWW-Authenticate
+        sub._force_auth_user, sub._force_auth_token = request.user, request.auth
+    return sub, match
+
+
+def response_body(response):
+    if isinstance(response, Response):
+        return response.data
+    if response.streaming:
+        raise CompoundRequestError('不支持流式响应.')
+    if not response.content:
+        return None
+    if response.get('Content-Type', '').startswith('application/json'):
+        return json.loads(response.content)
+    return response.content.decode(response.charset)
+
+
+def dispatch(request, path, compound_view):
+    """执行一个子请求, 返回 (状态码, 响应数据)"""
+    try:
+        sub, match = sub_request(request, path)
+        if getattr(match.func, 'view_class', None) is compound_view:
+            raise CompoundRequestError('不能嵌套复合请求.')
+        view = match.func
+        if iscoroutinefunction(view):
+            # * 异步视图里的 ORM 调用会回到当前线程执行, 仍然使用同一个数据库连接
+            view = async_to_sync(view)
+        response = view(sub, *match.args, **match.kwargs)
+        return response.status_code, response_body(response)
+    except CompoundRequestError as exc:
+        return 400, {'detail': str(exc)}
+    except Http404:
+        return 404, {'detail': 'Not found.'}
+    except PermissionDenied:
+        return 403, {'detail': 'You do not have permission to perform this action.'}
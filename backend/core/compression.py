@@ -0,0 +1,124 @@
+"""
+HTTP 压缩: Accept-Encoding 协商、gzip/brotli 压缩器和媒体文件的预压缩
+
+brotli 是可选依赖, 没有安装时只使用 gzip。
+"""
+import gzip
+import zlib
+
+from django.conf import settings
+
+try:
+    import brotli
+except ImportError:     # brotli 是可选依赖, 没有安装时只提供 gzip
+    brotli = None
+
+# 可以压缩的内容类型, 图片(SVG 除外)、视频、压缩包等本身已经压缩过, 再压缩只浪费 CPU
+COMPRESSIBLE_TYPES = ('text/', 'application/json', 'application/x-ndjson', 'application/javascript', 'application/xml',
+                      'image/svg+xml', 'image/bmp', 'image/x-icon', 'image/tiff')
+
+# 预压缩文件的后缀
+SUFFIXES = {'br': '.br', 'gzip': '.gz'}
+
+
+def available_encodings():
+    """服务器支持的编码, 按优先顺序排列"""
+    return ['br', 'gzip'] if brotli is not None else ['gzip']
+
+
+def is_compressible(content_type):
+    content_type = (content_type or '').split(';')[0].strip().lower()
+    return content_type.startswith(COMPRESSIBLE_TYPES)
+
+
+def is_html(content_type):
+    return (content_type or '').split(';')[0].strip().lower() == 'text/html'
+
+
+def negotiate(accept_encoding, encodings=None):
+    """
+    根据 Accept-Encoding 从 encodings(默认为服务器支持的全部编码)里选一个, 客户端都不接受时返回 None
+
+    客户端给出的 q 值最高的编码优先, q 值相同时按服务器的优先顺序; q=0 表示拒绝, * 匹配没有单独列出的编码。
+    """
+    weights = {}
+    for part in (accept_encoding or '').split(','):
+        coding, *params = [item.strip() for item in part.split(';')]
+        if not coding:
+            continue
+        quality = 1.0
+        for param in params:
+            if param.startswith('q='):
+                try:
+                    quality = float(param[2:])
+                except ValueError:
+                    quality = 0.0
+        weights[coding.lower()] = quality
+    candidates = [
+        (weights.get(encoding, weights.get('*', 0.0)), -index, encoding)
+        for index, encoding in enumerate(available_encodings() if encodings is None else encodings)
+    ]
+    quality, _, encoding = max(candidates, default=(0.0, 0, None))
+    return encoding if quality > 0 else None
+
+
+class Compressor:
+    """增量压缩器, compress() 返回已经可以输出的压缩数据(可能为空), finish() 返回剩余的数据"""
+
+    def __init__(self, encoding):
+        config = settings.COMPRESSION
+        self.encoding = encoding
+        if encoding == 'br':
+            self._compressor = brotli.Compressor(quality=config['BROTLI_QUALITY'])
+            self._compress, self._finish = self._compressor.process, self._compressor.finish
+        else:
+            # wbits=31 输出带 gzip 头和尾的数据
+            self._compressor = zlib.compressobj(config['GZIP_LEVEL'], zlib.DEFLATED, 31)
+            self._compress, self._finish = self._compressor.compress, self._compressor.flush
+
+    def compress(self, data):
+        return self._compress(data)
+
+    def finish(self):
+        return self._finish()
+
+
+def compress(data, encoding):
+    compressor = Compressor(encoding)
+    return compressor.compress(data) + compressor.finish()
+
+
+def compress_stream(chunks, encoding):
+    """
+    压缩流式响应, 逐块输出
+
+    * 压缩器攒够一个块才会输出, 小块(例如逐行导出的 CSV)合并后再发送, 内存占用与响应大小无关。
+    """
+    compressor = Compressor(encoding)
+    for chunk in chunks:
+        data = compressor.compress(chunk if isinstance(chunk, bytes) else bytes(chunk))
+        if data:
+            yield data
+    yield compressor.finish()
+
+
+async def acompress_stream(chunks, encoding):
+    """compress_stream 的异步版本, 用于 ASGI 下的异步流式响应"""
+    compressor = Compressor(encoding)
+    async for chunk in chunks:
+        data = compressor.compress(chunk if isinstance(chunk, bytes) else bytes(chunk))
+        if data:
+            yield data
+    yield compressor.finish()
+
+
+def precompressed_variants(data):
+    """
+    媒体文件的预压缩版本 {编码: 数据}, 只保留至少节省 10% 的编码
+
+    预压缩只发生在上传时, 可以使用最高的压缩级别。
+    """
+    variants = {'gzip': gzip.compress(data, compresslevel=9, mtime=0)}
+    if brotli is not None:
+        variants['br'] = brotli.compress(data, quality=11)
+    return {encoding: compressed for encoding, compressed in variants.items() if len(compressed) <= len(data) * 0.9}
@@ -0,0 +1,131 @@
+"""
+只读副本路由
+
+settings 里配置了只读副本(DB_REPLICA_HOSTS)时, 在 read_from_replicas() 范围内执行的查询会随机发到某个只读副本,
+其余读写仍然走 default。路由只看上下文, 不关心是哪个视图, 需要走副本的视图用 ReplicaReadMixin 标记。
+
+另外提供 SQLite 写锁冲突时重试事务的 retry_on_lock, 以及不扫描全表的行数估计 estimated_count。
+"""
+import random
+import time
+from contextlib import contextmanager
+from functools import wraps
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction
+from django.conf import settings
+from django.db import OperationalError, connections, models
+from django.db.models import Max
+from rest_framework.permissions import SAFE_METHODS
+
+_use_replicas = ContextVar('use_replicas', default=False)
+
+
+def replica_aliases():
+    return [alias for alias in settings.DATABASES if alias.startswith('replica')]
+
+
+@contextmanager
+def read_from_replicas():
+    """范围内的读查询发到只读副本; contextvars 在线程和协程之间互不影响"""
+    token = _use_replicas.set(True)
+    try:
+        yield
+    finally:
+        _use_replicas.reset(token)
+
+
+def replica_reads(view):
+    """函数视图的装饰器, 同时支持同步和异步视图"""
+    if iscoroutinefunction(view):
+        @wraps(view)
+        async def async_wrapper(*args, **kwargs):
+            with read_from_replicas():
+                return await view(*args, **kwargs)
+        return async_wrapper
+
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        with read_from_replicas():
+            return view(*args, **kwargs)
+    return wrapper
+
+
+class ReplicaRouter:
+    """只在 read_from_replicas() 范围内把读查询路由到副本, 写操作和迁移只发到 default"""
+
+    def db_for_read(self, model, **hints):
+        if _use_replicas.get():
+            replicas = replica_aliases()
+            if replicas:
+                return random.choice(replicas)
+        return None
+
+    def db_for_write(self, model, **hints):
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True     # 副本与 default 是同一份数据
+
+    def allow_migrate(self, db, app_label, **hints):
+        return db == 'default'
+
+
+class ReplicaReadMixin:
+    """
+    视图的 GET/HEAD/OPTIONS 请求在只读副本上查询
+
+    ! 副本有复制延迟, 只适合允许读到稍旧数据的接口(例如商品目录), 写后立即读自己数据的接口不要使用。
+    """
+
+    def dispatch(self, request, *args, **kwargs):
+        if request.method not in SAFE_METHODS:
+            return super().dispatch(request, *args, **kwargs)
+        with read_from_replicas():
+            return super().dispatch(request, *args, **kwargs)
+
+
+def retry_on_lock(func, attempts=10, delay=0.005):
+    """
+    SQLite 写锁冲突时("database is locked"/"table is locked") 退避重试整个事务
+
+    文件数据库上 busy timeout 会先等待写锁, 这里主要兜底共享缓存的内存数据库(测试)等不支持等待的情况;
+    退避时间带随机抖动, 避免同时失败的事务又同时重试。
+    """
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        for attempt in range(attempts):
+            try:
+                return func(*args, **kwargs)
+            except OperationalError as exc:
+                if 'locked' not in str(exc) or attempt == attempts - 1:
+                    raise
+                time.sleep(delay * (2 ** attempt) * random.uniform(0.5, 1.5))
+    return wrapper
+
+
+def estimated_count(model, using='default'):
+    """
+    不扫描全表估计表的行数, 数据库不支持时返回 None
+
+    PostgreSQL 读 pg_class.reltuples, MySQL 读 information_schema(都由 ANALYZE/自动统计维护);
+    SQLite 没有行数统计, 用自增主键的最大值代替, 只走一次主键索引, 有删除时会偏大。
+    """
+    connection = connections[using]
+    table = model._meta.db_table
+    if connection.vendor == 'postgresql':
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT reltuples::bigint FROM pg_class WHERE oid = to_regclass(%s)', [table])
+            row = cursor.fetchone()
+        # ! 从没 ANALYZE 过的表 reltuples 为 -1
+        return row[0] if row and row[0] >= 0 else None
+    if connection.vendor == 'mysql':
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'SELECT TABLE_ROWS FROM information_schema.TABLES WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s', [table],
+            )
+            row = cursor.fetchone()
+        return row[0] if row else None
+    if connection.vendor == 'sqlite' and isinstance(model._meta.pk, models.AutoField):
+        return model._default_manager.using(using).aggregate(last=Max('pk'))['last'] or 0
+    return None
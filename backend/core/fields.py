@@ -0,0 +1,25 @@
+from rest_framework import serializers
+
+
+class ImageVariantsField(serializers.Field):
+    """
+    把模型中记录的衍生图路径输出为 {尺寸: {格式: URL}} 的映射, 客户端据此拼出 srcset
+
+    衍生图还没有生成时输出空字典, 客户端回退使用原图。
+    """
+
+    def __init__(self, image_field, **kwargs):
+        self.image_field = image_field  # 衍生图对应的图片字段, 用它的 storage 生成 URL
+        kwargs['read_only'] = True
+        super().__init__(**kwargs)
+
+    def to_representation(self, value):
+        storage = self.parent.Meta.model._meta.get_field(self.image_field).storage
+        request = self.context.get('request')
+        urls = {}
+        for size_name, formats in (value or {}).get('variants', {}).items():
+            urls[size_name] = {}
+            for fmt, name in formats.items():
+                url = storage.url(name)
+                urls[size_name][fmt] = request.build_absolute_uri(url) if request else url
+        return urls
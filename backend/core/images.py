@@ -0,0 +1,88 @@
+import os
+from io import BytesIO
+
+from django.apps import apps
+from django.conf import settings
+from PIL import Image, ImageOps, features
+
+from . import jobs
+from .media import save_content_addressed
+
+# * 各格式的保存参数, 不支持的格式(例如 Pillow 编译时没有 libavif)会被自动跳过
+FORMAT_OPTIONS = {
+    'webp': {'format': 'WEBP', 'quality': 80, 'method': 4},
+    'avif': {'format': 'AVIF', 'quality': 60},
+    'jpeg': {'format': 'JPEG', 'quality': 82, 'optimize': True, 'progressive': True},
+}
+
+def supported_formats():
+    return [fmt for fmt in settings.IMAGE_VARIANT_FORMATS if fmt == 'jpeg' or features.check(fmt)]
+
+
+def variant_name(source_name, size_name, fmt):
+    """products/abc.jpg -> products/variants/abc_thumb.webp, 保存时文件名会换成内容的摘要"""
+    directory, filename = os.path.split(source_name)
+    stem = os.path.splitext(filename)[0]
+    return os.path.join(directory, 'variants', f'{stem}_{size_name}.{fmt}')
+
+
+def generate_variants(field_file):
+    """
+    生成图片的各尺寸、各格式衍生图, 返回 {'source': 原图, 'variants': {尺寸: {格式: 路径}}}
+
+    thumb 会居中裁剪为固定尺寸, 其他尺寸等比缩放, 不会放大比目标尺寸小的原图。
+    """
+    storage = field_file.storage
+    with field_file.open('rb') as f:
+        original = ImageOps.exif_transpose(Image.open(f))
+        original.load()
+
+    variants = {}
+    for size_name, size in settings.IMAGE_VARIANT_SIZES.items():
+        if size_name == 'thumb':
+            image = ImageOps.fit(original, size, Image.Resampling.LANCZOS)
+        else:
+            image = original.copy()
+            image.thumbnail(size, Image.Resampling.LANCZOS)
+
+        variants[size_name] = {}
+        for fmt in supported_formats():
+            converted = image.convert('RGB') if fmt == 'jpeg' or image.mode not in ('RGB', 'RGBA') else image
+            buffer = BytesIO()
+            converted.save(buffer, **FORMAT_OPTIONS[fmt])
+            # * 衍生图同样按内容命名, 可以被永久缓存; 内容没变时不重复写入
+            variants[size_name][fmt] = save_content_addressed(storage, variant_name(field_file.name, size_name, fmt), buffer.getvalue())
+    return {'source': field_file.name, 'variants': variants}
+
+
+def build_variants(model_label, pk, field_name, variants_field):
+    """
+    生成衍生图并写回模型, 由后台任务 core.tasks.build_image_variants 执行, 失败时由任务队列重试
+
+    ! auto_now 字段(例如 updated_at)一起更新, 按它翻页的增量同步接口才会把衍生图发给已经同步过的客户端。
+    """
+    model = apps.get_model(model_label)
+    instance = model._default_manager.filter(pk=pk).first()
+    if instance is None:
+        return
+    field_file = getattr(instance, field_name)
+    setattr(instance, variants_field, generate_variants(field_file) if field_file else {})
+    touched = [field.name for field in model._meta.concrete_fields if getattr(field, 'auto_now', False)]
+    instance.save(update_fields=[variants_field, *touched])
+
+
+def schedule_variants(instance, field_name, variants_field):
+    """
+    图片字段变化后把生成衍生图加入后台任务队列, 不占用请求线程
+
+    任务执行时读取最新的图片, 所以同一对象排队中的任务只保留一个。
+    """
+    field_file = getattr(instance, field_name)
+    source = field_file.name if field_file else None
+    if (getattr(instance, variants_field) or {}).get('source') == source:
+        return
+    label = instance._meta.label
+    jobs.enqueue(
+        'core.tasks.build_image_variants', key=f'image-variants:{label}:{instance.pk}:{field_name}',
+        model_label=label, pk=instance.pk, field_name=field_name, variants_field=variants_field,
+    )
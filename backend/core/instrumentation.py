@@ -0,0 +1,113 @@
+"""
+请求级性能埋点
+
+被采样的请求在 ContextVar 里保存一个 RequestStats, SQL 执行包装器和序列化计时都往里面记:
+
+- SQL: 每个数据库连接建立时装上 QueryRecorder(execute_wrapper), 只有当前上下文里有 RequestStats 时才计时;
+  contextvars 会跟着 sync_to_async 进入线程, 异步视图里的查询也能记到同一个请求上。
+- 序列化: 包装 BaseSerializer.data, 嵌套的序列化器(例如关联商品)不会重复计时;
+  不经过 .data 的序列化(core.compiled.CompiledSerializer)用 timing_serializer 自己计时。
+
+没有被采样的请求只记录总耗时, 开销是几次 ContextVar 读取。
+"""
+import time
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.db.backends.signals import connection_created
+from rest_framework import serializers
+
+_current = ContextVar('request_stats', default=None)
+
+
+class RequestStats:
+    __slots__ = ('queries', 'sql_time', 'serializer_time', 'serializer_depth', 'statements')
+
+    def __init__(self):
+        self.queries = 0
+        self.sql_time = 0.0
+        self.serializer_time = 0.0
+        self.serializer_depth = 0
+        self.statements = Counter()     # SQL 语句(不含参数) -> 执行次数
+
+    @property
+    def duplicates(self):
+        """同一条 SQL 语句重复执行的次数, 只是参数不同的查询也算重复"""
+        return sum(count - 1 for count in self.statements.values() if count > 1)
+
+
+def start():
+    """开始记录当前请求, 返回 (stats, token), 结束时把 token 交给 finish"""
+    stats = RequestStats()
+    return stats, _current.set(stats)
+
+
+def finish(token):
+    _current.reset(token)
+
+
+def current():
+    return _current.get()
+
+
+class QueryRecorder:
+    """connection.execute_wrappers 里的包装器, 记录查询数、耗时和语句"""
+
+    def __call__(self, execute, sql, params, many, context):
+        stats = _current.get()
+        if stats is None:
+            return execute(sql, params, many, context)
+        start_time = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            stats.sql_time += time.perf_counter() - start_time
+            stats.queries += 1
+            stats.statements[sql] += 1
+
+
+query_recorder = QueryRecorder()
+
+
+def install_query_recorder(sender, connection, **kwargs):
+    if query_recorder not in connection.execute_wrappers:
+        connection.execute_wrappers.append(query_recorder)
+
+
+@contextmanager
+def timing_serializer(stats):
+    """把这段代码的耗时记为序列化耗时, 嵌套时只统计最外层; stats 为 None(请求没有被采样)时什么都不做"""
+    if stats is None:
+        yield
+        return
+    stats.serializer_depth += 1
+    start_time = time.perf_counter()
+    try:
+        yield
+    finally:
+        stats.serializer_depth -= 1
+        if not stats.serializer_depth:
+            stats.serializer_time += time.perf_counter() - start_time
+
+
+def timed_data(data_property):
+    """包装序列化器的 data 属性, 只统计最外层的序列化耗时"""
+
+    def data(serializer):
+        stats = _current.get()
+        if stats is None:
+            return data_property.fget(serializer)
+        with timing_serializer(stats):
+            return data_property.fget(serializer)
+
+    return property(data)
+
+
+def install():
+    """在 CoreConfig.ready() 里调用一次"""
+    connection_created.connect(install_query_recorder, dispatch_uid='core.instrumentation')
+    if not getattr(serializers.BaseSerializer.data.fget, 'instrumented', False):
+        instrumented = timed_data(serializers.BaseSerializer.data)
+        instrumented.fget.instrumented = True
+        serializers.BaseSerializer.data = instrumented
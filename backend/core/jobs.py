@@ -0,0 +1,290 @@
+"""
+基于数据库的后台任务队列
+
+生成衍生图、预热缓存、重建搜索索引、发送邮件等慢操作不放在请求里执行, 而是写入任务表, 由 run_jobs 命令启动的 worker
+在线程池或进程池里执行, 不需要额外的消息队列。
+
+    # products/tasks.py
+    @jobs.task(max_attempts=3)
+    def index_products(ids):
+        ...
+
+    index_products.enqueue(ids=[1, 2, 3])
+    jobs.enqueue('products.tasks.index_products', key='index:1', delay=5, ids=[1])
+
+* 任务与调用方的数据写在同一个事务里: 事务回滚时任务也不存在, worker 只会看到已提交的任务, 不会出现数据还没提交就执行的情况。
+* 同一个 key 同时只有一个排队中的任务, 重复入队直接合并; 已经开始执行的任务不影响新的入队。
+* 失败的任务按指数退避重试, 超过 max_attempts 后标记为失败; worker 退出时没执行完的任务在租约过期后重新排队。
+! 任务至少执行一次(重试、worker 中途退出都会导致重复执行), 任务本身需要是幂等的。
+! 参数只能是可以 JSON 序列化的关键字参数, 传 id 而不是模型实例, 执行时再读取最新的数据。
+
+任务放在各 app 的 tasks 模块里, worker 启动时自动导入。JOBS['EAGER'] 打开时不写入队列, 在事务提交后直接在当前线程执行(测试、脚本)。
+"""
+import logging
+import multiprocessing
+import os
+import random
+import socket
+import time
+import traceback
+import uuid
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, close_old_connections, transaction
+from django.db.models import F
+from django.utils import timezone
+from django.utils.module_loading import autodiscover_modules
+
+from .db import retry_on_lock
+from .models import Job
+
+logger = logging.getLogger(__name__)
+
+_registry = {}
+
+
+class UnknownTask(LookupError):
+    """任务名没有注册"""
+
+
+class Task:
+    def __init__(self, func, name, max_attempts=None):
+        self.func = func
+        self.name = name
+        self.max_attempts = max_attempts
+
+    def __call__(self, *args, **kwargs):
+        return self.func(*args, **kwargs)
+
+    def enqueue(self, *, key=None, delay=0, **kwargs):
+        return enqueue(self.name, key=key, delay=delay, **kwargs)
+
+
+def task(name=None, *, max_attempts=None):
+    """把函数注册为后台任务, 任务名默认为 模块.函数名"""
+    def decorator(func):
+        registered = Task(func, name or f'{func.__module__}.{func.__name__}', max_attempts)
+        _registry[registered.name] = registered
+        return registered
+    return decorator
+
+
+def get_task(name):
+    if name not in _registry:
+        autodiscover_modules('tasks')
+    try:
+        return _registry[name]
+    except KeyError:
+        raise UnknownTask(f'未注册的后台任务: {name}')
+
+
+def enqueue(name, *, key=None, delay=0, **kwargs):
+    """
+    把任务加入队列, 返回 Job; 同一 key 已有排队中的任务时不重复入队, 返回 None
+
+    delay 为延迟执行的秒数, 可以用来合并一段时间内的重复任务(配合 key)。
+    """
+    registered = get_task(name)
+    if settings.JOBS['EAGER']:
+        transaction.on_commit(lambda: run_eagerly(registered, kwargs))
+        return None
+    job = Job(
+        name=name, payload=kwargs, key=key, run_at=timezone.now() + timedelta(seconds=delay),
+        max_attempts=registered.max_attempts or settings.JOBS['MAX_ATTEMPTS'],
+    )
+    if key is None:
+        job.save()
+        return job
+    try:
+        # ! 放在保存点里, 违反唯一约束时不影响调用方的事务
+        with transaction.atomic():
+            job.save()
+    except IntegrityError:
+        return None
+    return job
+
+
+def run_eagerly(registered, kwargs):
+    try:
+        registered.func(**kwargs)
+    except Exception:
+        logger.exception('后台任务执行失败: %s', registered.name)
+
+
+def backoff(attempts):
+    """第 n 次失败后等待 BACKOFF_BASE * 2^(n-1) 秒(不超过 BACKOFF_MAX), 乘以 0.5~1 的随机系数, 避免同时失败的任务同时重试"""
+    config = settings.JOBS
+    return min(config['BACKOFF_BASE'] * 2 ** (attempts - 1), config['BACKOFF_MAX']) * random.uniform(0.5, 1)
+
+
+@retry_on_lock
+def claim(worker_id, limit):
+    """领取最多 limit 个到期的任务, 返回任务 id"""
+    now = timezone.now()
+    due = Job.objects.filter(status=Job.QUEUED, run_at__lte=now)
+    # * 先用只读查询判断有没有到期的任务, 空闲轮询时不开启写事务(SQLite 的事务一开始就会占用写锁)
+    if not due.exists():
+        return []
+    with transaction.atomic():
+        # * SQLite 的写事务是 IMMEDIATE 的, 多个 worker 领取时互相排队; 其他数据库上用 SKIP LOCKED 跳过别人正在领取的任务
+        ids = list(
+            Job.objects.select_for_update(skip_locked=True)
+            .filter(pk__in=due.order_by('run_at', 'id').values('id')[:limit]).values_list('id', flat=True)
+        )
+        if ids:
+            Job.objects.filter(pk__in=ids).update(
+                status=Job.RUNNING, locked_by=worker_id, locked_at=now, attempts=F('attempts') + 1,
+            )
+    return ids
+
+
+@retry_on_lock
+def retry_or_fail(job, worker_id, error):
+    """执行失败: 还有重试次数时按退避时间重新排队, 否则标记为失败"""
+    now = timezone.now()
+    mine = Job.objects.filter(pk=job.pk, status=Job.RUNNING, locked_by=worker_id)
+    if job.attempts < job.max_attempts:
+        try:
+            with transaction.atomic():
+                mine.update(status=Job.QUEUED, run_at=now + timedelta(seconds=backoff(job.attempts)),
+                            locked_by='', locked_at=None, last_error=error)
+            return
+        except IntegrityError:
+            error = f'{error}\n同一 key 已有排队中的任务, 不再重试'
+    mine.update(status=Job.FAILED, finished_at=now, locked_by='', locked_at=None, last_error=error)
+
+
+@retry_on_lock
+def claimed_job(job_id, worker_id):
+    return Job.objects.filter(pk=job_id, status=Job.RUNNING, locked_by=worker_id).first()
+
+
+@retry_on_lock
+def complete(job, worker_id):
+    Job.objects.filter(pk=job.pk, status=Job.RUNNING, locked_by=worker_id).update(
+        status=Job.DONE, finished_at=timezone.now(), locked_by='', locked_at=None, last_error='',
+    )
+
+
+def execute(job_id, worker_id):
+    """执行一个已领取的任务, 返回是否成功"""
+    job = claimed_job(job_id, worker_id)
+    if job is None:     # 租约已经过期, 任务被重新排队了
+        return False
+    try:
+        get_task(job.name).func(**job.payload)
+    except Exception:
+        logger.exception('后台任务执行失败: %s', job)
+        retry_or_fail(job, worker_id, traceback.format_exc())
+        return False
+    complete(job, worker_id)
+    return True
+
+
+def run_in_pool(job_id, worker_id):
+    """线程池/进程池里执行任务, 执行完关闭过期的数据库连接(与请求结束时一样)"""
+    try:
+        return execute(job_id, worker_id)
+    finally:
+        close_old_connections()
+
+
+def requeue_expired():
+    """租约过期(worker 已经退出)的任务按失败处理: 重新排队或标记为失败, 返回处理的数量"""
+    cutoff = timezone.now() - timedelta(seconds=settings.JOBS['LEASE_SECONDS'])
+    expired = list(Job.objects.filter(status=Job.RUNNING, locked_at__lt=cutoff))
+    for job in expired:
+        retry_or_fail(job, job.locked_by, f'worker {job.locked_by} 没有在租约期内完成任务')
+    return len(expired)
+
+
+def prune():
+    """删除超过 JOBS['RETENTION'] 的已完成任务, 失败的任务保留两倍的时间以便排查, 返回删除的数量"""
+    now = timezone.now()
+    retention = timedelta(seconds=settings.JOBS['RETENTION'])
+    deleted, _ = Job.objects.filter(status=Job.DONE, finished_at__lt=now - retention).delete()
+    failed, _ = Job.objects.filter(status=Job.FAILED, finished_at__lt=now - retention * 2).delete()
+    return deleted + failed
+
+
+def setup_process():
+    """进程池的子进程初始化, 子进程用 spawn 方式启动, 需要重新加载 Django"""
+    import django
+    django.setup()
+
+
+class Worker:
+    """
+    从队列领取任务交给线程池或进程池执行
+
+    线程池适合 I/O 为主的任务(发邮件、请求外部服务), Pillow 缩放图片时也会释放 GIL;
+    纯 Python 的 CPU 密集任务用进程池。
+    """
+
+    def __init__(self, concurrency=None, processes=False, poll_interval=None):
+        config = settings.JOBS
+        self.concurrency = concurrency or config['CONCURRENCY']
+        self.processes = processes
+        self.poll_interval = config['POLL_INTERVAL'] if poll_interval is None else poll_interval
+        self.id = f'{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}'
+        self.stopping = False
+
+    def stop(self, *args):
+        """不再领取新任务, 等正在执行的任务完成后退出"""
+        self.stopping = True
+
+    @retry_on_lock
+    def heartbeat(self):
+        Job.objects.filter(status=Job.RUNNING, locked_by=self.id).update(locked_at=timezone.now())
+
+    def run(self, once=False):
+        """
+        循环领取并执行任务, 返回执行的任务数
+
+        once 为 True 时执行完当前所有到期的任务就退出(定时任务、测试)。
+        """
+        autodiscover_modules('tasks')
+        if self.processes:
+            # ! 用 spawn 而不是 fork 启动子进程, fork 会把打开着的 SQLite 连接带进子进程
+            executor = ProcessPoolExecutor(self.concurrency, mp_context=multiprocessing.get_context('spawn'), initializer=setup_process)
+        else:
+            executor = ThreadPoolExecutor(self.concurrency, thread_name_prefix='jobs')
+        lease = settings.JOBS['LEASE_SECONDS']
+        executed, running = 0, set()
+        last_heartbeat = last_maintenance = 0
+        with executor:
+            while not self.stopping:
+                if time.monotonic() - last_maintenance > lease:
+                    requeue_expired()
+                    prune()
+                    last_maintenance = time.monotonic()
+                if running and time.monotonic() - last_heartbeat > lease / 4:
+                    self.heartbeat()
+                    last_heartbeat = time.monotonic()
+
+                ids = claim(self.id, self.concurrency - len(running)) if len(running) < self.concurrency else []
+                running.update(executor.submit(run_in_pool, pk, self.id) for pk in ids)
+                executed += len(ids)
+                if once and not ids and not running:
+                    break
+                if not ids:
+                    if running:
+                        wait(running, timeout=self.poll_interval, return_when=FIRST_COMPLETED)
+                    else:
+                        time.sleep(self.poll_interval)
+                running = self.collect(running)
+            self.collect(wait(running).done)
+        return executed
+
+    @staticmethod
+    def collect(futures):
+        """返回还没完成的任务; execute 自己处理了任务的异常, 这里只会遇到数据库不可用等意外错误"""
+        pending = set()
+        for future in futures:
+            if not future.done():
+                pending.add(future)
+            elif future.exception() is not None:
+                logger.error('执行后台任务时出错', exc_info=future.exception())
+        return pending
@@ -0,0 +1,22 @@
+import signal
+
+from django.core.management.base import BaseCommand
+
+from core.jobs import Worker
+
+
+class Command(BaseCommand):
+    help = '启动后台任务 worker, 执行 core.jobs 队列里的任务; 收到 SIGTERM/SIGINT 后执行完手上的任务再退出'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--concurrency', type=int, help='并发执行的任务数, 默认为 JOBS["CONCURRENCY"]')
+        parser.add_argument('--processes', action='store_true', help='使用进程池(默认线程池), 适合 CPU 密集的任务')
+        parser.add_argument('--once', action='store_true', help='执行完当前所有到期的任务就退出, 用于定时任务')
+
+    def handle(self, *args, concurrency, processes, once, **options):
+        worker = Worker(concurrency=concurrency, processes=processes)
+        signal.signal(signal.SIGTERM, worker.stop)
+        signal.signal(signal.SIGINT, worker.stop)
+        self.stdout.write(f'worker {worker.id} 已启动, 并发 {worker.concurrency}')
+        executed = worker.run(once=once)
+        self.stdout.write(self.style.SUCCESS(f'执行了 {executed} 个任务'))
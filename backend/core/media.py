@@ -0,0 +1,232 @@
+"""
+内容寻址的媒体文件和媒体文件服务
+
+上传的图片按内容的 SHA-256 命名(products/<32 位十六进制>.jpg), 文件内容变了文件名也一定会变,
+所以可以让浏览器和 CDN 永久缓存(Cache-Control: immutable), 不需要再发条件请求; 同样内容的图片只保存一份。
+可压缩的文件(SVG、BMP 等)上传时顺便写好 .gz/.br 预压缩版本, 请求时按 Accept-Encoding 直接返回, 不在请求里压缩。
+
+serve 负责在应用层提供 MEDIA_ROOT 下的文件: ETag/Last-Modified 条件请求、单段 Range 请求(断点续传、视频拖动),
+响应是 FileResponse, WSGI 服务器提供 wsgi.file_wrapper 时(gunicorn、uWSGI)用 sendfile 零拷贝发送。
+! 前面有 nginx/CDN 时更推荐由它们直接提供 MEDIA_ROOT, 这里的缓存头和预压缩文件同样适用(nginx 的 gzip_static/brotli_static)。
+"""
+import hashlib
+import mimetypes
+import os
+import re
+import stat
+
+from django.conf import settings
+from django.core.exceptions import SuspiciousFileOperation
+from django.core.files.base import ContentFile
+from django.db import models
+from django.db.models.fields.files import ImageFieldFile
+from django.http import FileResponse, Http404, HttpResponse
+from django.utils._os import safe_join
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from django.utils.http import http_date, parse_http_date_safe, quote_etag
+
+from . import compression
+
+DIGEST_LENGTH = 32  # 文件名里 SHA-256 摘要的十六进制位数(128 位)
+CONTENT_ADDRESSED_NAME = re.compile(rf'(?:^|/)(?P<digest>[0-9a-f]{{{DIGEST_LENGTH}}})\.[0-9a-z]+$')
+RANGE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+def content_digest(content):
+    """按块计算文件内容的摘要, 不会把整个文件读进内存"""
+    sha256 = hashlib.sha256()
+    for chunk in content.chunks():
+        sha256.update(chunk)
+    content.seek(0)
+    return sha256.hexdigest()[:DIGEST_LENGTH]
+
+
+def content_name(name, digest):
+    """products/phone.JPG -> products/<digest>.jpg, 保留目录和扩展名"""
+    directory, filename = os.path.split(name)
+    return os.path.join(directory, digest + os.path.splitext(filename)[1].lower())
+
+
+def name_digest(name):
+    """内容寻址文件名里的摘要, 不是内容寻址的文件返回 None"""
+    match = CONTENT_ADDRESSED_NAME.search(name)
+    return match['digest'] if match else None
+
+
+def save_content_addressed(storage, name, data):
+    """按内容命名保存数据, 同样内容的文件已经存在时直接返回它的文件名"""
+    name = content_name(name, hashlib.sha256(data).hexdigest()[:DIGEST_LENGTH])
+    if not storage.exists(name):
+        name = storage.save(name, ContentFile(data))
+        precompress(storage, name, data)
+    return name
+
+
+def precompress(storage, name, data):
+    """为可压缩的文件写入 .gz/.br 预压缩版本, 太小或压缩效果不明显的文件跳过"""
+    if len(data) < settings.MEDIA_SERVING['PRECOMPRESS_MIN_SIZE'] \
+            or not compression.is_compressible(mimetypes.guess_type(name)[0]):
+        return
+    for encoding, compressed in compression.precompressed_variants(data).items():
+        sidecar = name + compression.SUFFIXES[encoding]
+        if not storage.exists(sidecar):
+            storage.save(sidecar, ContentFile(compressed))
+
+
+class ContentAddressedFieldFile(ImageFieldFile):
+
+    def save(self, name, content, save=True):
+        name = content_name(os.path.basename(name), content_digest(content))
+        target = self.field.generate_filename(self.instance, name)
+        if not self.storage.exists(target):
+            super().save(name, content, save)
+            if compression.is_compressible(mimetypes.guess_type(self.name)[0]):
+                precompress(self.storage, self.name, b''.join(content.chunks()))
+            return
+        # * 同样内容的文件已经存在, 直接引用, 不再重复写入
+        self.name = target
+        setattr(self.instance, self.field.attname, self.name)
+        self._committed = True
+        if save:
+            self.instance.save()
+
+    save.alters_data = True
+
+
+class ContentAddressedImageField(models.ImageField):
+    """上传时按内容命名的图片字段, upload_to 只决定目录"""
+    attr_class = ContentAddressedFieldFile
+
+
+class FileRange:
+    """
+    文件中 [当前位置, end) 的一段, 供 FileResponse 发送 206 响应
+
+    保留 fileno(), WSGI 服务器的 sendfile 从文件当前位置开始、按 Content-Length 发送, 仍然是零拷贝。
+    """
+
+    def __init__(self, file, end):
+        self.file = file
+        self.end = end
+
+    def read(self, size=-1):
+        remaining = self.end - self.file.tell()
+        if remaining <= 0:
+            return b''
+        return self.file.read(remaining if size is None or size < 0 else min(size, remaining))
+
+    def tell(self):
+        return self.file.tell()
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        if whence == os.SEEK_END:
+            return self.file.seek(self.end + offset)
+        return self.file.seek(offset, whence)
+
+    def fileno(self):
+        return self.file.fileno()
+
+    def close(self):
+        self.file.close()
+
+
+def parse_range(header, size):
+    """
+    解析 Range 请求头, 返回 (start, end) (end 不包含), 无法满足时返回 False, 不支持或格式不对时返回 None(返回完整文件)
+
+    只支持单个区间, 多个区间按规范可以直接返回完整文件。
+    """
+    match = RANGE.match(header or '')
+    if match is None:
+        return None
+    first, last = match.groups()
+    if first:
+        start = int(first)
+        end = min(int(last) + 1, size) if last else size
+        if last and int(last) < start:
+            return None
+    elif last:
+        start, end = max(size - int(last), 0), size
+        if not int(last):
+            return False
+    else:
+        return None
+    return (start, end) if start < size else False
+
+
+def if_range_matches(header, etag, last_modified):
+    """If-Range 只有和当前版本完全一致(强 ETag 或相同的修改时间)时才返回部分内容"""
+    if header is None:
+        return True
+    if header.startswith(('"', 'W/')):
+        return header == etag
+    return parse_http_date_safe(header) == last_modified
+
+
+def add_validators(response, etag, last_modified, immutable):
+    config = settings.MEDIA_SERVING
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(last_modified)
+    if immutable:
+        response['Cache-Control'] = f'public, max-age={config["IMMUTABLE_MAX_AGE"]}, immutable'
+    else:
+        response['Cache-Control'] = f'public, max-age={config["MAX_AGE"]}'
+    return response
+
+
+def serve(request, path):
+    """提供 MEDIA_ROOT 下的文件, 支持条件请求、Range 请求和预压缩版本"""
+    try:
+        fullpath = safe_join(settings.MEDIA_ROOT, path)
+        file_stat = os.stat(fullpath)
+    except (SuspiciousFileOperation, OSError, ValueError):
+        raise Http404
+    if not stat.S_ISREG(file_stat.st_mode):
+        raise Http404
+
+    content_type = mimetypes.guess_type(fullpath)[0] or 'application/octet-stream'
+    digest = name_digest(path)
+    etag = quote_etag(digest) if digest else f'"{file_stat.st_size:x}-{file_stat.st_mtime_ns:x}"'
+    last_modified = int(file_stat.st_mtime)
+    range_header = request.META.get('HTTP_RANGE')
+
+    # * Range 请求按原文件计算区间, 不使用预压缩版本
+    encoding = None
+    compressible = compression.is_compressible(content_type)
+    if compressible and range_header is None:
+        encoding = compression.negotiate(request.META.get('HTTP_ACCEPT_ENCODING'), [
+            encoding for encoding, suffix in compression.SUFFIXES.items() if os.path.isfile(fullpath + suffix)
+        ])
+        if encoding is not None:
+            etag = f'{etag[:-1]}-{encoding}"'   # 不同编码是不同的表示, ETag 也要不同
+
+    def finish(response):
+        if compressible:
+            patch_vary_headers(response, ('Accept-Encoding',))
+        response['Accept-Ranges'] = 'bytes'
+        return add_validators(response, etag, last_modified, digest is not None)
+
+    not_modified = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if not_modified is not None:
+        return finish(not_modified)
+
+    byte_range = None
+    if range_header is not None and if_range_matches(request.META.get('HTTP_IF_RANGE'), etag, last_modified):
+        byte_range = parse_range(range_header, file_stat.st_size)
+    if byte_range is False:
+        response = HttpResponse(status=416)
+        response['Content-Range'] = f'bytes */{file_stat.st_size}'
+        return finish(response)
+
+    file = open(fullpath + compression.SUFFIXES[encoding] if encoding else fullpath, 'rb')
+    if byte_range is not None:
+        start, end = byte_range
+        file.seek(start)
+        response = FileResponse(FileRange(file, end), status=206, content_type=content_type)
+        response['Content-Range'] = f'bytes {start}-{end - 1}/{file_stat.st_size}'
+    else:
+        response = FileResponse(file, content_type=content_type, filename=os.path.basename(fullpath))
+        if encoding is not None:
+            response['Content-Encoding'] = encoding
+    response.block_size = 64 * 1024     # 没有 sendfile 时按 64 KiB 读取
+    return finish(response)
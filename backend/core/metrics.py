@@ -0,0 +1,118 @@
+"""
+进程内的 Prometheus 指标
+
+不依赖 prometheus_client, 只实现这里用到的计数器和直方图, 输出 Prometheus 文本格式(0.0.4)。
+指标保存在当前进程里, 多进程部署(gunicorn 多个 worker)时每个进程分别统计, 需要按实例抓取。
+"""
+import bisect
+import threading
+
+# 请求耗时直方图的桶(秒)
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+def escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{name}="{escape(value)}"' for name, value in labels) + '}'
+
+
+def format_value(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    def __init__(self, name, documentation, labelnames=()):
+        self.name, self.documentation, self.labelnames = name, documentation, labelnames
+        self._values = {}
+
+    def inc(self, labels=(), amount=1):
+        self._values[labels] = self._values.get(labels, 0) + amount
+
+    def collect(self):
+        yield f'# HELP {self.name} {self.documentation}'
+        yield f'# TYPE {self.name} counter'
+        for labels, value in sorted(self._values.items()):
+            yield f'{self.name}{format_labels(zip(self.labelnames, labels))} {format_value(value)}'
+
+
+class Histogram:
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.name, self.documentation, self.labelnames = name, documentation, labelnames
+        self.buckets = tuple(buckets)
+        self._values = {}   # labels -> [每个桶(含 +Inf)的计数..., 总和]
+
+    def observe(self, labels, value):
+        values = self._values.get(labels)
+        if values is None:
+            values = self._values[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+        # * 每个值只计入它落在的那一个桶, 输出时再累加成 Prometheus 要求的累计计数
+        values[bisect.bisect_left(self.buckets, value)] += 1
+        values[-1] += value
+
+    def collect(self):
+        yield f'# HELP {self.name} {self.documentation}'
+        yield f'# TYPE {self.name} histogram'
+        for labels, values in sorted(self._values.items()):
+            pairs = list(zip(self.labelnames, labels))
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), values):
+                cumulative += count
+                le = bound if bound == '+Inf' else format_value(float(bound))
+                yield f'{self.name}_bucket{format_labels(pairs + [("le", le)])} {cumulative}'
+            yield f'{self.name}_count{format_labels(pairs)} {cumulative}'
+            yield f'{self.name}_sum{format_labels(pairs)} {format_value(values[-1])}'
+
+
+class Registry:
+    """所有指标共用一把锁, 每个请求结束时只加锁一次批量更新"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self):
+        with self.lock:
+            lines = [line for metric in self.metrics for line in metric.collect()]
+        return '\n'.join(lines) + '\n'
+
+    def reset(self):
+        with self.lock:
+            for metric in self.metrics:
+                metric._values.clear()
+
+
+registry = Registry()
+
+ENDPOINT_LABELS = ('endpoint', 'method')
+
+request_duration = registry.register(Histogram(
+    'http_request_duration_seconds', '请求总耗时', ENDPOINT_LABELS,
+))
+requests_total = registry.register(Counter(
+    'http_requests_total', '请求数', ENDPOINT_LABELS + ('status',),
+))
+# 以下指标只统计被采样的请求, 用 sampled_requests_total 作为分母
+sampled_requests_total = registry.register(Counter(
+    'http_sampled_requests_total', '被采样记录 SQL/序列化耗时的请求数', ENDPOINT_LABELS,
+))
+db_queries_total = registry.register(Counter(
+    'http_db_queries_total', 'SQL 查询数', ENDPOINT_LABELS,
+))
+db_duplicate_queries_total = registry.register(Counter(
+    'http_db_duplicate_queries_total', '同一请求里重复执行的 SQL(参数不同也算, 通常意味着 N+1 查询)', ENDPOINT_LABELS,
+))
+db_seconds_total = registry.register(Counter(
+    'http_db_seconds_total', 'SQL 总耗时(秒)', ENDPOINT_LABELS,
+))
+serializer_seconds_total = registry.register(Counter(
+    'http_serializer_seconds_total', '序列化总耗时(秒)', ENDPOINT_LABELS,
+))
@@ -0,0 +1,172 @@
+import logging
+import random
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.http import FileResponse
+from django.utils.cache import patch_vary_headers
+from django.utils.text import compress_sequence, compress_string
+
+from . import compression, instrumentation, metrics
+
+logger = logging.getLogger('core.instrumentation')
+
+
+def endpoint_name(request):
+    """指标里的接口名: URL 名称, ViewSet 再加上 action, 例如 product-list:list"""
+    match = request.resolver_match
+    if match is None:
+        return 'unmatched'
+    name = match.view_name or match._func_path
+    action = (getattr(match.func, 'actions', None) or {}).get(request.method.lower())
+    return f'{name}:{action}' if action else name
+
+
+class InstrumentationMiddleware:
+    """
+    记录每个请求的总耗时, 按 INSTRUMENTATION['SAMPLE_RATE'] 采样记录 SQL 和序列化耗时
+
+    被采样的请求会带上 Server-Timing 响应头(INSTRUMENTATION['SERVER_TIMING'] 打开时), 浏览器开发者工具里可以直接看到;
+    同一请求里重复执行的 SQL 超过阈值时记一条警告日志, 用来发现 N+1 查询。
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not settings.INSTRUMENTATION['ENABLED']:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        started = time.perf_counter()
+        stats, token = self.begin()
+        try:
+            response = self.get_response(request)
+        finally:
+            if token is not None:
+                instrumentation.finish(token)
+        return self.record(request, response, stats, time.perf_counter() - started)
+
+    async def __acall__(self, request):
+        started = time.perf_counter()
+        stats, token = self.begin()
+        try:
+            response = await self.get_response(request)
+        finally:
+            if token is not None:
+                instrumentation.finish(token)
+        return self.record(request, response, stats, time.perf_counter() - started)
+
+    def begin(self):
+        if random.random() < settings.INSTRUMENTATION['SAMPLE_RATE']:
+            return instrumentation.start()
+        return None, None
+
+    def record(self, request, response, stats, elapsed):
+        labels = (endpoint_name(request), request.method)
+        with metrics.registry.lock:
+            metrics.request_duration.observe(labels, elapsed)
+            metrics.requests_total.inc(labels + (str(response.status_code),))
+            if stats is not None:
+                metrics.sampled_requests_total.inc(labels)
+                metrics.db_queries_total.inc(labels, stats.queries)
+                metrics.db_duplicate_queries_total.inc(labels, stats.duplicates)
+                metrics.db_seconds_total.inc(labels, stats.sql_time)
+                metrics.serializer_seconds_total.inc(labels, stats.serializer_time)
+        if stats is None:
+            return response
+
+        duplicates = stats.duplicates
+        if duplicates >= settings.INSTRUMENTATION['DUPLICATE_QUERY_WARNING']:
+            statement, count = stats.statements.most_common(1)[0]
+            logger.warning('%s 重复执行了 %d 次 SQL, 最多的一条执行了 %d 次: %s', labels[0], duplicates, count, statement)
+        if settings.INSTRUMENTATION['SERVER_TIMING']:
+            response['Server-Timing'] = ', '.join([
+                f'total;dur={elapsed * 1000:.2f}',
+                f'db;dur={stats.sql_time * 1000:.2f};desc="{stats.queries} queries, {duplicates} duplicated"',
+                f'serializer;dur={stats.serializer_time * 1000:.2f}',
+            ])
+        return response
+
+
+class CompressionMiddleware:
+    """
+    按 Accept-Encoding 压缩响应, 支持 gzip 和 brotli(安装了 brotli 时)
+
+    只压缩文本/JSON 等可压缩的类型; 小于 COMPRESSION['MIN_SIZE'] 或压缩后没有变小的响应原样返回;
+    流式响应(例如商品导出)逐块压缩, 不会把整个响应读进内存。
+    ! HTML 页面(admin、DRF 可浏览 API)里有 CSRF 令牌又会回显查询参数, 只用 gzip 压缩, 并且与 Django 的 GZipMiddleware
+      一样加入随机长度的填充(COMPRESSION['HTML_RANDOM_BYTES']), 防止 BREACH 攻击根据压缩后的长度猜出令牌。
+    ! 已经带 Content-Encoding 的响应、部分内容(206)和 FileResponse 不处理, 媒体文件由 core.media 使用预压缩的版本,
+      FileResponse 保持原样才能使用 sendfile。
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not settings.COMPRESSION['ENABLED']:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        return self.compress(request, self.get_response(request))
+
+    async def __acall__(self, request):
+        return self.compress(request, await self.get_response(request))
+
+    def compress(self, request, response):
+        if response.has_header('Content-Encoding') or response.status_code == 206 or isinstance(response, FileResponse) \
+                or not compression.is_compressible(response.get('Content-Type')):
+            return response
+        if not response.streaming and len(response.content) < settings.COMPRESSION['MIN_SIZE']:
+            return response
+
+        # * 响应内容取决于 Accept-Encoding, 缓存(CDN/浏览器)需要按它区分
+        patch_vary_headers(response, ('Accept-Encoding',))
+        html = compression.is_html(response.get('Content-Type'))
+        encoding = compression.negotiate(request.META.get('HTTP_ACCEPT_ENCODING'), ['gzip'] if html else None)
+        if encoding is None or (html and response.streaming and response.is_async):
+            return response
+
+        if html:
+            max_random_bytes = settings.COMPRESSION['HTML_RANDOM_BYTES']
+            if response.streaming:
+                response.streaming_content = compress_sequence(response.streaming_content, max_random_bytes=max_random_bytes)
+                del response['Content-Length']
+            else:
+                compressed = compress_string(response.content, max_random_bytes=max_random_bytes)
+                if len(compressed) >= len(response.content):
+                    return response
+                response.content = compressed
+                response['Content-Length'] = str(len(compressed))
+        elif response.streaming:
+            if response.is_async:
+                response.streaming_content = compression.acompress_stream(response.streaming_content, encoding)
+            else:
+                response.streaming_content = compression.compress_stream(response.streaming_content, encoding)
+            del response['Content-Length']
+        else:
+            compressed = compression.compress(response.content, encoding)
+            if len(compressed) >= len(response.content):
+                return response
+            response.content = compressed
+            response['Content-Length'] = str(len(compressed))
+
+        # 与 GZipMiddleware 一样把强 ETag 改成弱 ETag, 压缩后的字节与原内容不同; If-None-Match 按弱比较, 仍然可以命中 304
+        etag = response.get('ETag')
+        if etag and etag.startswith('"'):
+            response['ETag'] = 'W/' + etag
+        response['Content-Encoding'] = encoding
+        return response
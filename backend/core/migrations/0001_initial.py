@@ -0,0 +1,38 @@
+# Generated by Django 5.1.15 on 2026-10-18 06:32
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Job',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=200, verbose_name='任务名')),
+                ('payload', models.JSONField(blank=True, default=dict, verbose_name='参数')),
+                ('key', models.CharField(blank=True, max_length=200, null=True, verbose_name='幂等键')),
+                ('status', models.CharField(choices=[('queued', '排队中'), ('running', '执行中'), ('done', '已完成'), ('failed', '失败')], default='queued', max_length=10, verbose_name='状态')),
+                ('run_at', models.DateTimeField(verbose_name='计划执行时间')),
+                ('attempts', models.PositiveSmallIntegerField(default=0, verbose_name='已执行次数')),
+                ('max_attempts', models.PositiveSmallIntegerField(default=5, verbose_name='最多执行次数')),
+                ('locked_by', models.CharField(blank=True, default='', max_length=100, verbose_name='执行的 worker')),
+                ('locked_at', models.DateTimeField(blank=True, null=True, verbose_name='租约时间')),
+                ('last_error', models.TextField(blank=True, default='', verbose_name='最近的错误')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='创建时间')),
+                ('finished_at', models.DateTimeField(blank=True, null=True, verbose_name='结束时间')),
+            ],
+            options={
+                'verbose_name': '后台任务',
+                'verbose_name_plural': '后台任务',
+                'indexes': [models.Index(fields=['status', 'run_at', 'id'], name='job_claim_idx'), models.Index(fields=['status', 'finished_at'], name='job_finished_idx')],
+                'constraints': [models.UniqueConstraint(condition=models.Q(('status', 'queued')), fields=('key',), name='job_queued_key_uniq')],
+            },
+        ),
+    ]
@@ -0,0 +1,44 @@
+from django.db import models
+from django.db.models import Q
+
+
+class Job(models.Model):
+    """
+    后台任务队列(见 core.jobs)
+
+    任务和调用方的数据写在同一个事务里, 由 run_jobs 命令启动的 worker 领取执行。
+    """
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUS_CHOICES = [(QUEUED, '排队中'), (RUNNING, '执行中'), (DONE, '已完成'), (FAILED, '失败')]
+
+    name = models.CharField(max_length=200, verbose_name='任务名')
+    payload = models.JSONField(default=dict, blank=True, verbose_name='参数')
+    key = models.CharField(max_length=200, null=True, blank=True, verbose_name='幂等键') # 同一 key 同时只有一个排队中的任务
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=QUEUED, verbose_name='状态')
+    run_at = models.DateTimeField(verbose_name='计划执行时间') # 延迟执行和失败重试的退避都通过它实现
+    attempts = models.PositiveSmallIntegerField(default=0, verbose_name='已执行次数')
+    max_attempts = models.PositiveSmallIntegerField(default=5, verbose_name='最多执行次数')
+    locked_by = models.CharField(max_length=100, blank=True, default='', verbose_name='执行的 worker')
+    locked_at = models.DateTimeField(null=True, blank=True, verbose_name='租约时间') # worker 定期刷新, 过期说明 worker 已经退出
+    last_error = models.TextField(blank=True, default='', verbose_name='最近的错误')
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name='创建时间')
+    finished_at = models.DateTimeField(null=True, blank=True, verbose_name='结束时间')
+
+    class Meta:
+        verbose_name = '后台任务'
+        verbose_name_plural = verbose_name
+        indexes = [
+            # * worker 领取任务: status='queued' AND run_at <= now ORDER BY run_at, id
+            models.Index(fields=['status', 'run_at', 'id'], name='job_claim_idx'),
+            models.Index(fields=['status', 'finished_at'], name='job_finished_idx'),
+        ]
+        constraints = [
+            # * 幂等键只在排队期间唯一: 重复入队会被合并, 已经开始执行的任务不挡住新的任务
+            models.UniqueConstraint(fields=['key'], condition=Q(status='queued'), name='job_queued_key_uniq'),
+        ]
+
+    def __str__(self):
+        return f'{self.name}#{self.pk}({self.status})'
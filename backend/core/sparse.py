@@ -0,0 +1,120 @@
+"""
+稀疏字段集和按需展开
+
+    ?fields=id,name,price       只输出这些字段
+    ?expand=category            展开嵌套的关联数据
+
+两个参数都不带时输出与原来完全一致, 空值(?fields=)等同于不带。带任意一个时进入稀疏模式: 输出 fields 列出的字段(不带 fields 时为所有普通字段),
+再加上 expand 列出的关联数据; 可展开字段只有出现在 expand 里才会嵌套输出, 有外键列的(例如 category)只列在 fields 里时输出 id。
+视图据此只查询需要的列, 不需要的 JOIN、预取和批量查询都会跳过。
+
+解析结果按 (序列化器, fields, expand) 缓存, 同样的参数组合不会重复解析和校验。
+"""
+from functools import lru_cache
+
+from rest_framework import serializers
+from rest_framework.exceptions import ValidationError
+from rest_framework.permissions import SAFE_METHODS
+
+FIELDS_PARAM = 'fields'
+EXPAND_PARAM = 'expand'
+
+
+class FieldSet:
+    """解析后的字段选择: fields 为按序列化器声明顺序排列的输出字段, collapsed 为只输出 id 的可展开字段"""
+
+    def __init__(self, fields, expand, collapsed):
+        self.fields = fields
+        self.expand = expand
+        self.collapsed = collapsed
+
+    def __contains__(self, name):
+        return name in self.fields
+
+    def columns(self, field_columns):
+        """需要查询的列, field_columns 为 {输出字段: [列, ...]}, 没有列出的字段就是同名的列"""
+        columns = ['id']
+        for name in self.fields:
+            for column in [name] if name in self.collapsed else field_columns.get(name, [name]):
+                if column not in columns:
+                    columns.append(column)
+        return columns
+
+
+def split(value):
+    return [name.strip() for name in value.split(',') if name.strip()] if value else []
+
+
+@lru_cache(maxsize=512)
+def parse(serializer_class, fields_param, expand_param):
+    """解析并校验 fields/expand 参数, 都没有时返回 None(输出全部字段)"""
+    requested, expand = split(fields_param), split(expand_param)
+    # ! 空的 ?fields= 视为没有带, 否则一个字段都不选, 每一项都输出 {}
+    if not requested:
+        fields_param = None
+    if fields_param is None and not expand:
+        return None
+    declared = list(serializer_class().fields)
+    expandable = getattr(serializer_class, 'expandable_fields', {})
+
+    errors = {}
+    unknown = [name for name in requested if name not in declared]
+    if unknown:
+        errors[FIELDS_PARAM] = [f'未知字段: {", ".join(unknown)}.']
+    not_expandable = [name for name in expand if name not in expandable]
+    if not_expandable:
+        errors[EXPAND_PARAM] = [f'不能展开的字段: {", ".join(not_expandable)}.']
+    # ! 没有外键列的可展开字段(例如关联商品)没有 id 形式, 只能通过 expand 输出
+    needs_expand = [name for name in requested if name in expandable and expandable[name] is None and name not in expand]
+    if needs_expand:
+        errors.setdefault(FIELDS_PARAM, []).append(f'请通过 expand 参数展开: {", ".join(needs_expand)}.')
+    if errors:
+        raise ValidationError(errors)
+
+    if fields_param is None:
+        requested = [name for name in declared if name not in expandable]
+    selected = set(requested).union(expand)
+    fields = tuple(name for name in declared if name in selected)
+    collapsed = frozenset(name for name in fields if name in expandable and name not in expand)
+    return FieldSet(fields, frozenset(expand), collapsed)
+
+
+class SparseFieldsMixin:
+    """
+    序列化器根据 context['field_set'] 裁剪字段
+
+    expandable_fields 为 {可展开字段: 未展开时输出 id 用的外键字段名, 没有则为 None}。
+    """
+    expandable_fields = {}
+
+    def get_fields(self):
+        fields = super().get_fields()
+        field_set = self.context.get('field_set')
+        if field_set is None:
+            return fields
+        selected = {}
+        for name in field_set.fields:
+            if name in field_set.collapsed:
+                source = self.expandable_fields[name]
+                kwargs = {'source': source} if source != name else {}
+                selected[name] = serializers.PrimaryKeyRelatedField(read_only=True, **kwargs)
+            else:
+                selected[name] = fields[name]
+        return selected
+
+
+class SparseFieldsViewMixin:
+    """从查询参数解析字段选择并放进序列化器的 context, 只对 GET/HEAD 等只读请求生效"""
+
+    def get_field_set(self):
+        if not hasattr(self, '_field_set'):
+            params = self.request.query_params
+            self._field_set = None if self.request.method not in SAFE_METHODS else parse(
+                self.get_serializer_class(), params.get(FIELDS_PARAM), params.get(EXPAND_PARAM),
+            )
+        return self._field_set
+
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        context['field_set'] = self.get_field_set()
+        return context
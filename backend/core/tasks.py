@@ -0,0 +1,21 @@
+"""core 的后台任务, 由 core.jobs 的 worker 自动导入"""
+from django.conf import settings
+from django.core.mail import send_mail
+
+from . import images, jobs
+
+
+@jobs.task(max_attempts=3)
+def build_image_variants(model_label, pk, field_name, variants_field):
+    """生成上传图片的缩略图和 WebP/AVIF 衍生图"""
+    images.build_variants(model_label, pk, field_name, variants_field)
+
+
+@jobs.task()
+def send_email(subject, message, recipients, html_message=None):
+    """
+    发送邮件, 供账户激活、密码重置等接口使用, 请求里只需要入队, 不用等待 SMTP
+
+    ! 失败重试时可能重复发送, 邮件内容要能承受收到两次(例如同一个重置链接)。
+    """
+    send_mail(subject, message, settings.DEFAULT_FROM_EMAIL, recipients, html_message=html_message)
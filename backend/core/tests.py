@@ -0,0 +1,490 @@
+import datetime
+import gzip
+import os
+import shutil
+import tempfile
+import unittest
+import time
+from io import BytesIO
+from unittest import mock
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import connection
+from django.db import transaction
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils.text import compress_string
+
+from PIL import Image
+from rest_framework.renderers import JSONRenderer
+
+from core import compression, db, instrumentation, jobs, media, renderers
+from core.admin import EstimatedCountPaginator
+from core.compiled import CompiledSerializer
+from core.models import Job
+from core.metrics import registry
+from products.models import ProductCategory, Product
+from users import tokens
+from users.authentication import SignedTokenAuthentication
+
+
+class SQLiteProfileTests(TestCase):
+    """SQLite 配置: 连接建立时执行的 PRAGMA"""
+
+    def test_pragmas_applied_on_connection(self):
+        with connection.cursor() as cursor:
+            cursor.execute('PRAGMA synchronous')
+            self.assertEqual(cursor.fetchone()[0], 1)   # NORMAL
+            cursor.execute('PRAGMA cache_size')
+            self.assertEqual(cursor.fetchone()[0], -32000)
+        self.assertEqual(connection.transaction_mode, 'IMMEDIATE')
+
+
+class ReplicaRouterTests(TestCase):
+    """只读副本路由"""
+
+    @classmethod
+    def setUpTestData(cls):
+        category = ProductCategory.objects.create(name='手机')
+        cls.product = Product.objects.create(name='商品', price=1, category=category)
+
+    def setUp(self):
+        cache.clear()
+
+    def test_reads_use_replicas_only_inside_context(self):
+        router = db.ReplicaRouter()
+        with mock.patch('core.db.replica_aliases', return_value=['replica_0']):
+            self.assertIsNone(router.db_for_read(Product))
+            with db.read_from_replicas():
+                self.assertEqual(router.db_for_read(Product), 'replica_0')
+                self.assertEqual(router.db_for_write(Product), 'default')
+        # 没有配置副本时仍然读 default
+        with db.read_from_replicas():
+            self.assertIsNone(router.db_for_read(Product))
+
+    def test_product_get_requests_read_from_replicas(self):
+        seen = []
+        original = db.ReplicaRouter.db_for_read
+
+        def spy(router, model, **hints):
+            seen.append(db._use_replicas.get())
+            return original(router, model, **hints)
+
+        self.client.force_login(User.objects.create_user('admin', is_staff=True))
+        with mock.patch.object(db.ReplicaRouter, 'db_for_read', spy):
+            self.client.get(reverse('product-list'))
+            self.assertTrue(seen and all(seen))
+            seen.clear()
+            self.client.post(reverse('product-restock', args=[self.product.pk]), {'quantity': 1})
+            self.assertTrue(seen and not any(seen))
+
+
+class InstrumentationTests(TestCase):
+    """请求埋点: Server-Timing 响应头、重复 SQL 检测和 Prometheus 指标"""
+
+    @classmethod
+    def setUpTestData(cls):
+        category = ProductCategory.objects.create(name='手机')
+        Product.objects.bulk_create(Product(name=f'商品 {i}', price=1, category=category) for i in range(3))
+
+    def setUp(self):
+        cache.clear()
+        registry.reset()
+
+    @override_settings(INSTRUMENTATION={**settings.INSTRUMENTATION, 'SERVER_TIMING': True})
+    def test_server_timing_header(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('product-list'))
+        timing = response['Server-Timing']
+        self.assertIn('total;dur=', timing)
+        self.assertIn(f'desc="{len(queries)} queries, 0 duplicated"', timing)
+        serializer_time = float(timing.rsplit('serializer;dur=', 1)[1])
+        self.assertGreater(serializer_time, 0)
+
+    @override_settings(INSTRUMENTATION={**settings.INSTRUMENTATION, 'SERVER_TIMING': True})
+    def test_compiled_list_serialization_is_timed(self):
+        to_representation = CompiledSerializer.to_representation
+
+        def slow(*args, **kwargs):
+            time.sleep(0.01)
+            return to_representation(*args, **kwargs)
+
+        with mock.patch.object(CompiledSerializer, 'to_representation', autospec=True, side_effect=slow):
+            response = self.client.get(reverse('product-list'))
+        # 每个商品至少 10ms, 列表接口不经过 BaseSerializer.data
+        self.assertGreaterEqual(float(response['Server-Timing'].rsplit('serializer;dur=', 1)[1]), 30)
+
+    def test_duplicate_queries_are_flagged(self):
+        stats, token = instrumentation.start()
+        try:
+            for pk in range(3):
+                list(Product.objects.filter(pk=pk))
+            list(ProductCategory.objects.all())
+        finally:
+            instrumentation.finish(token)
+        self.assertEqual(stats.queries, 4)
+        self.assertEqual(stats.duplicates, 2)
+
+    @override_settings(INSTRUMENTATION={**settings.INSTRUMENTATION, 'SAMPLE_RATE': 0, 'SERVER_TIMING': True})
+    def test_unsampled_requests_only_record_latency(self):
+        response = self.client.get(reverse('product-list'))
+        self.assertNotIn('Server-Timing', response)
+        body = self.client.get(reverse('metrics')).content.decode()
+        self.assertIn('http_requests_total{endpoint="product-list:list",method="GET",status="200"} 1', body)
+        self.assertNotIn('http_db_queries_total{endpoint="product-list:list"', body)
+
+    def test_metrics_endpoint(self):
+        self.client.get(reverse('product-list'))
+        self.client.get(reverse('product-detail', args=[0]))
+        response = self.client.get(reverse('metrics'))
+        self.assertTrue(response['Content-Type'].startswith('text/plain; version=0.0.4'))
+        body = response.content.decode()
+        self.assertIn('http_request_duration_seconds_bucket{endpoint="product-list:list",method="GET",le="+Inf"} 1', body)
+        self.assertIn('http_requests_total{endpoint="product-detail:retrieve",method="GET",status="404"} 1', body)
+        self.assertIn('http_db_queries_total{endpoint="product-list:list",method="GET"}', body)
+
+    def test_metrics_forbidden_from_other_addresses(self):
+        self.assertEqual(self.client.get(reverse('metrics'), REMOTE_ADDR='10.0.0.1').status_code, 403)
+
+
+class FastJSONRendererTests(TestCase):
+    """orjson 渲染器的输出与 DRF 的 JSONRenderer 相同"""
+
+    data = {
+        'name': '手机\u2028"引号"', 'price': '1999.00', 'stock': 0, 'on_sale': True, 'sku': None,
+        'created_at': datetime.datetime(2024, 5, 1, 8, 30, 15, 123456),
+        'items': [{'id': 2 ** 70}, []],
+    }
+
+    def test_same_bytes_as_json_renderer(self):
+        data = dict(self.data, items=[{'id': 1}, []])
+        self.assertEqual(renderers.FastJSONRenderer().render(data), JSONRenderer().render(data))
+
+    def test_falls_back_without_orjson_or_on_encode_error(self):
+        expected = JSONRenderer().render(self.data)     # 超出 64 位的整数 orjson 无法编码
+        self.assertEqual(renderers.FastJSONRenderer().render(self.data), expected)
+        with mock.patch.object(renderers, 'orjson', None):
+            self.assertEqual(renderers.FastJSONRenderer().render(self.data), expected)
+
+
+class CompoundRequestTests(TestCase):
+    """复合请求: 一次往返执行多个只读子请求"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('alice', 'alice@example.com', 'correct-horse')
+        category = ProductCategory.objects.create(name='手机')
+        cls.product = Product.objects.create(name='商品', price=1, category=category)
+
+    def setUp(self):
+        cache.clear()
+
+    def compound(self, *paths, **extra):
+        requests = [{'id': index, 'path': path} for index, path in enumerate(paths)]
+        response = self.client.post(reverse('compound'), {'requests': requests}, content_type='application/json', **extra)
+        self.assertEqual(response.status_code, 200, response.content)
+        return [(item['status'], item['body']) for item in response.json()['responses']]
+
+    def test_sub_requests_match_direct_requests(self):
+        self.client.force_login(self.user)
+        paths = ['/api/products/?page_size=5', f'/api/product-categories/{self.product.category_id}/', '/api/users/me/?fields=username']
+        responses = self.compound(*paths)
+        cache.clear()
+        self.assertEqual(responses, [(200, self.client.get(path).json()) for path in paths])
+        self.assertEqual(responses[2][1], {'username': 'alice'})
+
+    def test_authenticates_once(self):
+        access = tokens.issue_tokens(self.user)['access']
+        authenticate = SignedTokenAuthentication.authenticate
+        with mock.patch.object(SignedTokenAuthentication, 'authenticate', autospec=True, side_effect=authenticate) as authenticate:
+            responses = self.compound('/api/users/me/', '/api/users/me/', HTTP_AUTHORIZATION=f'Bearer {access}')
+        self.assertEqual([status for status, _ in responses], [200, 200])
+        self.assertEqual(authenticate.call_count, 1)
+
+    def test_per_item_errors(self):
+        responses = self.compound('/api/users/me/', '/api/nowhere/', '/api/batch/', 'https://example.com/api/products/',
+                                  f'/api/async/products/{self.product.pk}/')
+        self.assertEqual([status for status, _ in responses], [401, 404, 400, 400, 200])
+        self.assertEqual(responses[4][1]['name'], '商品')
+
+    def test_rejects_invalid_payload(self):
+        for payload in ({}, {'requests': []}, {'requests': [{'id': 1}]}, {'requests': [{'path': '/'}] * 21}):
+            with self.subTest(payload=str(payload)[:20]):
+                response = self.client.post(reverse('compound'), payload, content_type='application/json')
+                self.assertEqual(response.status_code, 400)
+
+
+class CompressionTests(TestCase):
+    """响应压缩: Accept-Encoding 协商、流式压缩和弱 ETag"""
+
+    @classmethod
+    def setUpTestData(cls):
+        category = ProductCategory.objects.create(name='手机')
+        Product.objects.bulk_create(
+            Product(name=f'商品 {i}', description='很长的描述' * 20, price=1, category=category) for i in range(10)
+        )
+        cls.admin = User.objects.create_user('admin', is_staff=True)
+
+    def setUp(self):
+        cache.clear()
+
+    def test_negotiate(self):
+        encodings = ['br', 'gzip']
+        self.assertEqual(compression.negotiate('gzip, deflate, br', encodings), 'br')
+        self.assertEqual(compression.negotiate('gzip;q=1.0, br;q=0.5', encodings), 'gzip')
+        self.assertEqual(compression.negotiate('br;q=0, *', encodings), 'gzip')
+        self.assertIsNone(compression.negotiate('identity', encodings))
+        self.assertIsNone(compression.negotiate('', encodings))
+        with mock.patch.object(compression, 'brotli', None):
+            self.assertEqual(compression.negotiate('br, gzip'), 'gzip')
+
+    def test_list_is_gzipped(self):
+        plain = self.client.get(reverse('product-list'))
+        self.assertNotIn('Content-Encoding', plain)
+        self.assertIn('Accept-Encoding', plain['Vary'])
+        cache.clear()
+        response = self.client.get(reverse('product-list'), HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(gzip.decompress(response.content), plain.content)
+        self.assertLess(int(response['Content-Length']), len(plain.content) // 3)
+        # 弱 ETag 仍然可以用于条件请求
+        self.assertTrue(response['ETag'].startswith('W/"'))
+        revalidated = self.client.get(reverse('product-list'), HTTP_ACCEPT_ENCODING='gzip', HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(revalidated.status_code, 304)
+
+    def test_small_responses_are_not_compressed(self):
+        response = self.client.get(reverse('product-detail', args=[0]), HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(response.status_code, 404)
+        self.assertNotIn('Content-Encoding', response)
+
+    def test_streaming_export_is_compressed(self):
+        self.client.force_login(self.admin)
+        plain = b''.join(self.client.get(reverse('product-export')).streaming_content)
+        response = self.client.get(reverse('product-export'), HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(gzip.decompress(b''.join(response.streaming_content)), plain)
+
+    def test_html_is_padded_gzip(self):
+        self.client.force_login(self.admin)
+        url = reverse('product-list') + '?format=api'
+        plain = self.client.get(url, HTTP_ACCEPT_ENCODING='identity')
+        self.assertTrue(plain['Content-Type'].startswith('text/html'))
+        with mock.patch('core.middleware.compress_string', wraps=compress_string) as padded:
+            response = self.client.get(url, HTTP_ACCEPT_ENCODING='br, gzip')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertIn(b'csrfmiddlewaretoken', gzip.decompress(response.content))
+        # * 与 GZipMiddleware 一样加入随机填充
+        self.assertEqual(padded.call_args.kwargs, {'max_random_bytes': settings.COMPRESSION['HTML_RANDOM_BYTES']})
+
+    @unittest.skipIf(compression.brotli is None, '没有安装 brotli')
+    def test_brotli(self):
+        plain = self.client.get(reverse('product-list'))
+        cache.clear()
+        response = self.client.get(reverse('product-list'), HTTP_ACCEPT_ENCODING='gzip, br')
+        self.assertEqual(response['Content-Encoding'], 'br')
+        self.assertEqual(compression.brotli.decompress(response.content), plain.content)
+
+
+class MediaServingTests(TestCase):
+    """内容寻址的上传文件, 以及带缓存头、Range 和预压缩版本的媒体文件服务"""
+
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root, ignore_errors=True)
+        self.enterContext(override_settings(MEDIA_ROOT=self.media_root))
+
+    def make_image(self, name='phone.JPG'):
+        buffer = BytesIO()
+        Image.new('RGB', (64, 64), 'red').save(buffer, 'JPEG')
+        return SimpleUploadedFile(name, buffer.getvalue(), content_type='image/jpeg')
+
+    def get(self, name, **extra):
+        response = self.client.get(settings.MEDIA_URL + name, **extra)
+        body = b''.join(response.streaming_content) if response.streaming else response.content
+        return response, body
+
+    def test_uploads_are_content_addressed_and_deduplicated(self):
+        category = ProductCategory.objects.create(name='手机')
+        first = Product.objects.create(category=category, name='手机', price=1, image=self.make_image())
+        second = Product.objects.create(category=category, name='手机壳', price=1, image=self.make_image('other.jpg'))
+        self.assertRegex(first.image.name, r'^products/[0-9a-f]{32}\.jpg$')
+        self.assertEqual(second.image.name, first.image.name)
+        self.assertEqual(os.listdir(os.path.join(self.media_root, 'products')), [os.path.basename(first.image.name)])
+
+    def test_immutable_cache_headers_and_revalidation(self):
+        name = media.save_content_addressed(default_storage, 'products/a.jpg', b'x' * 100)
+        response, body = self.get(name)
+        self.assertEqual(body, b'x' * 100)
+        self.assertEqual(response['Content-Type'], 'image/jpeg')
+        self.assertIn('immutable', response['Cache-Control'])
+        self.assertEqual(response['ETag'], f'"{media.name_digest(name)}"')
+        self.assertEqual(self.get(name, HTTP_IF_NONE_MATCH=response['ETag'])[0].status_code, 304)
+
+        default_storage.save('products/legacy.jpg', SimpleUploadedFile('legacy.jpg', b'y'))
+        response, _ = self.get('products/legacy.jpg')
+        self.assertEqual(response['Cache-Control'], f'public, max-age={settings.MEDIA_SERVING["MAX_AGE"]}')
+
+    def test_range_requests(self):
+        data = bytes(range(256)) * 4
+        name = media.save_content_addressed(default_storage, 'products/a.jpg', data)
+        response, body = self.get(name, HTTP_RANGE='bytes=10-19')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual((body, response['Content-Length'], response['Content-Range']), (data[10:20], '10', 'bytes 10-19/1024'))
+        self.assertEqual(self.get(name, HTTP_RANGE='bytes=-4')[1], data[-4:])
+        self.assertEqual(self.get(name, HTTP_RANGE='bytes=1000-')[1], data[1000:])
+        self.assertEqual(self.get(name, HTTP_RANGE='bytes=2000-')[0].status_code, 416)
+        # If-Range 不匹配时返回完整文件
+        response, body = self.get(name, HTTP_RANGE='bytes=10-19', HTTP_IF_RANGE='"stale"')
+        self.assertEqual((response.status_code, body), (200, data))
+
+    def test_precompressed_variants(self):
+        svg = b'<svg xmlns="http://www.w3.org/2000/svg">' + b'<rect width="1" height="1"/>' * 200 + b'</svg>'
+        name = media.save_content_addressed(default_storage, 'icons/logo.svg', svg)
+        self.assertTrue(default_storage.exists(name + '.gz'))
+        response, body = self.get(name, HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual((response['Content-Encoding'], response['Content-Type']), ('gzip', 'image/svg+xml'))
+        self.assertEqual(gzip.decompress(body), svg)
+        self.assertIn('Accept-Encoding', response['Vary'])
+        response, body = self.get(name)
+        self.assertNotIn('Content-Encoding', response)
+        self.assertEqual(body, svg)
+        # JPEG 等已经压缩过的格式不预压缩
+        jpeg = media.save_content_addressed(default_storage, 'products/a.jpg', b'x' * 4096)
+        self.assertFalse(default_storage.exists(jpeg + '.gz'))
+
+    def test_rejects_paths_outside_media_root(self):
+        self.assertEqual(self.client.get(settings.MEDIA_URL + '../manage.py').status_code, 404)
+        self.assertEqual(self.client.get(settings.MEDIA_URL + 'products/').status_code, 404)
+
+
+calls = []
+
+
+@jobs.task(name='tests.record', max_attempts=2)
+def record(value, fail=False):
+    calls.append(value)
+    if fail:
+        raise RuntimeError('失败')
+
+
+class JobQueueTests(TestCase):
+    """数据库后台任务队列: 入队、幂等键、重试和租约"""
+
+    def setUp(self):
+        calls.clear()
+
+    def run_job(self, job):
+        self.assertEqual(jobs.claim('w1', 10), [job.pk])
+        jobs.execute(job.pk, 'w1')
+        job.refresh_from_db()
+        return job
+
+    def test_enqueue_is_transactional_and_deduplicated_by_key(self):
+        with self.assertRaises(RuntimeError), transaction.atomic():
+            record.enqueue(value=1)
+            raise RuntimeError
+        self.assertFalse(Job.objects.exists())
+
+        job = record.enqueue(key='k', value=1)
+        self.assertIsNone(record.enqueue(key='k', value=2))
+        self.assertEqual(Job.objects.count(), 1)
+        # 开始执行后可以再次入队
+        self.assertEqual(jobs.claim('w1', 10), [job.pk])
+        self.assertIsNotNone(record.enqueue(key='k', value=3))
+        with self.assertRaises(jobs.UnknownTask):
+            jobs.enqueue('tests.missing')
+
+    def test_success_retry_and_failure(self):
+        job = self.run_job(record.enqueue(value='ok'))
+        self.assertEqual((job.status, job.attempts, calls), (Job.DONE, 1, ['ok']))
+
+        job = self.run_job(record.enqueue(value='bad', fail=True))
+        self.assertEqual((job.status, job.attempts), (Job.QUEUED, 1))
+        self.assertIn('RuntimeError', job.last_error)
+        self.assertGreater(job.run_at, job.created_at)
+        # 退避时间没到之前不会被领取
+        self.assertEqual(jobs.claim('w1', 10), [])
+        Job.objects.filter(pk=job.pk).update(run_at=job.created_at)
+        job = self.run_job(job)
+        self.assertEqual((job.status, job.attempts), (Job.FAILED, 2))
+        self.assertIsNotNone(job.finished_at)
+
+    def test_expired_lease_is_requeued(self):
+        job = record.enqueue(value=1)
+        jobs.claim('w1', 10)
+        Job.objects.filter(pk=job.pk).update(locked_at=job.created_at - datetime.timedelta(hours=1))
+        self.assertEqual(jobs.requeue_expired(), 1)
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.locked_by), (Job.QUEUED, ''))
+        # 旧 worker 之后再提交结果不会生效
+        self.assertFalse(jobs.execute(job.pk, 'w1'))
+        self.assertEqual(calls, [])
+
+    @override_settings(JOBS={**settings.JOBS, 'EAGER': True})
+    def test_eager_mode_runs_after_commit(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertIsNone(record.enqueue(value=1))
+            self.assertEqual(calls, [])
+        self.assertEqual(calls, [1])
+        self.assertFalse(Job.objects.exists())
+
+    @override_settings(CATALOG_CACHE={**settings.CATALOG_CACHE, 'WARM_URLS': ['http://testserver/api/products/']})
+    def test_catalog_changes_schedule_cache_warmup(self):
+        cache.clear()
+        category = ProductCategory.objects.create(name='手机')
+        Product.objects.create(name='商品', price=1, category=category)
+        job = Job.objects.get(name='products.tasks.warm_catalog_cache')
+        self.assertEqual(job.key, 'warm-catalog-cache')
+        Job.objects.filter(pk=job.pk).update(run_at=job.created_at)     # 跳过合并变更的延迟
+        self.run_job(job)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('product-list'))
+        self.assertEqual(len(queries), 0)
+        self.assertEqual(response.json()['results'][0]['name'], '商品')
+
+
+class JobWorkerTests(TransactionTestCase):
+    """worker 在线程池里执行任务"""
+
+    def test_worker_drains_queue(self):
+        calls.clear()
+        for value in range(5):
+            record.enqueue(value=value)
+        record.enqueue(value='bad', fail=True)
+        self.assertEqual(jobs.Worker(concurrency=3, poll_interval=0).run(once=True), 6)
+        self.assertEqual(sorted(calls, key=str), [0, 1, 2, 3, 4, 'bad'])
+        self.assertEqual(Job.objects.filter(status=Job.DONE).count(), 5)
+        self.assertEqual(Job.objects.get(status=Job.QUEUED).attempts, 1)
+
+
+class EstimatedCountPaginatorTests(TestCase):
+    """后台大表分页: 未筛选的列表用估计的行数, 筛选后精确统计"""
+
+    @classmethod
+    def setUpTestData(cls):
+        category = ProductCategory.objects.create(name='手机')
+        for i in range(4):
+            Product.objects.create(category=category, name=f'手机{i}', price=i, is_on_sale=i % 2 == 0)
+        Product.objects.order_by('pk').first().delete()
+
+    def count(self, queryset):
+        with CaptureQueriesContext(connection) as queries:
+            count = EstimatedCountPaginator(queryset, 2).count
+        return count, [query['sql'] for query in queries]
+
+    @override_settings(ADMIN_ESTIMATED_COUNT_THRESHOLD=2)
+    def test_large_table_uses_estimate(self):
+        count, queries = self.count(Product.objects.order_by('-pk'))
+        self.assertEqual(count, Product.objects.order_by('-pk').first().pk)
+        self.assertGreater(count, 3)    # 删掉的那一行还计在估计值里
+        self.assertFalse(any('COUNT(' in sql for sql in queries))
+        self.assertEqual(self.count(Product.objects.filter(is_on_sale=True).order_by('-pk'))[0], 1)
+
+    def test_small_table_counts_exactly(self):
+        self.assertEqual(self.count(Product.objects.order_by('-pk'))[0], 3)
+        self.assertEqual(db.estimated_count(Job), 0)
@@ -0,0 +1,48 @@
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseForbidden
+from django.views.decorators.http import require_GET, require_safe
+from rest_framework import permissions, status
+from rest_framework.response import Response
+from rest_framework.views import APIView
+
+from . import compound, media
+from .metrics import registry
+
+
+@require_GET
+def metrics(request):
+    """Prometheus 抓取接口, 只允许 INSTRUMENTATION['METRICS_ALLOWED_IPS'] 里的地址或管理员访问"""
+    if request.META.get('REMOTE_ADDR') not in settings.INSTRUMENTATION['METRICS_ALLOWED_IPS'] \
+            and not request.user.is_staff:
+        return HttpResponseForbidden()
+    return HttpResponse(registry.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+@require_safe
+def serve_media(request, path):
+    """MEDIA_ROOT 下的文件, 内容寻址的文件带永久缓存头(见 core.media)"""
+    return media.serve(request, path)
+
+
+class CompoundView(APIView):
+    """
+    复合请求, 一次往返执行多个 GET 子请求(见 core.compound)
+
+    子请求按顺序执行, 每一项的状态码和数据单独返回, 某一项失败不影响其他项。
+    """
+    permission_classes = [permissions.AllowAny]     # 权限由各个子请求的视图自己检查
+    max_requests = 20
+
+    def post(self, request):
+        items = request.data.get('requests') if isinstance(request.data, dict) else None
+        if not isinstance(items, list) or not 1 <= len(items) <= self.max_requests \
+                or not all(isinstance(item, dict) and isinstance(item.get('path'), str) for item in items):
+            return Response(
+                {'requests': [f'请提供 1 到 {self.max_requests} 个子请求, 每个子请求包含 path.']},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        responses = []
+        for item in items:
+            status_code, body = compound.dispatch(request, item['path'], type(self))
+            responses.append({'id': item.get('id'), 'status': status_code, 'body': body})
+        return Response({'responses': responses})
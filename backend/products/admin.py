@@ -1,5 +1,93 @@
-from django.contrib import admin
+from django import forms
+from django.contrib import admin, messages
+from django.contrib.admin.helpers import ActionForm
+from django.core.exceptions import ValidationError
+
+from core.admin import LargeTableAdmin, prefix_q
+from . import bulk, stock
 from .models import ProductCategory, Product
+from .search import get_search_backend
+
+
+class ProductActionForm(ActionForm):
+    """批量操作的参数, 显示在操作下拉框旁边"""
+    percent = forms.DecimalField(required=False, max_digits=5, decimal_places=2, min_value=-99, label='调价(%)')
+    quantity = forms.IntegerField(required=False, min_value=1, label='补货数量')
+
+
+@admin.register(ProductCategory)
+class ProductCategoryAdmin(LargeTableAdmin, admin.ModelAdmin):
+    list_display = ('name', 'parent', 'depth', 'product_count', 'on_sale_count', 'updated_at')
+    list_select_related = ('parent',)
+    ordering = ('path',)        # * 按 path 排序即树的先序遍历, 走 category_path_idx
+    sortable_by = ()
+    search_fields = ('name',)   # 商品编辑页的分类自动补全用
+    autocomplete_fields = ('parent',)
+
+
+@admin.register(Product)
+class ProductAdmin(LargeTableAdmin, admin.ModelAdmin):
+    """
+    商品后台
+
+    * 分类用自动补全, 编辑页不会把所有分类渲染进 <select>; 列表按分类筛选也会加载所有分类, 所以只提供促销筛选。
+    * 批量操作都是一条 UPDATE, 不逐个调用 save(), 由 products.bulk/products.stock 手动维护分类商品数和缓存。
+    """
+    list_display = ('id', 'name', 'sku', 'category', 'price', 'stock', 'is_on_sale', 'updated_at')
+    list_select_related = ('category',)
+    list_filter = ('is_on_sale',)
+    sortable_by = ('id', 'price', 'updated_at')     # 只允许按有 (字段, id) 索引的列排序
+    search_fields = ('sku', 'name', 'description')
+    search_help_text = 'SKU 前缀, 或商品名称/描述的全文搜索'
+    autocomplete_fields = ('category',)
+    readonly_fields = ('created_at', 'updated_at')
+    action_form = ProductActionForm
+    actions = ['adjust_price', 'mark_on_sale', 'mark_not_on_sale', 'restock']
+
+    def get_search_results(self, request, queryset, search_term):
+        """
+        先按 SKU 前缀查(唯一索引), 没有命中再交给商品搜索后端(FTS5 全文索引)
+
+        默认实现对每个搜索字段做 icontains, 大表上每次搜索都是全表扫描。
+        """
+        terms = search_term.split()
+        if not terms:
+            return queryset, False
+        by_sku = queryset.filter(prefix_q('sku', search_term.strip()))
+        if by_sku.exists():
+            return by_sku, False
+        return get_search_backend().filter_matches(queryset, terms), False
+
+    def get_action_parameter(self, request, name):
+        """校验批量操作表单里的参数, 没填或不合法时提示并返回 None"""
+        field = self.action_form.base_fields[name]
+        try:
+            value = field.clean(request.POST.get(name))
+        except ValidationError as exc:
+            self.message_user(request, f'{field.label}: {exc.messages[0]}', messages.ERROR)
+            return None
+        if value is None:
+            self.message_user(request, f'请填写{field.label}', messages.ERROR)
+        return value
+
+    @admin.action(description='按百分比调整价格', permissions=['change'])
+    def adjust_price(self, request, queryset):
+        percent = self.get_action_parameter(request, 'percent')
+        if percent is not None:
+            updated = bulk.adjust_prices(queryset, percent)
+            self.message_user(request, f'已调整 {updated} 个商品的价格.', messages.SUCCESS)
+
+    @admin.action(description='设为促销', permissions=['change'])
+    def mark_on_sale(self, request, queryset):
+        self.message_user(request, f'{bulk.set_on_sale(queryset, True)} 个商品设为促销.', messages.SUCCESS)
+
+    @admin.action(description='取消促销', permissions=['change'])
+    def mark_not_on_sale(self, request, queryset):
+        self.message_user(request, f'{bulk.set_on_sale(queryset, False)} 个商品取消促销.', messages.SUCCESS)
 
-admin.site.register(ProductCategory)
-admin.site.register(Product)
\ No newline at end of file
+    @admin.action(description='补货', permissions=['change'])
+    def restock(self, request, queryset):
+        quantity = self.get_action_parameter(request, 'quantity')
+        if quantity is not None:
+            updated = stock.restock_many(queryset, quantity)
+            self.message_user(request, f'已为 {updated} 个商品补货 {quantity} 件.', messages.SUCCESS)
@@ -0,0 +1,100 @@
+"""
+商品目录的 ASGI 原生只读接口
+
+与 ProductViewSet/ProductCategoryViewSet 的 list/retrieve 输出完全一致, 但使用 Django 的异步 ORM
+(acount, aget, async for), 在 ASGI 下不会为每个请求占用一个线程。写操作仍然走原来的 DRF 视图。
+"""
+from asgiref.sync import sync_to_async
+from django.http import HttpResponse
+from django.views.decorators.http import require_GET
+from rest_framework.exceptions import ValidationError
+from rest_framework.request import Request
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+from core.db import replica_reads
+from core.renderers import FastJSONRenderer
+
+from .facets import acompute_facets, facets_requested
+from .models import ProductCategory, Product
+from .related import related_index
+from .serializers import ProductCategorySerializer, ProductSerializer
+from .views import ProductViewSet
+
+
+def json_response(data, status=200):
+    return HttpResponse(FastJSONRenderer().render(data), status=status, content_type='application/json')
+
+
+def not_found(message='Not found.'):
+    return json_response({'detail': message}, status=404)
+
+
+async def serialize_products(products, request, field_set=None):
+    # ! 关联商品需要查询数据库, 先用异步接口取好再交给同步的序列化器; 稀疏字段集没有要关联商品时不查询
+    context = {'request': request, 'field_set': field_set}
+    if field_set is None or 'related_products' in field_set:
+        context['related_products'] = await related_index.aneighbors_for(products)
+    return ProductSerializer(products, many=True, context=context).data
+
+
+@require_GET
+@replica_reads
+async def product_list(request):
+    """商品列表, 支持与 ProductViewSet 相同的搜索、筛选、排序、页码分页、facets 和 fields/expand 参数"""
+    drf_request = Request(request)
+    view = ProductViewSet(request=drf_request, action='list', format_kwarg=None, args=(), kwargs={})
+    try:
+        # * 构造过滤条件时 django-filter 会同步查询一次分类是否存在, 放到线程里执行; 真正的数据查询仍是异步的
+        queryset = await sync_to_async(view.filter_queryset)(view.get_queryset())
+    except ValidationError as exc:
+        return json_response(exc.detail, status=400)
+
+    paginator = view.pagination_class()
+    page_size = paginator.get_page_size(drf_request)
+    try:
+        page_number = int(drf_request.query_params.get(paginator.page_query_param, 1))
+    except ValueError:
+        return not_found('Invalid page.')
+    count = await queryset.acount()
+    last_page = max(1, -(-count // page_size))
+    if not 1 <= page_number <= last_page:
+        return not_found('Invalid page.')
+
+    offset = (page_number - 1) * page_size
+    products = [product async for product in queryset[offset:offset + page_size]]
+
+    url = request.build_absolute_uri()
+    previous = None
+    if page_number > 1:
+        previous = replace_query_param(url, paginator.page_query_param, page_number - 1) if page_number > 2 \
+            else remove_query_param(url, paginator.page_query_param)
+    data = {
+        'count': count,
+        'next': replace_query_param(url, paginator.page_query_param, page_number + 1) if page_number < last_page else None,
+        'previous': previous,
+        'results': await serialize_products(products, request, view.get_field_set()),
+    }
+    if facets_requested(drf_request):
+        data['facets'] = await acompute_facets(queryset)
+    return json_response(data)
+
+
+@require_GET
+@replica_reads
+async def product_detail(request, pk):
+    """商品详情"""
+    view = ProductViewSet(request=Request(request), action='retrieve', format_kwarg=None, args=(), kwargs={'pk': pk})
+    try:
+        product = await view.get_queryset().aget(pk=pk)
+    except ValidationError as exc:
+        return json_response(exc.detail, status=400)
+    except Product.DoesNotExist:
+        return not_found('No Product matches the given query.')
+    return json_response((await serialize_products([product], request, view.get_field_set()))[0])
+
+
+@require_GET
+async def category_list(request):
+    """商品分类列表"""
+    categories = [category async for category in ProductCategory.objects.order_by('path')]
+    return json_response(ProductCategorySerializer(categories, many=True, context={'request': request}).data)
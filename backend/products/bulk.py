@@ -0,0 +1,247 @@
+"""
+商品批量导入/导出和批量修改
+
+导入按流读取 CSV/JSONL, 分批校验后用 bulk_create(update_conflicts=True) 按 sku 插入或更新;
+导出用生成器逐批读取数据库, 配合 StreamingHttpResponse 使用, 不会把整个目录读进内存。
+批量修改(后台的调价、促销)对整个 queryset 执行一条 UPDATE, 不逐个保存商品。
+"""
+import csv
+import io
+import json
+from decimal import Decimal
+from itertools import islice
+
+from django.db import transaction
+from django.db.models import Count, F
+from django.db.models.functions import Round
+from django.utils import timezone
+from rest_framework import serializers
+
+from . import tree
+from .cache import bump_product_versions
+from .models import ProductCategory, Product
+from .related import related_index
+from .search import get_search_backend
+
+# 导入/导出文件的列, category 使用分类名称
+COLUMNS = ['sku', 'name', 'description', 'price', 'stock', 'is_on_sale', 'category']
+# ! 已有商品不覆盖库存: 库存由预留/补货增减(products.stock), 导入的绝对值会冲掉预留中的扣减, 释放预留时库存就多了;
+# ! stock 列只作为新商品的初始库存
+UPDATE_FIELDS = ['name', 'description', 'price', 'is_on_sale', 'category', 'updated_at']
+FORMATS = ['csv', 'jsonl']
+AMBIGUOUS = object()    # 有多个同名分类时 _category_ids 里记录的值
+
+
+class ProductImportRowSerializer(serializers.Serializer):
+    """导入文件中一行商品数据的校验"""
+    sku = serializers.CharField(max_length=64)
+    name = serializers.CharField(max_length=200)
+    description = serializers.CharField(required=False, allow_blank=True, allow_null=True)
+    price = serializers.DecimalField(max_digits=10, decimal_places=2)
+    stock = serializers.IntegerField(required=False, default=0)
+    is_on_sale = serializers.BooleanField(required=False, default=False)
+    category = serializers.CharField(max_length=100)
+
+
+def read_rows(stream, file_format):
+    """
+    把上传的二进制流逐行解析为 (行号, dict), 不会一次性读入整个文件
+
+    行号是文件里的行号(CSV 表头不计), 跳过的空行也计入, 报告里的行号与文件一致。
+    无法解析的行(不是 UTF-8、不是 JSON 对象)产出 {'__error__': 原因}, 在报告里按行记录, 不影响其他行。
+    """
+    # * surrogateescape 让不是 UTF-8 的字节变成代理字符, 解析完再按行检查, 不会在读到一半时抛出异常
+    text = io.TextIOWrapper(stream, encoding='utf-8-sig', errors='surrogateescape', newline='')
+    if file_format == 'csv':
+        reader = csv.DictReader(text)
+        for row in reader:
+            values = [value for value in row.values() if isinstance(value, str)]
+            # * line_num 是已经读到的物理行数(含表头), 减去引号字段里的换行就是这一行开始的位置
+            line = reader.line_num - 1 - sum(value.count('\n') for value in values)
+            if any(is_undecodable(value) for value in values):
+                yield line, {'__error__': '不是有效的 UTF-8 编码'}
+            else:
+                yield line, row
+    elif file_format == 'jsonl':
+        for line, raw in enumerate(text, start=1):
+            if not raw.strip():
+                continue
+            if is_undecodable(raw):
+                yield line, {'__error__': '不是有效的 UTF-8 编码'}
+                continue
+            try:
+                row = json.loads(raw)
+            except json.JSONDecodeError as exc:
+                yield line, {'__error__': f'JSON 解析失败: {exc.msg}'}
+                continue
+            yield line, row if isinstance(row, dict) else {'__error__': '每行必须是一个 JSON 对象'}
+    else:
+        raise ValueError(f'不支持的文件格式: {file_format}')
+
+
+def is_undecodable(text):
+    """surrogateescape 解码后的文本里是否有无法解码的字节"""
+    return any('\udc80' <= char <= '\udcff' for char in text)
+
+
+def guess_format(filename):
+    return 'jsonl' if filename.lower().endswith(('.jsonl', '.ndjson')) else 'csv'
+
+
+class ProductImporter:
+    """
+    分批导入商品
+
+    每批在一个事务里完成: 校验 -> 按名称解析分类(进程内缓存, 每批最多一次查询) -> bulk_create 插入或更新。
+    校验失败的行不会导入, 行号和错误信息记录在返回的报告里。
+    ! 分类名称并不唯一(不同上级分类下可以有同名分类), 有多个同名分类时这一行报错, 不猜测是哪一个。
+    """
+
+    def __init__(self, batch_size=500, create_categories=False):
+        self.batch_size = batch_size
+        self.create_categories = create_categories
+        self._category_ids = {}     # 分类名称 -> id, 有多个同名分类时为 AMBIGUOUS
+
+    def run(self, rows):
+        """rows 为 read_rows 产出的 (行号, dict)"""
+        report = {'processed': 0, 'imported': 0, 'errors': []}
+        rows = iter(rows)
+        while True:
+            batch = list(islice(rows, self.batch_size))
+            if not batch:
+                break
+            imported, errors = self.import_batch(batch)
+            report['processed'] += len(batch)
+            report['imported'] += imported
+            report['errors'].extend(errors)
+        return report
+
+    def import_batch(self, batch):
+        valid, errors = [], []
+        for line, row in batch:
+            if '__error__' in row:
+                errors.append({'row': line, 'errors': {'non_field_errors': [row['__error__']]}})
+                continue
+            # * CSV 里的空单元格按未填写处理, 使用字段默认值
+            serializer = ProductImportRowSerializer(data={key: value for key, value in row.items() if value not in ('', None)})
+            if serializer.is_valid():
+                valid.append((line, serializer.validated_data))
+            else:
+                errors.append({'row': line, 'errors': serializer.errors})
+
+        with transaction.atomic():
+            self.resolve_categories({data['category'] for _, data in valid})
+            products = {}
+            for line, data in valid:
+                category_id = self._category_ids.get(data['category'])
+                if category_id is None:
+                    errors.append({'row': line, 'errors': {'category': [f'分类 "{data["category"]}" 不存在.']}})
+                    continue
+                if category_id is AMBIGUOUS:
+                    errors.append({'row': line, 'errors': {'category': [f'有多个名为 "{data["category"]}" 的分类, 无法确定是哪一个.']}})
+                    continue
+                # * 同一批里重复的 sku 以最后一行为准
+                products[data['sku']] = Product(
+                    sku=data['sku'], name=data['name'], description=data.get('description'),
+                    price=data['price'], stock=data['stock'], is_on_sale=data['is_on_sale'], category_id=category_id,
+                )
+            if products:
+                # 已有商品可能换了分类或促销状态, 旧分类的商品数和缓存也要更新
+                previous = {
+                    sku: (category_id, is_on_sale)
+                    for sku, category_id, is_on_sale in Product.objects.filter(sku__in=products).values_list('sku', 'category_id', 'is_on_sale')
+                }
+                saved = Product.objects.bulk_create(
+                    products.values(), update_conflicts=True, unique_fields=['sku'], update_fields=UPDATE_FIELDS,
+                )
+                self.after_write(saved, previous)
+        errors.sort(key=lambda error: error['row'])
+        return len(products), errors
+
+    def resolve_categories(self, names):
+        missing = [name for name in names if name not in self._category_ids]
+        if not missing:
+            return
+        for name, pk in ProductCategory.objects.filter(name__in=missing).values_list('name', 'id'):
+            self._category_ids[name] = AMBIGUOUS if name in self._category_ids else pk
+        if self.create_categories:
+            new = [name for name in missing if name not in self._category_ids]
+            created = ProductCategory.objects.bulk_create(ProductCategory(name=name) for name in new)
+            tree.assign_root_paths(created)
+            for category in created:
+                self._category_ids[category.name] = category.pk
+
+    @staticmethod
+    def after_write(products, previous):
+        """bulk_create 不会触发模型信号, 手动同步搜索索引、分类商品数和缓存"""
+        get_search_backend().index_many(products)
+        category_ids = tree.update_counts(
+            (previous.get(product.sku), (product.category_id, product.is_on_sale)) for product in products
+        )
+        # ! 整批导入在一个事务里, 提交后再递增缓存版本号
+        transaction.on_commit(lambda: bump_product_versions(*category_ids))
+        transaction.on_commit(related_index.clear)
+
+
+def adjust_prices(queryset, percent):
+    """按百分比调整价格(percent=-10 即打九折), 结果保留两位小数, 返回修改的商品数"""
+    factor = (Decimal(100) + Decimal(percent)) / 100
+    with transaction.atomic():
+        category_ids = set(queryset.order_by().values_list('category_id', flat=True).distinct())
+        updated = queryset.update(price=Round(F('price') * factor, 2), updated_at=timezone.now())
+        after_update(dict.fromkeys(category_ids, (0, 0)))
+    return updated
+
+
+def set_on_sale(queryset, is_on_sale):
+    """批量设置促销状态, 只更新状态真正变化的商品, 返回修改的商品数"""
+    changed = queryset.exclude(is_on_sale=is_on_sale)
+    sign = 1 if is_on_sale else -1
+    with transaction.atomic():
+        # ! 统计和 UPDATE 在同一个事务里; 其他数据库上与并发修改交错导致商品数不准时, 用 rebuild_category_tree 修正
+        counts = changed.order_by().values('category_id').annotate(changed=Count('id')).values_list('category_id', 'changed')
+        deltas = {category_id: (0, sign * count) for category_id, count in counts}
+        updated = changed.update(is_on_sale=is_on_sale, updated_at=timezone.now())
+        after_update(deltas)
+    return updated
+
+
+def after_update(deltas):
+    """
+    update() 不会触发模型信号, 手动更新分类商品数, 并让缓存失效
+
+    价格和促销状态不在搜索索引里, 不需要重建索引; updated_at 由调用方一起更新, 增量同步接口才能看到变化。
+    ! 缓存版本号在事务提交后才递增, 否则并发的读请求可能把提交前的旧数据缓存在新版本号下。
+    """
+    category_ids = tree.shift_counts(deltas)
+    transaction.on_commit(lambda: bump_product_versions(*category_ids))
+    transaction.on_commit(related_index.clear)
+
+
+class Echo:
+    """csv.writer 需要一个带 write 方法的对象, 这里直接把写入的内容返回给生成器"""
+
+    def write(self, value):
+        return value
+
+
+def export_rows(queryset, chunk_size=2000):
+    """逐批读取商品, 生成导出用的 dict"""
+    fields = [column if column != 'category' else 'category__name' for column in COLUMNS]
+    for values in queryset.order_by('id').values_list(*fields).iterator(chunk_size=chunk_size):
+        row = dict(zip(COLUMNS, values))
+        row['price'] = str(row['price'])
+        yield row
+
+
+def stream_export(queryset, file_format, chunk_size=2000):
+    """生成导出文件的内容, 每次产出一行"""
+    rows = export_rows(queryset, chunk_size)
+    if file_format == 'jsonl':
+        for row in rows:
+            yield json.dumps(row, ensure_ascii=False) + '\n'
+    else:
+        writer = csv.writer(Echo())
+        yield writer.writerow(COLUMNS)
+        for row in rows:
+            yield writer.writerow([row[column] for column in COLUMNS])
@@ -0,0 +1,144 @@
+import hashlib
+
+from django.conf import settings
+from django.core.cache import caches
+from django.utils.cache import get_conditional_response
+from django.utils.dateparse import parse_datetime
+from django.utils.http import http_date, quote_etag
+from rest_framework.response import Response
+
+from core import jobs
+
+# * 版本号的缓存键, 版本号变化后旧的响应缓存键自然失效, 不需要逐个删除
+GLOBAL_VERSION = 'catalog:version:global'       # 分类变更, 影响所有商品(嵌套分类)和分类列表
+PRODUCTS_VERSION = 'catalog:version:products'   # 任意商品变更
+CATEGORY_VERSION = 'catalog:version:category:{}'  # 某个分类下的商品变更
+
+
+def get_catalog_cache():
+    """目录缓存使用的缓存后端, 通过 CATALOG_CACHE['ALIAS'] 切换到 Redis 等共享缓存"""
+    return caches[settings.CATALOG_CACHE['ALIAS']]
+
+
+def bump_versions(*keys):
+    """递增版本号"""
+    cache = get_catalog_cache()
+    for key in keys:
+        # ! incr 在键不存在时会抛出 ValueError, 先用 add 初始化
+        cache.add(key, 0, timeout=None)
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.set(key, 1, timeout=None)
+    schedule_warmup()
+
+
+def schedule_warmup():
+    """
+    数据变更后在后台重新生成 CATALOG_CACHE['WARM_URLS'] 的缓存, 第一个访问的用户不用等待查询和序列化
+
+    延迟 WARM_DELAY 秒执行, 这段时间内的多次变更合并成一次预热; 没有配置预热地址时不入队。
+    """
+    config = settings.CATALOG_CACHE
+    if config['WARM_URLS']:
+        jobs.enqueue('products.tasks.warm_catalog_cache', key='warm-catalog-cache', delay=config['WARM_DELAY'])
+
+
+def bump_product_versions(*category_ids):
+    bump_versions(PRODUCTS_VERSION, *(CATEGORY_VERSION.format(pk) for pk in category_ids if pk is not None))
+
+
+def bump_global_version():
+    bump_versions(GLOBAL_VERSION)
+
+
+def normalize_query(query_params):
+    """把查询参数规范化为稳定的字符串, 参数顺序不同但含义相同的请求共用同一个缓存"""
+    return '&'.join(
+        f'{key}={value}'
+        for key in sorted(query_params)
+        for value in sorted(query_params.getlist(key))
+        if value != ''
+    )
+
+
+class CatalogCacheMixin:
+    """
+    为商品目录的 list/retrieve 提供带版本号的响应缓存, 以及 ETag/Last-Modified 条件请求
+
+    缓存键由视图名、动作、主机、规范化后的查询参数和相关版本号组成;
+    ETag 直接由缓存键计算, 客户端带着匹配的 If-None-Match 请求时无需查询数据库即可返回 304。
+    """
+    cache_prefix = None                 # 缓存键前缀, 默认使用 basename
+    cache_category_param = None         # 按分类筛选的查询参数, 指定后只依赖该分类的版本号
+    cache_product_versions = True       # 响应内容是否依赖商品数据
+
+    def list(self, request, *args, **kwargs):
+        return self._cached_response('list', request, lambda: super(CatalogCacheMixin, self).list(request, *args, **kwargs))
+
+    def retrieve(self, request, *args, **kwargs):
+        return self._cached_response('retrieve', request, lambda: super(CatalogCacheMixin, self).retrieve(request, *args, **kwargs))
+
+    def get_cache_version_keys(self, request):
+        keys = [GLOBAL_VERSION]
+        if self.cache_product_versions:
+            category = self.cache_category_param and request.query_params.get(self.cache_category_param)
+            if category and self.action == 'list':
+                keys.append(CATEGORY_VERSION.format(category))
+            else:
+                keys.append(PRODUCTS_VERSION)
+        return keys
+
+    def get_cache_key(self, action, request):
+        cache = get_catalog_cache()
+        version_keys = self.get_cache_version_keys(request)
+        versions = cache.get_many(version_keys)
+        raw = '|'.join([
+            self.cache_prefix or self.basename,
+            action,
+            str(self.kwargs.get(self.lookup_url_kwarg or self.lookup_field, '')),
+            request.get_host(),
+            normalize_query(request.query_params),
+            *(f'{key}={versions.get(key, 0)}' for key in version_keys),
+        ])
+        return 'catalog:response:' + hashlib.md5(raw.encode()).hexdigest()
+
+    def _cached_response(self, action, request, get_response):
+        cache = get_catalog_cache()
+        key = self.get_cache_key(action, request)
+        etag = quote_etag(key.rsplit(':', 1)[1])
+
+        entry = cache.get(key)
+        last_modified = entry['last_modified'] if entry else None
+        # * 命中条件请求时直接返回 304, 不需要查询和序列化
+        not_modified = get_conditional_response(request, etag=etag, last_modified=last_modified)
+        if not_modified is not None:
+            return self._add_validators(not_modified, etag, last_modified)
+
+        if entry is not None:
+            return self._add_validators(Response(entry['data']), etag, last_modified)
+
+        response = get_response()
+        if response.status_code == 200:
+            last_modified = self._last_modified(response.data)
+            cache.set(key, {'data': response.data, 'last_modified': last_modified}, settings.CATALOG_CACHE['TIMEOUT'])
+            self._add_validators(response, etag, last_modified)
+        return response
+
+    @staticmethod
+    def _last_modified(data):
+        """从响应数据里的 updated_at 计算 Last-Modified, 分页响应取当前页的最大值"""
+        items = data.get('results', [data]) if isinstance(data, dict) else data
+        timestamps = [
+            parse_datetime(item['updated_at']).timestamp()
+            for item in items
+            if isinstance(item, dict) and item.get('updated_at')
+        ]
+        return int(max(timestamps)) if timestamps else None
+
+    @staticmethod
+    def _add_validators(response, etag, last_modified):
+        response['ETag'] = etag
+        if last_modified is not None:
+            response['Last-Modified'] = http_date(last_modified)
+        return response
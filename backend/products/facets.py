@@ -0,0 +1,88 @@
+"""
+商品列表的分面统计
+
+客户端传 facets=true 时, 在列表响应里附带当前搜索/筛选结果按分类、是否促销、价格区间的商品数。
+所有分面由一条 GROUP BY category_id 的聚合查询算出: 每个分类一行, 促销数和各价格区间的数量用带 FILTER 的 COUNT,
+促销/价格分面再把各行相加, 分类分面按路径汇总到祖先分类, 不会为每个分面重新执行一遍列表查询。
+"""
+from collections import defaultdict
+from decimal import Decimal
+
+from django.conf import settings
+from django.db.models import Count, Q
+
+from .tree import PATH_DIGITS, ancestor_ids, segment
+
+
+def price_buckets():
+    """价格区间的边界, 区间为 [min, max), 第一个区间没有下限, 最后一个没有上限"""
+    bounds = [Decimal(str(bound)) for bound in settings.PRODUCT_FACETS['PRICE_BUCKETS']]
+    return list(zip([None, *bounds], [*bounds, None]))
+
+
+def facet_queryset(queryset):
+    aggregates = {'total': Count('id'), 'on_sale': Count('id', filter=Q(is_on_sale=True))}
+    for index, (lower, upper) in enumerate(price_buckets()):
+        condition = Q()
+        if lower is not None:
+            condition &= Q(price__gte=lower)
+        if upper is not None:
+            condition &= Q(price__lt=upper)
+        aggregates[f'price_{index}'] = Count('id', filter=condition)
+    # ! 去掉排序, 否则排序字段会进入 GROUP BY
+    return queryset.order_by().values('category_id', 'category__path').annotate(**aggregates)
+
+
+def build_facets(rows):
+    buckets = price_buckets()
+    categories = defaultdict(int)
+    paths = {}
+    on_sale = total = 0
+    prices = [0] * len(buckets)
+    for row in rows:
+        total += row['total']
+        on_sale += row['on_sale']
+        for index in range(len(buckets)):
+            prices[index] += row[f'price_{index}']
+        path = row['category__path'] or segment(row['category_id'])
+        for depth, pk in enumerate(ancestor_ids(path)):
+            categories[pk] += row['total']
+            paths[pk] = path[:(depth + 1) * (PATH_DIGITS + 1)]
+
+    as_string = lambda value: None if value is None else f'{value:.2f}'     # 与商品价格的输出格式一致
+    return {
+        # * 按路径排序即树的先序, 祖先分类的数量包含所有子分类
+        'category': [{'id': pk, 'count': categories[pk]} for pk in sorted(categories, key=paths.get)],
+        'is_on_sale': [{'value': True, 'count': on_sale}, {'value': False, 'count': total - on_sale}],
+        'price': [
+            {'min': as_string(lower), 'max': as_string(upper), 'count': count}
+            for (lower, upper), count in zip(buckets, prices)
+        ],
+    }
+
+
+def compute_facets(queryset):
+    return build_facets(facet_queryset(queryset))
+
+
+async def acompute_facets(queryset):
+    """compute_facets 的异步版本, 供 ASGI 视图使用"""
+    return build_facets([row async for row in facet_queryset(queryset)])
+
+
+def facets_requested(request):
+    return str(request.query_params.get('facets', '')).lower() in ('1', 'true')
+
+
+class FacetMixin:
+    """客户端请求 facets 时, 在分页响应里加上当前筛选结果的分面统计(按分页前的完整结果计算)"""
+
+    def paginate_queryset(self, queryset):
+        self._facet_source = queryset
+        return super().paginate_queryset(queryset)
+
+    def get_paginated_response(self, data):
+        response = super().get_paginated_response(data)
+        if facets_requested(self.request):
+            response.data['facets'] = compute_facets(self._facet_source)
+        return response
@@ -0,0 +1,65 @@
+import django_filters
+from django.db.models import Exists, OuterRef, Value
+from rest_framework import filters
+
+from . import tree
+from .models import ProductCategory, Product
+from .search import SEARCH_RANK, get_search_backend
+
+
+class ProductFilter(django_filters.FilterSet):
+    """商品筛选, 按分类筛选时包含所有子分类的商品"""
+    # * 校验分类参数时顺带查出是否有子分类, 叶子分类直接按 category_id 筛选, 不需要额外的查询
+    category = django_filters.ModelChoiceFilter(
+        queryset=ProductCategory.objects.annotate(has_children=Exists(ProductCategory.objects.filter(parent=OuterRef('pk')))),
+        method='filter_category',
+    )
+    is_on_sale = django_filters.BooleanFilter(method='filter_is_on_sale')
+
+    class Meta:
+        model = Product
+        # * 范围筛选: price__gte=100&price__lt=500, 与分面统计里价格区间的 [min, max) 对应
+        fields = {'category': ['exact'], 'is_on_sale': ['exact'], 'price': ['exact', 'gt', 'gte', 'lt', 'lte'], 'stock': ['gte', 'lte']}
+
+    def filter_category(self, queryset, name, category):
+        if not category.has_children:
+            return queryset.filter(category=category)
+        # ! 子树的分类 id 由 path 上的一次范围扫描取出, 商品再走 (category, 排序字段) 索引
+        return queryset.filter(category__in=tree.subtree(category).values('pk'))
+
+    def filter_is_on_sale(self, queryset, name, is_on_sale):
+        # ! is_on_sale=True 默认生成 WHERE "is_on_sale" / WHERE NOT "is_on_sale", SQLite 不会用它查找索引;
+        # ! 写成 is_on_sale = %s 才能按 (is_on_sale, 排序字段) 索引的前缀查找
+        return queryset.filter(is_on_sale=Value(is_on_sale))
+
+
+class ProductCategoryFilter(django_filters.FilterSet):
+    """分类筛选: parent 取直接子分类, parent__isnull=true 取根分类, subtree 取某个分类及其所有子分类"""
+    subtree = django_filters.ModelChoiceFilter(queryset=ProductCategory.objects.all(), method='filter_subtree')
+
+    class Meta:
+        model = ProductCategory
+        fields = {'parent': ['exact', 'isnull'], 'depth': ['exact', 'lte']}
+
+    def filter_subtree(self, queryset, name, category):
+        return queryset.filter(tree.subtree_q(category.path))
+
+
+class ProductSearchFilter(filters.SearchFilter):
+    """使用全文索引的商品搜索, 替代逐行 LIKE '%term%' 扫描的 SearchFilter"""
+
+    def filter_queryset(self, request, queryset, view):
+        search_terms = self.get_search_terms(request)
+        if not search_terms:
+            return queryset
+        return get_search_backend().filter_queryset(queryset, search_terms)
+
+
+class ProductOrderingFilter(filters.OrderingFilter):
+    """搜索时如果客户端没有指定排序, 优先按相关度排序"""
+
+    def get_ordering(self, request, queryset, view):
+        ordering = super().get_ordering(request, queryset, view)
+        if SEARCH_RANK in queryset.query.annotations and not request.query_params.get(self.ordering_param):
+            return [SEARCH_RANK, *(ordering or [])]
+        return ordering
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from products.stock import release_expired
+
+
+class Command(BaseCommand):
+    help = '释放过期未确认的库存预留, 建议每分钟执行一次'
+
+    def handle(self, *args, **options):
+        released = release_expired()
+        self.stdout.write(self.style.SUCCESS(f'释放了 {released} 个过期的库存预留'))
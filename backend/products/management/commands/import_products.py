@@ -0,0 +1,33 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from products import bulk
+
+
+class Command(BaseCommand):
+    help = '从 CSV/JSONL 文件批量导入商品, 按 sku 新增或更新'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='CSV 或 JSONL 文件路径')
+        parser.add_argument('--format', dest='file_format', choices=bulk.FORMATS, help='文件格式, 默认按扩展名判断')
+        parser.add_argument('--batch-size', type=int, default=1000, help='每批写入的行数')
+        parser.add_argument('--create-categories', action='store_true', help='自动创建不存在的分类')
+        parser.add_argument('--report', help='把逐行错误报告写入这个 JSON 文件')
+
+    def handle(self, *args, path, file_format, batch_size, create_categories, report, **options):
+        importer = bulk.ProductImporter(batch_size=batch_size, create_categories=create_categories)
+        try:
+            with open(path, 'rb') as f:
+                result = importer.run(bulk.read_rows(f, file_format or bulk.guess_format(path)))
+        except OSError as exc:
+            raise CommandError(exc)
+
+        if report:
+            with open(report, 'w', encoding='utf-8') as f:
+                json.dump(result, f, ensure_ascii=False, indent=2)
+        self.stdout.write(self.style.SUCCESS(
+            f'处理 {result["processed"]} 行, 导入 {result["imported"]} 行, 失败 {len(result["errors"])} 行'
+        ))
+        for error in result['errors'][:20]:
+            self.stdout.write(self.style.WARNING(f'第 {error["row"]} 行: {error["errors"]}'))
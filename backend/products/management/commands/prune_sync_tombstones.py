@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from products.sync import prune_tombstones
+
+
+class Command(BaseCommand):
+    help = '清理超过 CATALOG_SYNC["TOMBSTONE_TTL"] 的删除记录, 建议每天执行一次'
+
+    def handle(self, *args, **options):
+        pruned = prune_tombstones()
+        self.stdout.write(self.style.SUCCESS(f'清理了 {pruned} 条删除记录'))
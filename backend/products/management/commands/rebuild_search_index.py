@@ -0,0 +1,24 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from products import tasks
+from products.search import get_search_backend
+
+
+class Command(BaseCommand):
+    help = '重建商品全文搜索索引, 用于批量导入等绕过了模型信号的写入之后'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--background', action='store_true', help='加入后台任务队列, 由 run_jobs 的 worker 执行')
+
+    def handle(self, *args, background, **options):
+        if background:
+            if tasks.rebuild_search_index.enqueue(key='rebuild-search-index') is None and not settings.JOBS['EAGER']:
+                self.stdout.write(self.style.WARNING('已有排队中的重建任务'))
+            else:
+                self.stdout.write(self.style.SUCCESS('已加入后台任务队列'))
+            return
+        with transaction.atomic():
+            get_search_backend().rebuild()
+        self.stdout.write(self.style.SUCCESS('商品搜索索引已重建'))
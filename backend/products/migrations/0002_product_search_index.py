@@ -0,0 +1,38 @@
+from django.db import migrations
+
+from products.search import tokenize
+
+FTS_TABLE = 'products_product_fts'
+
+
+def create_search_index(apps, schema_editor):
+    """创建 FTS5 虚拟表并导入已有商品, 只在 SQLite 上执行"""
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    Product = apps.get_model('products', 'Product')
+    schema_editor.execute(
+        f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} "
+        f"USING fts5(name, description, tokenize = 'unicode61 remove_diacritics 2')"
+    )
+    for pk, name, description in Product.objects.values_list('pk', 'name', 'description').iterator():
+        schema_editor.execute(
+            f'INSERT INTO {FTS_TABLE} (rowid, name, description) VALUES (%s, %s, %s)',
+            [pk, tokenize(name), tokenize(description)],
+        )
+
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    schema_editor.execute(f'DROP TABLE IF EXISTS {FTS_TABLE}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
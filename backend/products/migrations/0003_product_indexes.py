@@ -0,0 +1,57 @@
+# Generated by Django 5.1.15 on 2026-10-18 05:42
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0002_product_search_index'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['created_at', 'id'], name='product_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['updated_at', 'id'], name='product_updated_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['price', 'id'], name='product_price_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['category', 'created_at', 'id'], name='product_cat_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['category', 'updated_at', 'id'], name='product_cat_updated_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['category', 'price', 'id'], name='product_cat_price_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['price', 'created_at', 'id'], name='product_price_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['price', 'updated_at', 'id'], name='product_price_updated_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(condition=models.Q(('is_on_sale', True)), fields=['created_at', 'id'], name='product_sale_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(condition=models.Q(('is_on_sale', True)), fields=['updated_at', 'id'], name='product_sale_updated_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(condition=models.Q(('is_on_sale', True)), fields=['price', 'id'], name='product_sale_price_idx'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.1.15 on 2026-10-18 05:43
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0003_product_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='image_variants',
+            field=models.JSONField(blank=True, default=dict, editable=False, verbose_name='商品图片衍生图'),
+        ),
+    ]
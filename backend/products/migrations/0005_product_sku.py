@@ -0,0 +1,18 @@
+# Generated by Django 5.1.15 on 2026-10-18 05:46
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0004_product_image_variants'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='sku',
+            field=models.CharField(blank=True, max_length=64, null=True, unique=True, verbose_name='商品编码'),
+        ),
+    ]
@@ -0,0 +1,48 @@
+# Generated by Django 5.1.15 on 2026-10-18 05:48
+
+import django.db.models.deletion
+import uuid
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0005_product_sku'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StockReservation',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('status', models.CharField(choices=[('held', '预留中'), ('confirmed', '已确认'), ('released', '已释放')], default='held', max_length=16, verbose_name='状态')),
+                ('expires_at', models.DateTimeField(verbose_name='过期时间')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='创建时间')),
+                ('user', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='stock_reservations', to=settings.AUTH_USER_MODEL, verbose_name='用户')),
+            ],
+            options={
+                'verbose_name': '库存预留',
+                'verbose_name_plural': '库存预留',
+            },
+        ),
+        migrations.CreateModel(
+            name='StockReservationItem',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('quantity', models.PositiveIntegerField(verbose_name='数量')),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='reservation_items', to='products.product', verbose_name='商品')),
+                ('reservation', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='items', to='products.stockreservation', verbose_name='库存预留')),
+            ],
+            options={
+                'verbose_name': '库存预留商品',
+                'verbose_name_plural': '库存预留商品',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='stockreservation',
+            index=models.Index(fields=['status', 'expires_at'], name='reservation_expiry_idx'),
+        ),
+    ]
@@ -0,0 +1,61 @@
+# Generated by Django 5.1.15 on 2026-10-18 06:13
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Count, Q
+
+
+def populate_tree(apps, schema_editor):
+    """已有的分类都是根分类, 路径即自身主键; 商品数按分类统计一次"""
+    ProductCategory = apps.get_model('products', 'ProductCategory')
+    Product = apps.get_model('products', 'Product')
+    counts = {
+        row['category_id']: row
+        for row in Product.objects.values('category_id').annotate(total=Count('id'), on_sale=Count('id', filter=Q(is_on_sale=True))).order_by()
+    }
+    categories = list(ProductCategory.objects.all())
+    for category in categories:
+        category.path = f'{category.pk:010d}/'
+        row = counts.get(category.pk, {})
+        category.product_count, category.on_sale_count = row.get('total', 0), row.get('on_sale', 0)
+    ProductCategory.objects.bulk_update(categories, ['path', 'product_count', 'on_sale_count'], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0006_stock_reservation'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='productcategory',
+            name='depth',
+            field=models.PositiveSmallIntegerField(default=0, editable=False, verbose_name='层级'),
+        ),
+        migrations.AddField(
+            model_name='productcategory',
+            name='on_sale_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='促销商品数'),
+        ),
+        migrations.AddField(
+            model_name='productcategory',
+            name='parent',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='children', to='products.productcategory', verbose_name='上级分类'),
+        ),
+        migrations.AddField(
+            model_name='productcategory',
+            name='path',
+            field=models.CharField(default='', editable=False, max_length=255, verbose_name='路径'),
+        ),
+        migrations.AddField(
+            model_name='productcategory',
+            name='product_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='商品数'),
+        ),
+        migrations.AddIndex(
+            model_name='productcategory',
+            index=models.Index(fields=['path'], name='category_path_idx'),
+        ),
+        migrations.RunPython(populate_tree, migrations.RunPython.noop),
+    ]
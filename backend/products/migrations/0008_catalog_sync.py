@@ -0,0 +1,43 @@
+# Generated by Django 5.1.15 on 2026-10-18 06:18
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0007_category_tree'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CatalogTombstone',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('product', '商品'), ('category', '商品分类')], max_length=16, verbose_name='类型')),
+                ('object_id', models.BigIntegerField(verbose_name='对象 id')),
+                ('deleted_at', models.DateTimeField(verbose_name='删除时间')),
+            ],
+            options={
+                'verbose_name': '已删除的目录数据',
+                'verbose_name_plural': '已删除的目录数据',
+            },
+        ),
+        migrations.AddField(
+            model_name='productcategory',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True, verbose_name='更新时间'),
+        ),
+        migrations.AddIndex(
+            model_name='productcategory',
+            index=models.Index(fields=['updated_at', 'id'], name='category_updated_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='catalogtombstone',
+            index=models.Index(fields=['deleted_at', 'id'], name='catalog_tombstone_deleted_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='catalogtombstone',
+            constraint=models.UniqueConstraint(fields=('kind', 'object_id'), name='catalog_tombstone_uniq'),
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 5.1.15 on 2026-10-18 06:28
+
+import core.media
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0008_catalog_sync'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='product',
+            name='image',
+            field=core.media.ContentAddressedImageField(blank=True, null=True, upload_to='products/', verbose_name='商品图片'),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.1.15 on 2026-10-18 06:53
+
+import django.db.models.deletion
+import products.models
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0009_content_addressed_media'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductSearchDocument',
+            fields=[
+                ('product', models.OneToOneField(db_column='rowid', db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, primary_key=True, related_name='search_document', serialize=False, to='products.product')),
+                ('name', models.TextField()),
+                ('description', models.TextField(null=True)),
+                ('document', products.models.FullTextDocumentField(db_column='products_product_fts')),
+            ],
+            options={
+                'db_table': 'products_product_fts',
+                'managed': False,
+            },
+        ),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 5.1.15 on 2026-10-18 06:54
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0010_product_search_document'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='product',
+            name='product_sale_created_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='product',
+            name='product_sale_updated_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='product',
+            name='product_sale_price_idx',
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['is_on_sale', 'created_at', 'id'], name='product_sale_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['is_on_sale', 'updated_at', 'id'], name='product_sale_updated_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['is_on_sale', 'price', 'id'], name='product_sale_price_idx'),
+        ),
+    ]
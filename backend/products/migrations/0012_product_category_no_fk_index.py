@@ -0,0 +1,19 @@
+# Generated by Django 5.1.15 on 2026-10-18 07:10
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0011_product_sale_indexes'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='product',
+            name='category',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='products', to='products.productcategory', verbose_name='商品分类'),
+        ),
+    ]
@@ -1,15 +1,45 @@
-from django.db import models
+import uuid
+
+from django.conf import settings
+from django.db import models, transaction
+
+from core.media import ContentAddressedImageField
 
 class ProductCategory(models.Model):
     """
     商品分类
+
+    分类树用物化路径保存(见 products.tree), path/depth 和商品数都由信号维护, 不能直接编辑。
     """
     name = models.CharField(max_length=100, verbose_name='分类名称')
     description = models.TextField(null=True, blank=True, verbose_name='分类描述')
+    parent = models.ForeignKey('self', on_delete=models.CASCADE, null=True, blank=True, related_name='children', verbose_name='上级分类')
+    path = models.CharField(max_length=255, default='', editable=False, verbose_name='路径') # 从根分类到自身的主键路径, 例如 0000000001/0000000007/
+    depth = models.PositiveSmallIntegerField(default=0, editable=False, verbose_name='层级') # 根分类为 0
+    product_count = models.PositiveIntegerField(default=0, editable=False, verbose_name='商品数') # * 包含所有子分类的商品
+    on_sale_count = models.PositiveIntegerField(default=0, editable=False, verbose_name='促销商品数')
+    updated_at = models.DateTimeField(auto_now=True, verbose_name='更新时间') # 增量同步接口按它翻页
 
     class Meta:
         verbose_name = '商品分类'
         verbose_name_plural = verbose_name
+        indexes = [
+            # * 子树查询是 path 上的一段范围扫描, 按 path 排序即树的先序遍历
+            models.Index(fields=['path'], name='category_path_idx'),
+            models.Index(fields=['updated_at', 'id'], name='category_updated_idx'),
+        ]
+
+    # 由信号增量维护的字段, 修改已有分类时不写回, 否则内存里过期的值会覆盖掉并发更新过的商品数
+    TREE_FIELDS = ('path', 'depth', 'product_count', 'on_sale_count')
+
+    def save(self, *args, **kwargs):
+        if not self._state.adding and not args and kwargs.get('update_fields') is None and not kwargs.get('force_insert'):
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields if not field.primary_key and field.name not in self.TREE_FIELDS
+            ]
+        # ! post_save 信号里会更新 path, 换父分类时还要移动整棵子树, 与保存放在同一个事务里
+        with transaction.atomic(using=kwargs.get('using')):
+            super().save(*args, **kwargs)
 
     def __str__(self):
         return self.name
@@ -18,11 +48,14 @@ class Product(models.Model):
     """
     商品
     """
-    category = models.ForeignKey(ProductCategory, on_delete=models.CASCADE, related_name='products', verbose_name='商品分类') # 关联商品分类
+    # ! 不单独给 category_id 建索引: 下面以 category 开头的组合索引已经覆盖所有按分类的查询, 多一个索引只是多一份写入开销
+    category = models.ForeignKey(ProductCategory, on_delete=models.CASCADE, db_index=False, related_name='products', verbose_name='商品分类') # 关联商品分类
+    sku = models.CharField(max_length=64, unique=True, null=True, blank=True, verbose_name='商品编码') # 供应商 SKU, 批量导入时按它更新已有商品
     name = models.CharField(max_length=200, verbose_name='商品名称')
     description = models.TextField(null=True, blank=True, verbose_name='商品描述')
     price = models.DecimalField(max_digits=10, decimal_places=2, verbose_name='商品价格')
-    image = models.ImageField(upload_to='products/', null=True, blank=True, verbose_name='商品图片') # 商品图片，上传到 products/ 目录
+    image = ContentAddressedImageField(upload_to='products/', null=True, blank=True, verbose_name='商品图片') # 商品图片，按内容的摘要命名, 上传到 products/ 目录
+    image_variants = models.JSONField(default=dict, blank=True, editable=False, verbose_name='商品图片衍生图') # 缩略图/WebP 等衍生图的路径, 由后台线程生成
     stock = models.IntegerField(default=0, verbose_name='商品库存')
     is_on_sale = models.BooleanField(default=False, verbose_name='是否促销')
     created_at = models.DateTimeField(auto_now_add=True, verbose_name='创建时间')
@@ -31,6 +64,135 @@ class Product(models.Model):
     class Meta:
         verbose_name = '商品'
         verbose_name_plural = verbose_name
+        # * 覆盖商品列表接口的 筛选字段 x 排序字段 组合, 末尾的 id 用于游标分页的第二排序键
+        # * SQLite 可以反向扫描索引, 所以倒序排序不需要单独建索引
+        indexes = [
+            models.Index(fields=['created_at', 'id'], name='product_created_idx'),
+            models.Index(fields=['updated_at', 'id'], name='product_updated_idx'),
+            models.Index(fields=['price', 'id'], name='product_price_idx'),
+            # 按分类筛选
+            models.Index(fields=['category', 'created_at', 'id'], name='product_cat_created_idx'),
+            models.Index(fields=['category', 'updated_at', 'id'], name='product_cat_updated_idx'),
+            models.Index(fields=['category', 'price', 'id'], name='product_cat_price_idx'),
+            # 按价格精确筛选后再按时间排序
+            models.Index(fields=['price', 'created_at', 'id'], name='product_price_created_idx'),
+            models.Index(fields=['price', 'updated_at', 'id'], name='product_price_updated_idx'),
+            # 按是否促销筛选
+            # ! 不用只索引 is_on_sale=True 的部分索引: 筛选非促销商品时只能沿排序索引逐行扫描过滤
+            models.Index(fields=['is_on_sale', 'created_at', 'id'], name='product_sale_created_idx'),
+            models.Index(fields=['is_on_sale', 'updated_at', 'id'], name='product_sale_updated_idx'),
+            models.Index(fields=['is_on_sale', 'price', 'id'], name='product_sale_price_idx'),
+        ]
+
+    def __str__(self):
+        return self.name
+
+
+class FullTextMatch(models.Lookup):
+    """SQLite FTS5 的 MATCH 查询, document__match='"手机" *'"""
+    lookup_name = 'match'
+
+    def as_sql(self, compiler, connection):
+        lhs, lhs_params = self.process_lhs(compiler, connection)
+        rhs, rhs_params = self.process_rhs(compiler, connection)
+        return f'{lhs} MATCH {rhs}', [*lhs_params, *rhs_params]
+
+
+class FullTextDocumentField(models.TextField):
+    """FTS5 虚拟表与表同名的隐藏列, 代表整行文档, MATCH 和 bm25() 都作用在它上面"""
+
+
+FullTextDocumentField.register_lookup(FullTextMatch)
+
+
+class ProductSearchDocument(models.Model):
+    """
+    商品全文索引(SQLite FTS5 虚拟表), 只用于查询
+
+    虚拟表由迁移 0002 创建, 由 products.search.SQLiteFTS5Backend 维护, rowid 与商品 id 相同;
+    通过 Product.search_document 关联查询, JOIN 和别名都交给 ORM 生成。
+    """
+    product = models.OneToOneField(
+        Product, primary_key=True, db_column='rowid', db_constraint=False, on_delete=models.DO_NOTHING, related_name='search_document',
+    )
+    name = models.TextField()
+    description = models.TextField(null=True)
+    document = FullTextDocumentField(db_column='products_product_fts')
+
+    class Meta:
+        managed = False
+        db_table = 'products_product_fts'
+
+
+class StockReservation(models.Model):
+    """
+    库存预留
+
+    下单时先预留库存(已从 Product.stock 扣减), 确认后转为正式扣减, 超时未确认则自动释放回库存。
+    """
+    STATUS_HELD = 'held'
+    STATUS_CONFIRMED = 'confirmed'
+    STATUS_RELEASED = 'released'
+    STATUS_CHOICES = [
+        (STATUS_HELD, '预留中'),
+        (STATUS_CONFIRMED, '已确认'),
+        (STATUS_RELEASED, '已释放'),
+    ]
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, null=True, blank=True, related_name='stock_reservations', verbose_name='用户')
+    status = models.CharField(max_length=16, choices=STATUS_CHOICES, default=STATUS_HELD, verbose_name='状态')
+    expires_at = models.DateTimeField(verbose_name='过期时间')
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name='创建时间')
+
+    class Meta:
+        verbose_name = '库存预留'
+        verbose_name_plural = verbose_name
+        indexes = [
+            # * 定时释放过期预留时按 (status, expires_at) 查找
+            models.Index(fields=['status', 'expires_at'], name='reservation_expiry_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.id}({self.get_status_display()})'
+
+
+class StockReservationItem(models.Model):
+    """库存预留中的一个商品"""
+    reservation = models.ForeignKey(StockReservation, on_delete=models.CASCADE, related_name='items', verbose_name='库存预留')
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='reservation_items', verbose_name='商品')
+    quantity = models.PositiveIntegerField(verbose_name='数量')
+
+    class Meta:
+        verbose_name = '库存预留商品'
+        verbose_name_plural = verbose_name
+
+    def __str__(self):
+        return f'{self.product_id} x {self.quantity}'
+
+
+class CatalogTombstone(models.Model):
+    """
+    已删除的商品/分类
+
+    由 post_delete 信号写入, 增量同步接口据此通知客户端删除本地缓存; 超过保留期的由 prune_sync_tombstones 命令清理。
+    """
+    KIND_PRODUCT = 'product'
+    KIND_CATEGORY = 'category'
+    KIND_CHOICES = [
+        (KIND_PRODUCT, '商品'),
+        (KIND_CATEGORY, '商品分类'),
+    ]
+
+    kind = models.CharField(max_length=16, choices=KIND_CHOICES, verbose_name='类型')
+    object_id = models.BigIntegerField(verbose_name='对象 id')
+    deleted_at = models.DateTimeField(verbose_name='删除时间')
+
+    class Meta:
+        verbose_name = '已删除的目录数据'
+        verbose_name_plural = verbose_name
+        constraints = [models.UniqueConstraint(fields=['kind', 'object_id'], name='catalog_tombstone_uniq')]
+        indexes = [models.Index(fields=['deleted_at', 'id'], name='catalog_tombstone_deleted_idx')]
 
     def __str__(self):
-        return self.name
\ No newline at end of file
+        return f'{self.kind}:{self.object_id}'
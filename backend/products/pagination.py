@@ -0,0 +1,121 @@
+import hashlib
+import json
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+from rest_framework import pagination
+from rest_framework.exceptions import NotFound
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+from .cache import PRODUCTS_VERSION, get_catalog_cache
+from .models import Product
+
+
+class ProductCursorPagination(pagination.CursorPagination):
+    """
+    商品列表的游标(keyset)分页, 适用于客户端无限滚动
+
+    按 (排序字段, id) 组合键翻页, 每页只需一次走索引的范围查询, 不做 COUNT(*) 也没有 OFFSET;
+    id 作为第二排序键保证排序字段取值相同时游标依然稳定, 新插入的数据不会导致重复或遗漏。
+    """
+    page_size = 10
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+    count_query_param = 'with_count'    # * 传 with_count=1 时返回总数, 总数会按商品版本号缓存
+    ordering_param = 'ordering'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        self.field, self.descending = self.get_keyset_ordering(request, view)
+        self.count = self.get_cached_count(queryset) if request.query_params.get(self.count_query_param) else None
+
+        id_order = '-id' if self.descending else 'id'
+        field_order = f'-{self.field}' if self.descending else self.field
+        queryset = queryset.order_by(field_order, id_order)
+
+        position = self.decode_cursor(request)
+        if position is not None:
+            value, pk = position
+            # ! 写成 field <= v AND (field < v OR id < pk) 的形式, 数据库可以直接在 (field, id) 索引上做范围扫描
+            if self.descending:
+                queryset = queryset.filter(Q(**{f'{self.field}__lte': value}), Q(**{f'{self.field}__lt': value}) | Q(id__lt=pk))
+            else:
+                queryset = queryset.filter(Q(**{f'{self.field}__gte': value}), Q(**{f'{self.field}__gt': value}) | Q(id__gt=pk))
+
+        # 多取一条用于判断是否还有下一页
+        results = list(queryset[:self.page_size + 1])
+        self.has_next = len(results) > self.page_size
+        self.page = results[:self.page_size]
+        return self.page
+
+    def get_keyset_ordering(self, request, view):
+        """取客户端排序参数中第一个合法字段, 否则使用视图的默认排序"""
+        valid_fields = getattr(view, 'ordering_fields', [])
+        terms = [term.strip() for term in request.query_params.get(self.ordering_param, '').split(',') if term.strip()]
+        terms += list(getattr(view, 'ordering', None) or ['-created_at'])
+        for term in terms:
+            if term.lstrip('-') in valid_fields:
+                return term.lstrip('-'), term.startswith('-')
+        return 'created_at', True
+
+    def get_cached_count(self, queryset):
+        """按过滤条件和商品版本号缓存总数, 数据变化前重复请求不再 COUNT(*)"""
+        cache = get_catalog_cache()
+        raw = f'{queryset.query}|{cache.get(PRODUCTS_VERSION, 0)}'
+        key = 'catalog:count:' + hashlib.md5(raw.encode()).hexdigest()
+        count = cache.get(key)
+        if count is None:
+            count = queryset.count()
+            cache.set(key, count, settings.CATALOG_CACHE['TIMEOUT'])
+        return count
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None
+        try:
+            data = json.loads(urlsafe_b64decode(encoded.encode('ascii')))
+            # * 游标与排序方式绑定, 客户端中途改了排序的话旧游标作废
+            if data['o'] != self.ordering_token():
+                raise ValueError
+            return Product._meta.get_field(self.field).to_python(data['v']), int(data['id'])
+        except (TypeError, ValueError, KeyError, ValidationError):
+            raise NotFound(self.invalid_cursor_message)
+
+    def encode_cursor(self, instance):
+        # * 列表接口使用编译后的序列化器时, 分页拿到的是 .values() 的 dict 行
+        if isinstance(instance, dict):
+            value, pk = instance[self.field], instance['id']
+        else:
+            value, pk = getattr(instance, self.field), instance.pk
+        data = {'o': self.ordering_token(), 'v': value.isoformat() if hasattr(value, 'isoformat') else str(value), 'id': pk}
+        encoded = urlsafe_b64encode(json.dumps(data, separators=(',', ':')).encode()).decode('ascii')
+        return replace_query_param(self.request.build_absolute_uri(), self.cursor_query_param, encoded)
+
+    def ordering_token(self):
+        return f'-{self.field}' if self.descending else self.field
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        return self.encode_cursor(self.page[-1])
+
+    def get_previous_link(self):
+        # 无限滚动只需要向后翻页
+        return None
+
+    def get_paginated_response(self, data):
+        payload = {'next': self.get_next_link(), 'previous': None}
+        if self.count is not None:
+            payload['count'] = self.count
+        payload['results'] = data
+        return Response(payload)
+
+    def get_paginated_response_schema(self, schema):
+        response_schema = super().get_paginated_response_schema(schema)
+        response_schema['properties']['count'] = {'type': 'integer', 'example': 123}
+        return response_schema
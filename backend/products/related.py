@@ -0,0 +1,129 @@
+import threading
+import time
+
+from django.conf import settings
+from django.db.models import F, Window
+from django.db.models.functions import RowNumber
+
+from .cache import CATEGORY_VERSION, get_catalog_cache
+from .models import Product
+
+RELATED_LIMIT = 4   # 每个商品最多返回的关联商品数量
+
+# * 关联商品只需要摘要字段, 避免把描述等大字段读进内存
+SUMMARY_FIELDS = ['id', 'name', 'price', 'image', 'image_variants', 'is_on_sale', 'category_id']
+
+
+class RelatedProductIndex:
+    """
+    按分类缓存的关联商品索引
+
+    每个分类只保存按 id 排序的前 limit + 1 个商品摘要, 这样排除掉商品自身之后仍然够 limit 个。
+    * 每个分类的数据记下加载时该分类的缓存版本号(见 products.cache), 其他进程(多个 Web worker、run_jobs)修改商品
+      递增版本号后, 下次读取时发现版本不同就重新加载; 另外最多保留 CATALOG_CACHE['TIMEOUT'] 秒, 兜底版本号没覆盖到的写入。
+    本进程里商品保存/删除时直接作废受影响的分类。
+    """
+
+    def __init__(self, limit=RELATED_LIMIT):
+        self.limit = limit
+        self._lock = threading.Lock()
+        self._by_category = {}     # category_id -> (版本号, 加载时间, [Product, ...])
+        self._generation = 0       # 每次作废时递增, 加载期间发生过作废的结果不写入索引
+
+    def neighbors_for(self, products):
+        """批量获取一页商品的关联商品, 返回 {product_id: [Product, ...]}"""
+        versions = self._by_id(products, get_catalog_cache().get_many(self._version_keys(products)))
+        missing, generation = self._missing(versions)
+        loaded = {}
+        if missing:
+            # ! 所有缺失的分类用一条查询加载, 查询数量与页大小无关
+            loaded = self._store(missing, list(self._load_queryset(missing)), versions, generation)
+        return self._collect(products, loaded)
+
+    async def aneighbors_for(self, products):
+        """neighbors_for 的异步版本, 供 ASGI 视图使用"""
+        versions = self._by_id(products, await get_catalog_cache().aget_many(self._version_keys(products)))
+        missing, generation = self._missing(versions)
+        loaded = {}
+        if missing:
+            loaded = self._store(missing, [row async for row in self._load_queryset(missing)], versions, generation)
+        return self._collect(products, loaded)
+
+    def invalidate(self, product):
+        """商品变更后作废它所在的分类, 以及仍然缓存着它的旧分类"""
+        with self._lock:
+            self._generation += 1
+            stale = [
+                category_id for category_id, (_, _, neighbors) in self._by_category.items()
+                if category_id == product.category_id or any(n.pk == product.pk for n in neighbors)
+            ]
+            for category_id in stale:
+                del self._by_category[category_id]
+
+    def clear(self):
+        with self._lock:
+            self._generation += 1
+            self._by_category.clear()
+
+    @staticmethod
+    def _category_ids(products):
+        return {product.category_id for product in products}
+
+    def _version_keys(self, products):
+        return [CATEGORY_VERSION.format(pk) for pk in self._category_ids(products)]
+
+    def _by_id(self, products, versions):
+        """{分类 id: 当前的缓存版本号}"""
+        return {pk: versions.get(CATEGORY_VERSION.format(pk), 0) for pk in self._category_ids(products)}
+
+    def _missing(self, versions):
+        """没有缓存、版本号已经变化或已经过期的分类, 以及当前的 generation"""
+        expired = time.monotonic() - settings.CATALOG_CACHE['TIMEOUT']
+        with self._lock:
+            missing = set()
+            for category_id, version in versions.items():
+                entry = self._by_category.get(category_id)
+                if entry is None or entry[0] != version or entry[1] < expired:
+                    missing.add(category_id)
+            return missing, self._generation
+
+    def _load_queryset(self, category_ids):
+        rank = Window(RowNumber(), partition_by=[F('category_id')], order_by=F('id').asc())
+        return (
+            Product.objects.filter(category_id__in=category_ids)
+            .only(*SUMMARY_FIELDS)
+            .annotate(related_rank=rank)
+            .filter(related_rank__lte=self.limit + 1)
+            .order_by('category_id', 'id')
+        )
+
+    def _store(self, category_ids, rows, versions, generation):
+        """
+        写入加载的结果并返回 {category_id: [Product, ...]}
+
+        ! 版本号在查询之前读取, 查询期间别的进程修改了商品时, 下次读取会因为版本号不同而重新加载;
+        ! 本进程在查询期间作废过(generation 变了)时不写入, 否则作废会被这次加载的旧数据覆盖。
+        """
+        loaded = {category_id: [] for category_id in category_ids}
+        for row in rows:
+            loaded[row.category_id].append(row)
+        now = time.monotonic()
+        with self._lock:
+            if generation == self._generation:
+                self._by_category.update(
+                    (category_id, (versions[category_id], now, neighbors)) for category_id, neighbors in loaded.items()
+                )
+        return loaded
+
+    def _collect(self, products, loaded):
+        with self._lock:
+            by_category = {
+                category_id: loaded[category_id] if category_id in loaded else self._by_category.get(category_id, (0, 0, []))[2]
+                for category_id in self._category_ids(products)
+            }
+        return {
+            product.pk: [n for n in by_category[product.category_id] if n.pk != product.pk][:self.limit]
+            for product in products
+        }
+
+related_index = RelatedProductIndex()
@@ -0,0 +1,138 @@
+import re
+from functools import lru_cache
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import F, FloatField, Func, Q, Value
+from django.utils.module_loading import import_string
+
+from .models import Product
+
+SEARCH_RANK = 'search_rank'     # 搜索相关度的注解字段名, 数值越小越相关
+
+# * 中日文字符之间没有空格, 需要逐字切分后才能做子串匹配
+CJK_CHARS = re.compile(r'([\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff])')
+
+
+def tokenize(text):
+    """把中文逐字用空格隔开, 英文和数字保持原样, 交给 FTS5 的 unicode61 分词器处理"""
+    return CJK_CHARS.sub(r' \1 ', text or '')
+
+
+def build_match_query(terms):
+    """
+    把搜索词转换为 FTS5 的 MATCH 表达式
+
+    每个搜索词作为一个短语, 中文逐字相邻匹配, 最后一个词元按前缀匹配, 多个搜索词之间是 AND 关系。
+    """
+    phrases = []
+    for term in terms:
+        # ! 只有标点的词元不会产生任何 FTS 词元, 保留的话整个查询都匹配不到结果
+        tokens = [token for token in tokenize(term.replace('"', ' ')).split() if any(ch.isalnum() for ch in token)]
+        if tokens:
+            phrases.append('"{}" *'.format(' '.join(tokens)))
+    return ' '.join(phrases)
+
+
+class SearchBackend:
+    """
+    商品搜索后端的接口
+
+    filter_queryset 需要返回过滤后的 queryset, 并带上 SEARCH_RANK 注解用于按相关度排序;
+    index/remove 在商品保存/删除时调用, 用于同步索引。
+    """
+
+    def index(self, product):
+        pass
+
+    def index_many(self, products):
+        for product in products:
+            self.index(product)
+
+    def remove(self, product):
+        pass
+
+    def rebuild(self):
+        pass
+
+    def filter_queryset(self, queryset, terms):
+        raise NotImplementedError('.filter_queryset() must be overridden.')
+
+    def filter_matches(self, queryset, terms):
+        """只筛选不计算相关度, 返回的 queryset 还可以继续 update()/delete()(后台的批量操作)"""
+        return self.filter_queryset(queryset, terms)
+
+
+class DatabaseLikeBackend(SearchBackend):
+    """不依赖全文索引的后备实现, 与原来 SearchFilter 的 icontains 行为一致"""
+    search_fields = ['name', 'description']
+
+    def filter_queryset(self, queryset, terms):
+        for term in terms:
+            condition = Q()
+            for field in self.search_fields:
+                condition |= Q(**{f'{field}__icontains': term})
+            queryset = queryset.filter(condition)
+        return queryset
+
+
+class SQLiteFTS5Backend(SearchBackend):
+    """
+    基于 SQLite FTS5 虚拟表的全文搜索
+
+    虚拟表 rowid 与商品 id 相同, 按 bm25 排序, 商品名称的权重高于描述。
+    """
+    table = 'products_product_fts'
+    weights = (10.0, 1.0)   # name, description
+
+    def index(self, product):
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {self.table} WHERE rowid = %s', [product.pk])
+            cursor.execute(
+                f'INSERT INTO {self.table} (rowid, name, description) VALUES (%s, %s, %s)',
+                [product.pk, tokenize(product.name), tokenize(product.description)],
+            )
+
+    def index_many(self, products):
+        pks = [(product.pk,) for product in products]
+        with connection.cursor() as cursor:
+            cursor.executemany(f'DELETE FROM {self.table} WHERE rowid = %s', pks)
+            cursor.executemany(
+                f'INSERT INTO {self.table} (rowid, name, description) VALUES (%s, %s, %s)',
+                [(product.pk, tokenize(product.name), tokenize(product.description)) for product in products],
+            )
+
+    def remove(self, product):
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {self.table} WHERE rowid = %s', [product.pk])
+
+    def rebuild(self):
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {self.table}')
+            for pk, name, description in Product.objects.values_list('pk', 'name', 'description').iterator(chunk_size=2000):
+                cursor.execute(
+                    f'INSERT INTO {self.table} (rowid, name, description) VALUES (%s, %s, %s)',
+                    [pk, tokenize(name), tokenize(description)],
+                )
+
+    def filter_queryset(self, queryset, terms):
+        match = build_match_query(terms)
+        if not match:
+            return queryset
+        # ! 与虚拟表 JOIN 后在同一行上计算 bm25; 写成 pk IN (...) 加相关子查询取 bm25 时, 每个命中的商品都会把 MATCH 重新执行一遍
+        rank = Func(F('search_document__document'), *(Value(weight) for weight in self.weights), function='bm25', output_field=FloatField())
+        return queryset.filter(search_document__document__match=match).annotate(**{SEARCH_RANK: rank})
+
+    def filter_matches(self, queryset, terms):
+        match = build_match_query(terms)
+        if not match:
+            return queryset
+        return queryset.filter(search_document__document__match=match)
+
+@lru_cache(maxsize=None)
+def get_search_backend():
+    """按 PRODUCT_SEARCH_BACKEND 配置加载搜索后端, 非 SQLite 数据库上退回到 icontains 实现"""
+    backend_path = settings.PRODUCT_SEARCH_BACKEND
+    if backend_path.endswith('SQLiteFTS5Backend') and connection.vendor != 'sqlite':
+        backend_path = 'products.search.DatabaseLikeBackend'
+    return import_string(backend_path)()
@@ -1,26 +1,124 @@
 from rest_framework import serializers
-from .models import ProductCategory, Product
+from core.fields import ImageVariantsField
+from core.sparse import SparseFieldsMixin
+from .models import ProductCategory, Product, StockReservation, StockReservationItem
+from .related import related_index
+from . import tree
 
 class ProductCategorySerializer(serializers.ModelSerializer):
     class Meta:
         model = ProductCategory
-        fields = '__all__' #  使用 '__all__' 包含所有字段，简单起见，可以根据需要显式列出字段
+        # * path/depth 和商品数由服务端维护, 只读
+        fields = ['id', 'name', 'description', 'parent', 'path', 'depth', 'product_count', 'on_sale_count']
 
+    def validate_parent(self, parent):
+        if parent is not None and self.instance is not None and (
+                parent.pk == self.instance.pk or tree.is_in_subtree(parent.path, self.instance.path)):
+            raise serializers.ValidationError('不能把分类移动到它自己或它的子分类下面.')
+        return parent
 
-class ProductSerializer(serializers.ModelSerializer):
-    category = ProductCategorySerializer(read_only=True) #  嵌套 ProductCategorySerializer，用于展示商品分类的详细信息
+
+class ProductCategorySummarySerializer(serializers.ModelSerializer):
+    """嵌套在商品里的分类, 不包含商品数, 避免任意商品变更都改变所有商品的响应"""
+
+    class Meta:
+        model = ProductCategory
+        fields = ['id', 'name', 'description']
+        read_only_fields = fields
+
+
+class ProductSummarySerializer(serializers.ModelSerializer):
+    """商品摘要, 用于关联商品等只需要展示卡片信息的场景, 不再嵌套任何关联数据"""
+    image_variants = ImageVariantsField(image_field='image')
+
+    class Meta:
+        model = Product
+        fields = ['id', 'name', 'price', 'image', 'image_variants', 'is_on_sale']
+        read_only_fields = fields
+
+
+class ProductListSerializer(serializers.ListSerializer):
+    """商品列表序列化器, 在逐个序列化之前一次性取出整页商品的关联商品"""
+
+    def to_representation(self, data):
+        items = list(data.all() if hasattr(data, 'all') else data)
+        # * 异步视图会提前用 aneighbors_for 取好, 这里只补齐缺失的部分; 稀疏字段集没有要关联商品时不查询
+        related_map = self.context.get('related_products') or {}
+        if 'related_products' in self.child.fields and not all(item.pk in related_map for item in items):
+            self.context['related_products'] = related_index.neighbors_for(items)
+        return super().to_representation(items)
+
+
+class ProductSerializer(SparseFieldsMixin, serializers.ModelSerializer):
+    category = ProductCategorySummarySerializer(read_only=True) #  嵌套分类摘要，用于展示商品分类的详细信息
     image = serializers.ImageField(required=False) #  ImageField 需要特别声明, required=False 表示图片不是必须的
+    image_variants = ImageVariantsField(image_field='image') # 各尺寸/格式衍生图的 URL, 用于客户端的 srcset
     related_products = serializers.SerializerMethodField(read_only=True)
 
     class Meta:
         model = Product
         fields = '__all__' # 使用 '__all__' 包含所有字段，简单起见，可以根据需要显式列出字段
         # fields = ['id', 'name', 'description', 'price', 'image', 'stock', 'is_on_sale', 'category'] #  也可以显式列出需要的字段
+        list_serializer_class = ProductListSerializer
+        read_only_fields = ['stock']    # ! 库存只能通过预留/补货接口原子地修改, 不允许客户端直接覆盖
+
+    # * ?expand= 可以展开的字段, 分类未展开时输出分类 id(见 core.sparse)
+    expandable_fields = {'category': 'category', 'related_products': None}
+
+    # * 编译后的列表序列化器(core.compiled)按整页计算关联商品, 需要额外取出 category_id
+    batch_value_fields = ['category_id']
+
+    @staticmethod
+    def batch_related_products(rows, context):
+        """一次取出整页 .values() 行的关联商品, 返回 {商品 id: 关联商品摘要列表}"""
+        neighbors = related_index.neighbors_for([Product(pk=row['id'], category_id=row['category_id']) for row in rows])
+        # 同一分类的商品共享关联商品, 每个关联商品只序列化一次
+        unique = {product.pk: product for products in neighbors.values() for product in products}
+        summaries = dict(zip(unique, ProductSummarySerializer(list(unique.values()), many=True, context=context).data))
+        return {pk: [summaries[product.pk] for product in products] for pk, products in neighbors.items()}
 
     def get_related_products(self, instance):
         """获取关联商品"""
         # TODO 等具体需求下来再对推荐做细化
         # * 获取同分类下的商品，排除当前商品,最多返回4个
-        related = Product.objects.filter(category=instance.category).exclude(id=instance.id)[:4]
-        # 序列化关联商品并返回data
-        return ProductSerializer(related, many=True, context={'request': self.context.get('request')}).data
+        # * 列表接口由 ProductListSerializer 预先批量取好, 单个商品时再单独查一次
+        related_map = self.context.get('related_products')
+        if related_map is None or instance.pk not in related_map:
+            related_map = related_index.neighbors_for([instance])
+        # ! 关联商品只用摘要序列化, 不会再递归获取关联商品
+        return ProductSummarySerializer(related_map[instance.pk], many=True, context=self.context).data
+
+
+class StockReservationItemSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = StockReservationItem
+        fields = ['product', 'quantity']
+
+
+class StockReservationSerializer(serializers.ModelSerializer):
+    items = StockReservationItemSerializer(many=True, read_only=True)
+
+    class Meta:
+        model = StockReservation
+        fields = ['id', 'status', 'expires_at', 'created_at', 'items']
+
+
+class ReservationLineSerializer(serializers.Serializer):
+    product = serializers.IntegerField()
+    quantity = serializers.IntegerField(min_value=1)
+
+
+class ReservationCreateSerializer(serializers.Serializer):
+    """创建库存预留的请求, items 为 [{"product": id, "quantity": n}, ...]"""
+    items = ReservationLineSerializer(many=True, allow_empty=False)
+
+    def validate_items(self, items):
+        # * 同一商品出现多次时合并数量, 返回 {product_id: 数量}
+        quantities = {}
+        for item in items:
+            quantities[item['product']] = quantities.get(item['product'], 0) + item['quantity']
+        existing = set(Product.objects.filter(pk__in=quantities).values_list('pk', flat=True))
+        missing = sorted(set(quantities) - existing)
+        if missing:
+            raise serializers.ValidationError(f'商品不存在: {missing}')
+        return quantities
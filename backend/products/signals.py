@@ -0,0 +1,99 @@
+from django.db.models.signals import pre_save, post_save, post_delete
+from django.dispatch import receiver
+
+from core.images import schedule_variants
+
+from . import sync, tree
+from .cache import bump_global_version, bump_product_versions
+from .models import CatalogTombstone, ProductCategory, Product
+from .related import related_index
+from .search import get_search_backend
+
+
+@receiver([post_save, post_delete], sender=Product)
+def invalidate_related_products(sender, instance, **kwargs):
+    """商品新增/修改/删除后作废关联商品索引中受影响的分类"""
+    related_index.invalidate(instance)
+
+
+@receiver(pre_save, sender=Product)
+def remember_previous_category(sender, instance, **kwargs):
+    """记录修改前的分类和促销状态, 商品换分类时旧分类的商品数和缓存也要更新"""
+    instance._previous_state = None
+    if instance.pk is not None:
+        instance._previous_state = Product.objects.filter(pk=instance.pk).values_list('category_id', 'is_on_sale').first()
+
+
+@receiver(post_save, sender=Product)
+def sync_category_on_save(sender, instance, raw=False, **kwargs):
+    """更新新旧分类及其祖先的商品数, 并递增商品和这些分类的缓存版本号(按分类筛选的列表包含子分类的商品)"""
+    if raw:
+        return
+    category_ids = tree.update_counts([(getattr(instance, '_previous_state', None), (instance.category_id, instance.is_on_sale))])
+    bump_product_versions(*category_ids)
+
+
+@receiver(post_delete, sender=Product)
+def sync_category_on_delete(sender, instance, **kwargs):
+    category_ids = tree.update_counts([((instance.category_id, instance.is_on_sale), None)])
+    bump_product_versions(*category_ids)
+
+
+@receiver(pre_save, sender=ProductCategory)
+def remember_category_path(sender, instance, raw=False, **kwargs):
+    """记录分类原来的路径, 父分类是自己的子分类时拒绝保存"""
+    if not raw:
+        tree.remember(instance)
+
+
+@receiver(post_save, sender=ProductCategory)
+def place_category(sender, instance, raw=False, **kwargs):
+    """计算新分类的路径, 换父分类时移动整棵子树"""
+    if not raw:
+        tree.place(instance)
+
+
+@receiver([post_save, post_delete], sender=ProductCategory)
+def bump_category_cache_version(sender, instance, **kwargs):
+    """分类变更会影响所有嵌套了分类信息的响应, 递增全局版本号"""
+    bump_global_version()
+
+
+@receiver(post_save, sender=Product)
+def index_product(sender, instance, **kwargs):
+    """同步商品搜索索引"""
+    get_search_backend().index(instance)
+
+
+@receiver(post_delete, sender=Product)
+def remove_product_from_index(sender, instance, **kwargs):
+    get_search_backend().remove(instance)
+
+
+@receiver(post_save, sender=Product)
+def build_product_image_variants(sender, instance, **kwargs):
+    """商品图片变化后在后台生成缩略图和 WebP/AVIF 衍生图"""
+    schedule_variants(instance, 'image', 'image_variants')
+
+
+@receiver(post_delete, sender=Product)
+def record_product_deletion(sender, instance, **kwargs):
+    """记录删除, 增量同步接口据此通知客户端"""
+    sync.record_deletion(CatalogTombstone.KIND_PRODUCT, instance.pk)
+
+
+@receiver(post_delete, sender=ProductCategory)
+def record_category_deletion(sender, instance, **kwargs):
+    sync.record_deletion(CatalogTombstone.KIND_CATEGORY, instance.pk)
+
+
+@receiver(post_save, sender=Product)
+def forget_product_deletion(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        sync.forget_deletion(CatalogTombstone.KIND_PRODUCT, instance.pk)
+
+
+@receiver(post_save, sender=ProductCategory)
+def forget_category_deletion(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        sync.forget_deletion(CatalogTombstone.KIND_CATEGORY, instance.pk)
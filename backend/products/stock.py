@@ -0,0 +1,130 @@
+"""
+库存预留
+
+所有库存变动都是带条件的 UPDATE (stock = stock - n WHERE stock >= n), 不做"先读后写", 并发下也不会超卖;
+多个商品的预留放在同一个事务里, 任何一个库存不足整单回滚。事务内按商品 id 顺序更新, 避免互相等锁形成死锁,
+并且事务里只有这几条 UPDATE 和预留记录的 INSERT, 持锁时间尽量短。
+
+库存变化后(事务提交后)递增商品所在分类及其祖先的缓存版本号, 目录接口的响应和 ETag 随之更新,
+带 If-None-Match 的客户端也能看到新的库存; 回滚的预留不会让缓存失效。
+"""
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from core.db import retry_on_lock
+
+from . import tree
+from .cache import bump_product_versions
+from .models import Product, StockReservation, StockReservationItem
+
+
+class InsufficientStock(Exception):
+    """库存不足"""
+
+    def __init__(self, product_id):
+        self.product_id = product_id
+        super().__init__(f'商品 {product_id} 库存不足')
+
+
+class ReservationStateError(Exception):
+    """预留状态不允许当前操作, 例如已经释放的预留再确认"""
+
+
+@retry_on_lock
+def reserve(quantities, user=None, ttl=None):
+    """
+    预留库存, quantities 为 {product_id: 数量}
+
+    成功返回 StockReservation, 任一商品库存不足时抛出 InsufficientStock, 不会扣减任何库存。
+    """
+    ttl = ttl if ttl is not None else settings.STOCK_RESERVATION_TTL
+    with transaction.atomic():
+        for product_id, quantity in sorted(quantities.items()):
+            updated = Product.objects.filter(pk=product_id, stock__gte=quantity).update(stock=F('stock') - quantity)
+            if not updated:
+                raise InsufficientStock(product_id)
+        invalidate_catalog(quantities)
+        reservation = StockReservation.objects.create(user=user, expires_at=timezone.now() + timedelta(seconds=ttl))
+        StockReservationItem.objects.bulk_create(
+            StockReservationItem(reservation=reservation, product_id=product_id, quantity=quantity)
+            for product_id, quantity in quantities.items()
+        )
+    return reservation
+
+
+@retry_on_lock
+def confirm(reservation):
+    """确认预留, 库存正式扣减; 已过期的预留不能再确认"""
+    updated = StockReservation.objects.filter(
+        pk=reservation.pk, status=StockReservation.STATUS_HELD, expires_at__gt=timezone.now(),
+    ).update(status=StockReservation.STATUS_CONFIRMED)
+    if not updated:
+        raise ReservationStateError('预留已过期或已处理')
+    reservation.status = StockReservation.STATUS_CONFIRMED
+    return reservation
+
+
+@retry_on_lock
+def release(reservation):
+    """释放预留, 把库存加回去; 通过状态条件更新保证同一预留只会释放一次"""
+    with transaction.atomic():
+        updated = StockReservation.objects.filter(
+            pk=reservation.pk, status=StockReservation.STATUS_HELD,
+        ).update(status=StockReservation.STATUS_RELEASED)
+        if not updated:
+            raise ReservationStateError('预留已确认或已释放')
+        items = sorted(reservation.items.values_list('product_id', 'quantity'))
+        for product_id, quantity in items:
+            Product.objects.filter(pk=product_id).update(stock=F('stock') + quantity)
+        invalidate_catalog([product_id for product_id, _ in items])
+    reservation.status = StockReservation.STATUS_RELEASED
+    return reservation
+
+
+def invalidate_catalog(product_ids):
+    """
+    事务提交后递增商品所在分类及其祖先的缓存版本号(按分类筛选的列表包含子分类的商品)
+
+    分类的路径里就是所有祖先的 id, 一次查询即可; 必须在事务里调用。
+    """
+    paths = Product.objects.filter(pk__in=product_ids).values_list('category__path', flat=True).distinct()
+    category_ids = {pk for path in paths for pk in tree.ancestor_ids(path)}
+    transaction.on_commit(lambda: bump_product_versions(*category_ids))
+
+
+def release_expired(now=None):
+    """释放所有过期未确认的预留, 返回释放的数量"""
+    now = now or timezone.now()
+    released = 0
+    expired = StockReservation.objects.filter(status=StockReservation.STATUS_HELD, expires_at__lte=now)
+    for reservation in list(expired):
+        try:
+            release(reservation)
+        except ReservationStateError:
+            continue    # 并发中已被确认或释放
+        released += 1
+    return released
+
+
+@retry_on_lock
+def restock(product, quantity):
+    """补货, 原子地增加库存"""
+    with transaction.atomic():
+        Product.objects.filter(pk=product.pk).update(stock=F('stock') + quantity)
+        invalidate_catalog([product.pk])
+
+
+@retry_on_lock
+def restock_many(queryset, quantity):
+    """批量补货, 一条 UPDATE 完成, 返回补货的商品数"""
+    with transaction.atomic():
+        category_ids = set(queryset.order_by().values_list('category_id', flat=True).distinct())
+        updated = queryset.update(stock=F('stock') + quantity)
+        # * 按分类筛选的列表包含子分类的商品, 祖先分类的缓存也要失效; 提交后再递增版本号, 同 invalidate_catalog
+        affected = tree.shift_counts(dict.fromkeys(category_ids, (0, 0)))
+        transaction.on_commit(lambda: bump_product_versions(*affected))
+    return updated
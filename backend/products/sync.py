@@ -0,0 +1,160 @@
+"""
+商品目录的增量同步
+
+客户端第一次不带 since 拉取全部商品和分类, 之后每次带上一次返回的 next, 只拿到这之后新增/修改的数据和被删除的 id。
+商品、分类按 (updated_at, id) 索引做 keyset 翻页, 删除记录按 (deleted_at, id) 翻页, 同步令牌里记录三者各自的位置;
+每批三条走索引的范围查询, 与目录总量无关。
+
+! 只返回 SETTLE_SECONDS 之前的变更: updated_at 是在事务提交之前写入的, 还没提交的事务可能写入比已返回位置更早的时间,
+  留出这段时间等它们提交, 否则会被跳过。同理不能从只读副本读取, 副本延迟同样会导致遗漏。
+! 通过 update() 修改的库存不会更新 updated_at, 同步数据不包含库存, 客户端需要时从商品详情获取实时库存。
+"""
+import json
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from rest_framework import serializers
+
+from core.compiled import CompiledSerializer
+
+from .models import CatalogTombstone, ProductCategory, Product
+
+
+class InvalidSyncToken(ValueError):
+    """同步令牌无法解析"""
+
+
+class SyncTokenExpired(Exception):
+    """同步令牌早于删除记录的保留期, 客户端需要重新全量同步"""
+
+
+class ProductSyncSerializer(serializers.ModelSerializer):
+    """同步用的紧凑商品数据: 分类只给 id, 不含关联商品和库存"""
+
+    class Meta:
+        model = Product
+        fields = ['id', 'category', 'sku', 'name', 'description', 'price', 'image', 'image_variants', 'is_on_sale',
+                  'created_at', 'updated_at']
+        read_only_fields = fields
+
+
+class CategorySyncSerializer(serializers.ModelSerializer):
+    """同步用的分类数据, path/depth/商品数由客户端根据 parent 和本地商品自行计算"""
+
+    class Meta:
+        model = ProductCategory
+        fields = ['id', 'name', 'description', 'parent', 'updated_at']
+        read_only_fields = fields
+
+
+def encode_token(positions):
+    data = {key: [timestamp.isoformat(), pk] for key, (timestamp, pk) in positions.items()}
+    return urlsafe_b64encode(json.dumps(data, separators=(',', ':')).encode()).decode('ascii')
+
+
+def decode_token(token):
+    """返回 {'p'|'c'|'t': (时间, id 或 None)}, id 为 None 表示该时间及之前的数据都已同步"""
+    try:
+        data = json.loads(urlsafe_b64decode(token.encode('ascii')))
+        positions = {}
+        for key in ('p', 'c', 't'):
+            timestamp, pk = data[key]
+            timestamp = parse_datetime(timestamp)
+            # ! 不带时区的时间与数据库里的时间比较会抛出 TypeError, 令牌只会由 encode_token 生成带时区的时间
+            if timestamp is None or timezone.is_naive(timestamp) or (pk is not None and not isinstance(pk, int)):
+                raise ValueError
+            positions[key] = (timestamp, pk)
+        return positions
+    except (TypeError, ValueError, KeyError):
+        raise InvalidSyncToken('无效的同步令牌.')
+
+
+def after(queryset, field, position):
+    """keyset 条件 (field, id) > position"""
+    if position is None:
+        return queryset
+    timestamp, pk = position
+    if pk is None:
+        return queryset.filter(**{f'{field}__gt': timestamp})
+    # ! 与游标分页相同的写法, 可以直接在 (field, id) 索引上做范围扫描
+    return queryset.filter(Q(**{f'{field}__gte': timestamp}), Q(**{f'{field}__gt': timestamp}) | Q(id__gt=pk))
+
+
+def fetch(queryset, field, position, upper, limit):
+    """取一批 (field, id) 在 position 之后、upper 之前的数据, 返回 (数据, 新位置, 是否还有更多)"""
+    rows = list(after(queryset.filter(**{f'{field}__lte': upper}), field, position).order_by(field, 'id')[:limit + 1])
+    if len(rows) > limit:
+        last = rows[limit - 1]
+        return rows[:limit], (last[field], last['id']), True
+    # 这一批已经取完 upper 之前的全部数据
+    return rows, (upper, None), False
+
+
+def changes(since=None, limit=None, context=None):
+    """
+    返回 since 之后的一批变更, since 为 None 时从头开始全量同步
+
+    limit 是每种数据每批最多返回的条数, 有任意一种没取完时 has_more 为 True, 客户端应该立即用 next 继续拉取。
+    """
+    config = settings.CATALOG_SYNC
+    limit = limit or config['BATCH_SIZE']
+    now = timezone.now()
+    upper = now - timedelta(seconds=config['SETTLE_SECONDS'])
+    if since is None:
+        # * 全量同步不需要删除记录, 从当前位置开始
+        positions = {'p': None, 'c': None, 't': (upper, None)}
+    else:
+        positions = decode_token(since)
+        if positions['t'][0] < now - timedelta(seconds=config['TOMBSTONE_TTL']):
+            raise SyncTokenExpired('同步令牌已过期, 请重新全量同步.')
+
+    context = context or {}
+    product_serializer = CompiledSerializer(ProductSyncSerializer, context)
+    category_serializer = CompiledSerializer(CategorySyncSerializer, context)
+    products, positions['p'], more_products = fetch(
+        product_serializer.values(Product.objects.all()), 'updated_at', positions['p'], upper, limit,
+    )
+    categories, positions['c'], more_categories = fetch(
+        category_serializer.values(ProductCategory.objects.all()), 'updated_at', positions['c'], upper, limit,
+    )
+    tombstones, positions['t'], more_tombstones = fetch(
+        CatalogTombstone.objects.values('id', 'kind', 'object_id', 'deleted_at'), 'deleted_at', positions['t'], upper, limit,
+    )
+    deleted = {'products': [], 'categories': []}
+    for tombstone in tombstones:
+        deleted['products' if tombstone['kind'] == CatalogTombstone.KIND_PRODUCT else 'categories'].append(tombstone['object_id'])
+    return {
+        'products': product_serializer.serialize(products),
+        'categories': category_serializer.serialize(categories),
+        'deleted': deleted,
+        'next': encode_token(positions),
+        'has_more': more_products or more_categories or more_tombstones,
+    }
+
+
+def record_deletion(kind, object_id):
+    """写入删除记录, 同一对象重复删除时只更新删除时间"""
+    CatalogTombstone.objects.bulk_create(
+        [CatalogTombstone(kind=kind, object_id=object_id, deleted_at=timezone.now())],
+        update_conflicts=True, unique_fields=['kind', 'object_id'], update_fields=['deleted_at'],
+    )
+
+
+def forget_deletion(kind, object_id):
+    """
+    新建对象时清掉同一 id 的删除记录
+
+    ! SQLite 会复用最大的已删除主键, 否则客户端可能先收到新对象, 再按旧的删除记录把它删掉。
+    """
+    CatalogTombstone.objects.filter(kind=kind, object_id=object_id).delete()
+
+
+def prune_tombstones():
+    """删除超过保留期的删除记录, 返回删除的数量"""
+    cutoff = timezone.now() - timedelta(seconds=settings.CATALOG_SYNC['TOMBSTONE_TTL'])
+    deleted, _ = CatalogTombstone.objects.filter(deleted_at__lt=cutoff).delete()
+    return deleted
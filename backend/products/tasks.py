@@ -0,0 +1,52 @@
+"""商品目录的后台任务, 由 core.jobs 的 worker 自动导入"""
+from io import BytesIO
+from urllib.parse import urlsplit
+
+from django.conf import settings
+from django.core.handlers.wsgi import WSGIRequest
+from django.db import transaction
+from django.urls import resolve
+
+from core import jobs
+
+from .search import get_search_backend
+
+
+@jobs.task(max_attempts=1)
+def rebuild_search_index():
+    """重建商品全文搜索索引, 商品多时要几分钟, 由 rebuild_search_index --background 入队"""
+    with transaction.atomic():
+        get_search_backend().rebuild()
+
+
+def warm_request(url):
+    """为预热构造一个匿名的 GET 请求"""
+    url = urlsplit(url)
+    secure = url.scheme == 'https'
+    return WSGIRequest({
+        'REQUEST_METHOD': 'GET',
+        'PATH_INFO': url.path,
+        'QUERY_STRING': url.query,
+        'HTTP_HOST': url.netloc or 'localhost',
+        'SERVER_NAME': url.hostname or 'localhost',
+        'SERVER_PORT': str(url.port or (443 if secure else 80)),
+        'SERVER_PROTOCOL': 'HTTP/1.1',
+        'wsgi.url_scheme': 'https' if secure else 'http',
+        'wsgi.input': BytesIO(),
+    })
+
+
+@jobs.task(max_attempts=2)
+def warm_catalog_cache():
+    """
+    请求一遍 CATALOG_CACHE['WARM_URLS'], 把响应写进目录缓存
+
+    缓存键里有主机名, 地址要写成客户端实际访问的完整 URL。
+    """
+    for url in settings.CATALOG_CACHE['WARM_URLS']:
+        request = warm_request(url)
+        match = resolve(request.path_info)
+        request.resolver_match = match
+        response = match.func(request, *match.args, **match.kwargs)
+        if response.status_code != 200:
+            raise RuntimeError(f'预热 {url} 失败: HTTP {response.status_code}')
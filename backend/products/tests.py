@@ -1,3 +1,1137 @@
-from django.test import TestCase
+import json
+import re
+import threading
+import shutil
+import tempfile
+from datetime import timedelta
+from decimal import Decimal
+from io import BytesIO, StringIO
+from unittest import mock
 
-# Create your tests here.
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from PIL import Image
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+
+from core import sparse
+
+from . import stock, sync, tree
+from .models import CatalogTombstone, ProductCategory, Product, StockReservation
+from .cache import bump_product_versions
+from .related import related_index
+from .search import get_search_backend
+from .views import ProductCategoryViewSet, ProductViewSet
+
+
+class RelatedProductsTests(TestCase):
+    """关联商品索引"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.phones = ProductCategory.objects.create(name='手机')
+        cls.books = ProductCategory.objects.create(name='图书')
+        for i in range(6):
+            Product.objects.create(category=cls.phones, name=f'手机{i}', price=Decimal('999.00'))
+            Product.objects.create(category=cls.books, name=f'图书{i}', price=Decimal('39.90'))
+
+    def setUp(self):
+        cache.clear()
+        related_index.clear()
+
+    def test_related_products_are_flat_and_bounded(self):
+        product = Product.objects.filter(category=self.phones).first()
+        response = self.client.get(reverse('product-detail', args=[product.pk]))
+        related = response.json()['related_products']
+        self.assertEqual(len(related), 4)
+        self.assertNotIn(product.pk, [item['id'] for item in related])
+        self.assertNotIn('related_products', related[0])
+
+    def test_whole_page_is_loaded_in_one_query(self):
+        products = list(Product.objects.all())
+        with self.assertNumQueries(1):
+            related_map = related_index.neighbors_for(products)
+        self.assertEqual(len(related_map), 12)
+        with self.assertNumQueries(0):
+            related_index.neighbors_for(products)
+
+    def test_save_invalidates_category(self):
+        product = Product.objects.filter(category=self.books).order_by('id').first()
+        other = Product.objects.filter(category=self.books).order_by('id').last()
+        self.assertIn(product.pk, [n.pk for n in related_index.neighbors_for([other])[other.pk]])
+
+        product.category = self.phones
+        product.save()
+        self.assertNotIn(product.pk, [n.pk for n in related_index.neighbors_for([other])[other.pk]])
+
+    def test_other_process_writes_are_picked_up(self):
+        other = Product.objects.filter(category=self.books).order_by('id').last()
+        first = Product.objects.filter(category=self.books).order_by('id').first()
+        related_index.neighbors_for([other])
+        # 别的进程修改了商品: 本进程的索引没有收到信号, 只有缓存里的版本号变了
+        Product.objects.filter(pk=first.pk).update(price=Decimal('1.00'))
+        bump_product_versions(self.books.pk)
+        neighbors = related_index.neighbors_for([other])[other.pk]
+        self.assertEqual(next(n.price for n in neighbors if n.pk == first.pk), Decimal('1.00'))
+
+    def test_load_racing_invalidation_is_not_stored(self):
+        other = Product.objects.filter(category=self.books).order_by('id').last()
+        load_queryset = related_index._load_queryset
+
+        def invalidate_during_load(category_ids):
+            rows = list(load_queryset(category_ids))
+            related_index.invalidate(other)
+            return rows
+
+        with mock.patch.object(related_index, '_load_queryset', invalidate_during_load):
+            self.assertEqual(len(related_index.neighbors_for([other])[other.pk]), 4)
+        with self.assertNumQueries(1):
+            related_index.neighbors_for([other])
+
+
+class ProductQueryCountTests(TestCase):
+    """商品接口的 SQL 数量不随页大小增长, 防止 N+1 回归"""
+
+    @classmethod
+    def setUpTestData(cls):
+        categories = [ProductCategory.objects.create(name=f'分类{i}') for i in range(5)]
+        for i in range(30):
+            Product.objects.create(category=categories[i % 5], name=f'商品{i}', description='测试描述', price=Decimal(i))
+        cls.product = Product.objects.first()
+
+    def setUp(self):
+        cache.clear()
+        related_index.clear()
+
+    def assertListQueries(self, num, params):
+        for page_size in (1, 10, 30):
+            cache.clear()
+            related_index.clear()
+            with self.subTest(page_size=page_size), self.assertNumQueries(num):
+                response = self.client.get(reverse('product-list'), {**params, 'page_size': page_size})
+            self.assertEqual(response.status_code, 200)
+
+    def test_list(self):
+        self.assertListQueries(3, {})  # count + 商品页(JOIN 分类) + 关联商品
+
+    def test_search(self):
+        self.assertListQueries(3, {'search': '商品'})
+
+    def test_filter_and_ordering(self):
+        self.assertListQueries(3, {'is_on_sale': 'false', 'ordering': 'price'})
+
+    def test_detail(self):
+        with self.assertNumQueries(2):  # 商品(JOIN 分类) + 关联商品
+            response = self.client.get(reverse('product-detail', args=[self.product.pk]))
+        self.assertEqual(response.json()['category']['id'], self.product.category_id)
+
+
+class CatalogCacheTests(TestCase):
+    """商品目录响应缓存"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.phones = ProductCategory.objects.create(name='手机')
+        cls.books = ProductCategory.objects.create(name='图书')
+        cls.phone = Product.objects.create(category=cls.phones, name='手机', price=Decimal('999.00'))
+        cls.book = Product.objects.create(category=cls.books, name='图书', price=Decimal('39.90'))
+
+    def setUp(self):
+        cache.clear()
+        related_index.clear()
+
+    def test_hit_runs_no_queries(self):
+        url = reverse('product-list')
+        first = self.client.get(url, {'page_size': 5, 'ordering': 'price'})
+        with self.assertNumQueries(0):
+            # * 参数顺序不同也命中同一个缓存
+            second = self.client.get(url, {'ordering': 'price', 'page_size': 5})
+        self.assertEqual(first.json(), second.json())
+        self.assertEqual(first['ETag'], second['ETag'])
+        self.assertIn('Last-Modified', second)
+
+    def test_if_none_match_returns_304(self):
+        url = reverse('product-detail', args=[self.phone.pk])
+        etag = self.client.get(url)['ETag']
+        with self.assertNumQueries(0):
+            response = self.client.get(url, headers={'if-none-match': etag})
+        self.assertEqual(response.status_code, 304)
+
+    def test_product_save_invalidates_its_category_only(self):
+        url = reverse('product-list')
+        books = self.client.get(url, {'category': self.books.pk})
+        phones = self.client.get(url, {'category': self.phones.pk})
+
+        self.phone.price = Decimal('888.00')
+        self.phone.save()
+
+        self.assertEqual(self.client.get(url, {'category': self.books.pk})['ETag'], books['ETag'])
+        response = self.client.get(url, {'category': self.phones.pk})
+        self.assertNotEqual(response['ETag'], phones['ETag'])
+        self.assertEqual(response.json()['results'][0]['price'], '888.00')
+
+    def test_category_save_invalidates_everything(self):
+        products = self.client.get(reverse('product-list'))
+        categories = self.client.get(reverse('productcategory-list'))
+
+        self.books.name = '书籍'
+        self.books.save()
+
+        self.assertNotEqual(self.client.get(reverse('product-list'))['ETag'], products['ETag'])
+        response = self.client.get(reverse('productcategory-list'))
+        self.assertNotEqual(response['ETag'], categories['ETag'])
+        self.assertIn('书籍', [item['name'] for item in response.json()])
+
+
+class ProductSearchTests(TestCase):
+    """商品全文搜索"""
+
+    @classmethod
+    def setUpTestData(cls):
+        category = ProductCategory.objects.create(name='数码')
+        cls.phone = Product.objects.create(category=category, name='华为智能手机', description='5G 全网通', price=Decimal('3999.00'))
+        cls.case = Product.objects.create(category=category, name='保护壳', description='适用于华为手机', price=Decimal('29.00'))
+        cls.laptop = Product.objects.create(category=category, name='MacBook Pro', description='笔记本电脑', price=Decimal('12999.00'))
+
+    def setUp(self):
+        cache.clear()
+        related_index.clear()
+
+    def search(self, term, **params):
+        response = self.client.get(reverse('product-list'), {'search': term, **params})
+        return [item['id'] for item in response.json()['results']]
+
+    def test_chinese_substring_ranked_by_name_first(self):
+        self.assertEqual(self.search('手机'), [self.phone.pk, self.case.pk])
+
+    def test_prefix_and_multiple_terms(self):
+        self.assertEqual(self.search('macb'), [self.laptop.pk])
+        self.assertEqual(self.search('华为 保护'), [self.case.pk])
+
+    def test_explicit_ordering_overrides_rank(self):
+        self.assertEqual(self.search('手机', ordering='price'), [self.case.pk, self.phone.pk])
+
+    def test_index_follows_save_and_delete(self):
+        self.laptop.name = '轻薄笔记本'
+        self.laptop.save()
+        self.assertEqual(self.search('轻薄'), [self.laptop.pk])
+        self.assertEqual(self.search('macbook'), [])
+
+        self.laptop.delete()
+        self.assertEqual(self.search('轻薄'), [])
+
+    def test_rank_computed_by_join(self):
+        # 相关度不能用相关子查询计算, 否则每个命中的商品都要重新执行一次 MATCH
+        with CaptureQueriesContext(connection) as queries:
+            self.search('手机')
+        with connection.cursor() as cursor:
+            cursor.execute('EXPLAIN QUERY PLAN ' + queries.captured_queries[-1]['sql'])
+            plan = ' '.join(str(row) for row in cursor.fetchall())
+        self.assertNotIn('CORRELATED', plan)
+
+    def test_search_inside_subquery(self):
+        # 表别名交给 ORM 生成, 搜索结果可以作为子查询嵌进别的查询
+        backend = get_search_backend()
+        matches = backend.filter_queryset(Product.objects.all(), ['手机']).values('pk')
+        self.assertCountEqual(Product.objects.filter(pk__in=matches), [self.phone, self.case])
+        self.assertEqual(backend.filter_matches(Product.objects.all(), ['macb']).update(stock=7), 1)
+
+
+class ProductCursorPaginationTests(TestCase):
+    """商品列表游标分页"""
+
+    @classmethod
+    def setUpTestData(cls):
+        category = ProductCategory.objects.create(name='数码')
+        # * 价格有大量重复值, 用来验证 (price, id) 游标的稳定性
+        for i in range(25):
+            Product.objects.create(category=category, name=f'商品{i}', price=Decimal(i % 3))
+
+    def setUp(self):
+        cache.clear()
+        related_index.clear()
+
+    def collect(self, **params):
+        ids = []
+        url, params = reverse('product-list'), {'pagination': 'cursor', 'page_size': 4, **params}
+        while url:
+            related_index.clear()
+            with self.assertNumQueries(2):  # 商品页 + 关联商品, 没有 COUNT(*)
+                data = self.client.get(url, params).json()
+            ids.extend(item['id'] for item in data['results'])
+            url, params = data['next'], {}
+        return ids
+
+    def test_walks_default_ordering_without_gaps(self):
+        expected = list(Product.objects.order_by('-created_at', '-id').values_list('id', flat=True))
+        self.assertEqual(self.collect(), expected)
+
+    def test_price_ordering_with_ties(self):
+        expected = list(Product.objects.order_by('price', 'id').values_list('id', flat=True))
+        self.assertEqual(self.collect(ordering='price'), expected)
+
+    def test_insert_between_pages_is_not_duplicated(self):
+        data = self.client.get(reverse('product-list'), {'pagination': 'cursor', 'page_size': 5}).json()
+        Product.objects.create(category=ProductCategory.objects.first(), name='新商品', price=Decimal('1'))
+        next_page = self.client.get(data['next']).json()
+        first_ids = {item['id'] for item in data['results']}
+        self.assertFalse(first_ids & {item['id'] for item in next_page['results']})
+
+    def test_optional_count_and_default_mode(self):
+        response = self.client.get(reverse('product-list'), {'pagination': 'cursor', 'with_count': 1})
+        self.assertEqual(response.json()['count'], 25)
+        self.assertIn('count', self.client.get(reverse('product-list')).json())
+
+    def test_cursor_bound_to_ordering(self):
+        data = self.client.get(reverse('product-list'), {'pagination': 'cursor', 'page_size': 5}).json()
+        response = self.client.get(data['next'] + '&ordering=price')
+        self.assertEqual(response.status_code, 404)
+
+
+class ProductIndexPlanTests(TestCase):
+    """
+    用 EXPLAIN QUERY PLAN 检查商品列表接口暴露的每个 筛选 x 排序 组合都能走索引
+
+    有筛选条件时必须按索引前缀查找(SEARCH ... USING INDEX); 沿索引逐行扫描(SCAN ... USING INDEX)再过滤
+    等同于遍历整张表, 只有未筛选的列表允许这样按排序读取; 任何组合都不允许为 ORDER BY 建临时 B 树。
+    全文搜索的结果集由 FTS 索引先行缩小, 按相关度排序本身就需要排序, 不在检查范围内;
+    按有子分类的分类筛选时要合并多个分类的索引区间, 同样需要排序, 这里的分类是叶子分类。
+    ! 空表或没有统计信息时查询规划器只能靠猜, 先写入一批分布接近真实数据的商品再 ANALYZE。
+    """
+    filters = [{}, {'category': None}, {'is_on_sale': 'true'}, {'is_on_sale': 'false'}, {'price': '9.90'},
+               {'category': None, 'is_on_sale': 'true'}]
+    orderings = ['-created_at', 'created_at', '-updated_at', 'updated_at', '-price', 'price']
+    index_search = re.compile(r'SEARCH products_product USING (COVERING )?INDEX \w+ \(')
+    index_scan = re.compile(r'SCAN products_product USING (COVERING )?INDEX ')
+    sort = re.compile(r'TEMP B-TREE')
+
+    @classmethod
+    def setUpTestData(cls):
+        categories = ProductCategory.objects.bulk_create(ProductCategory(name=f'分类{i}') for i in range(20))
+        cls.category = categories[0]
+        Product.objects.bulk_create(
+            Product(category=categories[i % 20], name=f'商品{i}', price=Decimal(i % 100) + Decimal('0.90'), is_on_sale=i % 10 == 0)
+            for i in range(2000)
+        )
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+
+    def filtered_queryset(self, params):
+        view = ProductViewSet(request=Request(APIRequestFactory().get('/', params)), action='list', format_kwarg=None, kwargs={})
+        return view.filter_queryset(view.get_queryset())
+
+    def test_filter_order_matrix_uses_indexes(self):
+        for filters in self.filters:
+            params = {key: value or self.category.pk for key, value in filters.items()}
+            for ordering in self.orderings:
+                queryset = self.filtered_queryset({**params, 'ordering': ordering})
+                # * 页码分页按单个字段排序, 游标分页额外按 id 排序
+                cursor_queryset = queryset.order_by(ordering, '-id' if ordering.startswith('-') else 'id')
+                for mode, qs in (('page', queryset), ('cursor', cursor_queryset)):
+                    with self.subTest(filters=filters, ordering=ordering, mode=mode):
+                        plan = qs.explain()
+                        self.assertIsNone(self.sort.search(plan), plan)
+                        if filters:
+                            self.assertIsNotNone(self.index_search.search(plan), plan)
+                            self.assertNotIn('SCAN products_product', plan)
+                        else:
+                            self.assertIsNotNone(self.index_scan.search(plan), plan)
+
+    def test_category_lookups_use_composite_indexes(self):
+        # 外键没有单独的索引, 按分类的查询(关联商品、分类筛选)走以 category 开头的组合索引
+        with connection.cursor() as cursor:
+            indexes = [index['columns'] for index in connection.introspection.get_constraints(cursor, Product._meta.db_table).values() if index['index']]
+        self.assertNotIn(['category_id'], indexes)
+        plan = Product.objects.filter(category_id__in=[self.category.pk, 0], is_on_sale=True).explain()
+        self.assertRegex(plan, r'SEARCH products_product USING (COVERING )?INDEX product_cat_\w+ \(category_id=\?\)')
+
+
+@override_settings(JOBS={**settings.JOBS, 'EAGER': True}, IMAGE_VARIANT_FORMATS=['webp', 'jpeg'])
+class ImageVariantTests(TestCase):
+    """商品图片衍生图"""
+
+    def setUp(self):
+        cache.clear()
+        related_index.clear()
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root, ignore_errors=True)
+        self.enterContext(override_settings(MEDIA_ROOT=self.media_root))
+
+    def make_image(self):
+        buffer = BytesIO()
+        Image.new('RGB', (1600, 900), 'red').save(buffer, 'JPEG')
+        return SimpleUploadedFile('phone.jpg', buffer.getvalue(), content_type='image/jpeg')
+
+    def test_variants_generated_after_commit_and_exposed(self):
+        category = ProductCategory.objects.create(name='数码')
+        with self.captureOnCommitCallbacks(execute=True):
+            product = Product.objects.create(category=category, name='手机', price=Decimal('1'), image=self.make_image())
+        product.refresh_from_db()
+        self.assertEqual(product.image_variants['source'], product.image.name)
+        thumb = product.image_variants['variants']['thumb']['webp']
+        with product.image.storage.open(thumb) as f:
+            self.assertEqual(Image.open(f).size, (200, 200))
+        with product.image.storage.open(product.image_variants['variants']['small']['jpeg']) as f:
+            self.assertEqual(Image.open(f).size, (480, 270))
+
+        data = self.client.get(reverse('product-detail', args=[product.pk])).json()
+        self.assertTrue(data['image_variants']['thumb']['webp'].startswith('http://testserver/media/products/variants/'))
+
+    def test_variants_bump_updated_at_for_sync(self):
+        category = ProductCategory.objects.create(name='数码')
+        with self.captureOnCommitCallbacks() as callbacks:
+            product = Product.objects.create(category=category, name='手机', price=Decimal('1'), image=self.make_image())
+        before = Product.objects.values_list('updated_at', flat=True).get(pk=product.pk)
+        for callback in callbacks:
+            callback()
+        product.refresh_from_db()
+        self.assertIn('thumb', product.image_variants['variants'])
+        # * 增量同步按 updated_at 翻页, 已经同步过这个商品的客户端也能拿到衍生图
+        self.assertGreater(product.updated_at, before)
+
+    def test_unchanged_image_is_not_reprocessed(self):
+        category = ProductCategory.objects.create(name='数码')
+        with self.captureOnCommitCallbacks(execute=True):
+            product = Product.objects.create(category=category, name='手机', price=Decimal('1'), image=self.make_image())
+        product.refresh_from_db()
+        with self.captureOnCommitCallbacks() as callbacks:
+            product.stock = 5
+            product.save()
+        self.assertEqual(callbacks, [])
+
+
+class AsyncCatalogTests(TestCase):
+    """ASGI 原生接口与 DRF 接口输出一致"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.phones = ProductCategory.objects.create(name='手机')
+        for i in range(15):
+            Product.objects.create(category=cls.phones, name=f'手机{i}', price=Decimal(i), is_on_sale=i % 2 == 0)
+
+    def setUp(self):
+        cache.clear()
+        related_index.clear()
+
+    async def assertSameResponse(self, async_url, sync_url, params=None):
+        async_response = await self.async_client.get(async_url, params or {})
+        sync_response = await self.async_client.get(sync_url, params or {})
+        self.assertEqual(async_response.status_code, sync_response.status_code)
+        # * 分页链接指向各自的路径, 其余内容应完全一致
+        self.assertEqual(async_response.content.decode().replace('/api/async/', '/api/'), sync_response.content.decode())
+
+    async def test_product_list(self):
+        for params in ({}, {'page': 2, 'page_size': 4, 'ordering': 'price'}, {'category': self.phones.pk, 'is_on_sale': 'true'},
+                       {'search': '手机1'}, {'page': 99}, {'facets': 'true', 'price__gte': '3'},
+                       {'fields': 'id,name', 'expand': 'category'}, {'fields': 'bogus'}):
+            with self.subTest(params=params):
+                await self.assertSameResponse(reverse('async-product-list'), reverse('product-list'), params)
+
+    async def test_empty_fields_outputs_everything(self):
+        response = await self.async_client.get(reverse('async-product-list'), {'fields': ''})
+        expected = await self.async_client.get(reverse('product-list'))
+        self.assertEqual(response.json()['results'], expected.json()['results'])
+
+    async def test_product_detail_and_categories(self):
+        product = await Product.objects.afirst()
+        await self.assertSameResponse(reverse('async-product-detail', args=[product.pk]), reverse('product-detail', args=[product.pk]))
+        await self.assertSameResponse(reverse('async-product-detail', args=[0]), reverse('product-detail', args=[0]))
+        await self.assertSameResponse(reverse('async-productcategory-list'), reverse('productcategory-list'))
+
+
+class BulkImportExportTests(TestCase):
+    """商品批量导入/导出"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_user('admin', 'admin@example.com', 'pass', is_staff=True)
+        cls.phones = ProductCategory.objects.create(name='手机')
+        Product.objects.create(category=cls.phones, sku='P-1', name='旧名称', price=Decimal('1.00'))
+
+    def setUp(self):
+        cache.clear()
+        related_index.clear()
+        self.client.force_login(self.admin)
+
+    def upload(self, name, content, **data):
+        upload = SimpleUploadedFile(name, content if isinstance(content, bytes) else content.encode('utf-8'))
+        return self.client.post(reverse('product-bulk-import'), {'file': upload, **data})
+
+    def test_csv_upsert_with_row_errors(self):
+        content = (
+            'sku,name,description,price,stock,is_on_sale,category\n'
+            'P-1,新名称,,2.50,3,true,手机\n'
+            'P-2,耳机,蓝牙耳机,99,,,手机\n'
+            'P-3,坏价格,,abc,1,false,手机\n'
+            'P-4,平板,,1999,1,false,平板\n'
+        )
+        report = self.upload('products.csv', content, batch_size=2).json()
+        self.assertEqual(report['processed'], 4)
+        self.assertEqual(report['imported'], 2)
+        self.assertEqual([error['row'] for error in report['errors']], [3, 4])
+        self.assertIn('price', report['errors'][0]['errors'])
+
+        updated = Product.objects.get(sku='P-1')
+        self.assertEqual((updated.name, updated.price, updated.is_on_sale), ('新名称', Decimal('2.50'), True))
+        self.assertEqual(Product.objects.get(sku='P-2').stock, 0)
+        # * 导入的数据同步到搜索索引
+        results = self.client.get(reverse('product-list'), {'search': '蓝牙'}).json()['results']
+        self.assertEqual([item['sku'] for item in results], ['P-2'])
+
+    def test_jsonl_create_categories(self):
+        content = '{"sku": "P-9", "name": "平板", "price": "1999.00", "category": "平板"}\nnot json\n'
+        report = self.upload('products.jsonl', content, create_categories='true').json()
+        self.assertEqual(report['imported'], 1)
+        self.assertEqual(report['errors'][0]['row'], 2)
+        self.assertTrue(ProductCategory.objects.filter(name='平板').exists())
+
+    def test_malformed_rows_are_reported(self):
+        content = '123\n[1]\n"text"\n'.encode() + b'{"sku": "\xff"}\n' + '{"sku": "P-8", "name": "耳机", "price": "9", "category": "手机"}\n'.encode()
+        report = self.upload('products.jsonl', content).json()
+        self.assertEqual(report['imported'], 1)
+        self.assertEqual([error['row'] for error in report['errors']], [1, 2, 3, 4])
+
+        content = 'sku,name,price,category\nP-7,'.encode() + b'\xb6\xfa\xbb\xfa' + ',9,手机\nP-6,耳机,9,手机\n'.encode()
+        report = self.upload('products.csv', content).json()
+        self.assertEqual((report['imported'], [error['row'] for error in report['errors']]), (1, [1]))
+        self.assertFalse(Product.objects.filter(sku='P-7').exists())
+
+    def test_row_numbers_match_file_lines(self):
+        content = '\n{"sku": "P-9", "name": "平板", "price": "1999.00", "category": "手机"}\n\n\nnot json\n'
+        report = self.upload('products.jsonl', content).json()
+        self.assertEqual((report['imported'], [error['row'] for error in report['errors']]), (1, [5]))
+
+        content = 'sku,name,description,price,category\nP-8,耳机,"两行\n描述",abc,手机\n\nP-7,耳机,,abc,手机\n'
+        report = self.upload('products.csv', content).json()
+        self.assertEqual([error['row'] for error in report['errors']], [1, 4])
+
+    def test_ambiguous_category_name_is_rejected(self):
+        ProductCategory.objects.create(name='手机', parent=ProductCategory.objects.create(name='二手'))
+        report = self.upload('products.csv', 'sku,name,price,category\nP-9,耳机,9,手机\nP-8,耳机,9,二手\n', create_categories='true').json()
+        self.assertEqual(report['imported'], 1)
+        self.assertEqual([error['row'] for error in report['errors']], [1])
+        self.assertIn('category', report['errors'][0]['errors'])
+        self.assertFalse(Product.objects.filter(sku='P-9').exists())
+        self.assertEqual(ProductCategory.objects.filter(name='手机').count(), 2)
+
+    def test_cache_invalidated_after_commit(self):
+        url = reverse('product-list')
+        etag = self.client.get(url, {'category': self.phones.pk})['ETag']
+        with self.captureOnCommitCallbacks() as callbacks:
+            self.upload('products.csv', 'sku,name,price,category\nP-1,新名称,2,手机\n')
+        # 提交前版本号不变, 并发的读请求不会把提交前的数据缓存在新版本号下
+        self.assertEqual(self.client.get(url, {'category': self.phones.pk})['ETag'], etag)
+        for callback in callbacks:
+            callback()
+        self.assertNotEqual(self.client.get(url, {'category': self.phones.pk})['ETag'], etag)
+
+    def test_existing_stock_is_not_overwritten(self):
+        product = Product.objects.get(sku='P-1')
+        stock.restock(product, 5)
+        reservation = stock.reserve({product.pk: 2})
+        self.upload('products.csv', 'sku,name,price,stock,category\nP-1,旧名称,1,100,手机\nP-5,新品,1,7,手机\n')
+        stock.release(reservation)
+        self.assertEqual(Product.objects.get(sku='P-1').stock, 5)
+        self.assertEqual(Product.objects.get(sku='P-5').stock, 7)
+
+    def test_streaming_export(self):
+        response = self.client.get(reverse('product-export'), {'file_format': 'jsonl'})
+        self.assertTrue(response.streaming)
+        rows = [json.loads(line) for line in b''.join(response.streaming_content).decode().splitlines()]
+        self.assertEqual(rows, [{'sku': 'P-1', 'name': '旧名称', 'description': None, 'price': '1.00',
+                                 'stock': 0, 'is_on_sale': False, 'category': '手机'}])
+
+    def test_requires_admin(self):
+        self.client.logout()
+        # 未登录时由令牌认证返回 401 (WWW-Authenticate: Bearer), 非管理员返回 403
+        self.assertEqual(self.client.get(reverse('product-export')).status_code, 401)
+        self.client.force_login(User.objects.create_user('customer'))
+        self.assertEqual(self.client.get(reverse('product-export')).status_code, 403)
+
+
+class StockReservationTests(TestCase):
+    """库存预留"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('buyer', 'buyer@example.com', 'pass')
+        category = ProductCategory.objects.create(name='数码')
+        cls.phone = Product.objects.create(category=category, name='手机', price=Decimal('1'), stock=5)
+        cls.case = Product.objects.create(category=category, name='保护壳', price=Decimal('1'), stock=1)
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(self.user)
+
+    def reserve(self, *lines):
+        items = [{'product': product.pk, 'quantity': quantity} for product, quantity in lines]
+        return self.client.post(reverse('stockreservation-list'), {'items': items}, content_type='application/json')
+
+    def stock_of(self, product):
+        return Product.objects.values_list('stock', flat=True).get(pk=product.pk)
+
+    def test_multi_item_reservation_is_all_or_nothing(self):
+        response = self.reserve((self.phone, 2), (self.case, 2))
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.json()['product'], self.case.pk)
+        self.assertEqual((self.stock_of(self.phone), self.stock_of(self.case)), (5, 1))
+
+        response = self.reserve((self.phone, 2), (self.case, 1))
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual((self.stock_of(self.phone), self.stock_of(self.case)), (3, 0))
+
+    def test_release_returns_stock_once(self):
+        reservation_id = self.reserve((self.phone, 2)).json()['id']
+        url = reverse('stockreservation-release', args=[reservation_id])
+        self.assertEqual(self.client.post(url).status_code, 200)
+        self.assertEqual(self.client.post(url).status_code, 409)
+        self.assertEqual(self.stock_of(self.phone), 5)
+
+    def test_expired_holds_are_released_and_cannot_be_confirmed(self):
+        reservation_id = self.reserve((self.phone, 3)).json()['id']
+        StockReservation.objects.filter(pk=reservation_id).update(expires_at=timezone.now() - timedelta(seconds=1))
+        response = self.client.post(reverse('stockreservation-confirm', args=[reservation_id]))
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(stock.release_expired(), 1)
+        self.assertEqual(self.stock_of(self.phone), 5)
+
+    def test_reservations_invalidate_catalog_cache(self):
+        url = reverse('product-detail', args=[self.phone.pk])
+        etag = self.client.get(url)['ETag']
+        with self.captureOnCommitCallbacks(execute=True):
+            reservation_id = self.reserve((self.phone, 3)).json()['id']
+        response = self.client.get(url, headers={'if-none-match': etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['stock'], 2)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('stockreservation-release', args=[reservation_id]))
+        self.assertEqual(self.client.get(url, headers={'if-none-match': response['ETag']}).json()['stock'], 5)
+        # 库存不足回滚的预留不会让缓存失效
+        etag = self.client.get(url)['ETag']
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            self.assertEqual(self.reserve((self.phone, 99)).status_code, 409)
+        self.assertEqual(callbacks, [])
+        self.assertEqual(self.client.get(url, headers={'if-none-match': etag}).status_code, 304)
+
+    def test_stock_is_read_only_through_product_api(self):
+        self.client.patch(reverse('product-detail', args=[self.phone.pk]), {'stock': 999}, content_type='application/json')
+        self.assertEqual(self.stock_of(self.phone), 5)
+
+
+class StockReservationStressTests(TransactionTestCase):
+    """并发抢购同一商品, 不允许超卖"""
+    buyers = 12
+    attempts = 10
+
+    def test_no_oversell_under_concurrency(self):
+        category = ProductCategory.objects.create(name='数码')
+        hot = Product.objects.create(category=category, name='爆款', price=Decimal('1'), stock=50)
+        other = Product.objects.create(category=category, name='赠品', price=Decimal('1'), stock=1000)
+        succeeded, barrier = [], threading.Barrier(self.buyers)
+
+        def buyer():
+            barrier.wait()
+            try:
+                for _ in range(self.attempts):
+                    try:
+                        stock.reserve({hot.pk: 1, other.pk: 2})
+                        succeeded.append(1)
+                    except stock.InsufficientStock:
+                        pass
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=buyer) for _ in range(self.buyers)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        hot.refresh_from_db()
+        other.refresh_from_db()
+        self.assertEqual(len(succeeded), 50)
+        self.assertEqual(hot.stock, 0)
+        self.assertEqual(other.stock, 1000 - 2 * 50)
+        self.assertEqual(StockReservation.objects.count(), 50)
+
+
+class CompiledListTests(TestCase):
+    """列表接口的编译序列化器, 输出必须与 DRF 序列化器逐字节相同"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.phones = ProductCategory.objects.create(name='手机', description='智能手机\u2028及配件')
+        cls.empty = ProductCategory.objects.create(name='空分类')
+        for i in range(7):
+            Product.objects.create(
+                category=cls.phones, name=f'华为手机{i}', description=None if i % 2 else f'描述 "{i}"',
+                price=Decimal('1999.5') + i, stock=i, is_on_sale=bool(i % 3), sku=f'P-{i}' if i % 2 else None,
+            )
+        Product.objects.filter(name='华为手机1').update(
+            image='products/华为 1.jpg',
+            image_variants={'variants': {'thumb': {'webp': 'products/variants/华为 1_thumb.webp'}}},
+        )
+
+    def setUp(self):
+        cache.clear()
+        related_index.clear()
+
+    def assertSameAsSerializer(self, view_class, url, params=None):
+        compiled = self.client.get(url, params)
+        cache.clear()
+        related_index.clear()
+        with mock.patch.object(view_class, 'compiled_list', False):
+            expected = self.client.get(url, params)
+        self.assertEqual(compiled.status_code, 200)
+        self.assertEqual(compiled.content, expected.content)
+        return compiled.json()
+
+    def test_product_list_pages(self):
+        self.assertSameAsSerializer(ProductViewSet, reverse('product-list'))
+        self.assertSameAsSerializer(ProductViewSet, reverse('product-list'), {'page_size': 3, 'page': 2})
+        self.assertSameAsSerializer(ProductViewSet, reverse('product-list'), {'is_on_sale': 'true', 'ordering': 'price'})
+
+    def test_search_and_cursor_pagination(self):
+        data = self.assertSameAsSerializer(ProductViewSet, reverse('product-list'), {'search': '华为'})
+        self.assertEqual(data['count'], 7)
+        page = self.assertSameAsSerializer(ProductViewSet, reverse('product-list'), {'pagination': 'cursor', 'page_size': 4})
+        self.assertSameAsSerializer(ProductViewSet, page['next'])
+
+    def test_category_list(self):
+        self.assertSameAsSerializer(ProductCategoryViewSet, reverse('productcategory-list'))
+
+    def test_list_query_count_unchanged(self):
+        # 总数、当前页(分类 JOIN)、关联商品索引
+        with self.assertNumQueries(3):
+            self.client.get(reverse('product-list'))
+
+
+class CategoryTreeTests(TestCase):
+    """分类树: 物化路径、包含子分类的商品数和按子树筛选"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.digital = ProductCategory.objects.create(name='数码')
+        cls.phones = ProductCategory.objects.create(name='手机', parent=cls.digital)
+        cls.cases = ProductCategory.objects.create(name='手机壳', parent=cls.phones)
+        cls.books = ProductCategory.objects.create(name='图书')
+        cls.phone = Product.objects.create(category=cls.phones, name='手机', price=Decimal('1999'), is_on_sale=True)
+        cls.case = Product.objects.create(category=cls.cases, name='手机壳', price=Decimal('19'))
+        cls.book = Product.objects.create(category=cls.books, name='小说', price=Decimal('39'))
+
+    def setUp(self):
+        cache.clear()
+
+    def counts(self):
+        return {
+            name: (product_count, on_sale_count)
+            for name, product_count, on_sale_count in ProductCategory.objects.values_list('name', 'product_count', 'on_sale_count')
+        }
+
+    def test_paths_and_counts(self):
+        self.cases.refresh_from_db()
+        self.assertEqual(self.cases.path, tree.segment(self.digital.pk) + tree.segment(self.phones.pk) + tree.segment(self.cases.pk))
+        self.assertEqual(self.cases.depth, 2)
+        self.assertEqual(self.counts(), {'数码': (2, 1), '手机': (2, 1), '手机壳': (1, 0), '图书': (1, 0)})
+
+    def test_counts_follow_product_changes(self):
+        self.case.is_on_sale = True
+        self.case.save()
+        self.phone.category = self.books
+        self.phone.save()
+        self.assertEqual(self.counts(), {'数码': (1, 1), '手机': (1, 1), '手机壳': (1, 1), '图书': (2, 1)})
+        self.case.delete()
+        self.assertEqual(self.counts(), {'数码': (0, 0), '手机': (0, 0), '手机壳': (0, 0), '图书': (2, 1)})
+
+    def test_moving_category_moves_subtree_and_counts(self):
+        self.phones.parent = self.books
+        self.phones.save()
+        self.cases.refresh_from_db()
+        self.assertEqual(self.cases.path, tree.segment(self.books.pk) + tree.segment(self.phones.pk) + tree.segment(self.cases.pk))
+        self.assertEqual(self.counts(), {'数码': (0, 0), '手机': (2, 1), '手机壳': (1, 0), '图书': (3, 1)})
+
+        with self.assertRaises(tree.CategoryMoveError):
+            self.books.parent = self.cases
+            self.books.save()
+        response = self.client.patch(
+            reverse('productcategory-detail', args=[self.phones.pk]), {'parent': self.cases.pk}, content_type='application/json',
+        )
+        self.assertEqual(response.status_code, 400)
+
+    def test_category_filter_includes_descendants(self):
+        url = reverse('product-list')
+        names = lambda category: sorted(item['name'] for item in self.client.get(url, {'category': category.pk}).json()['results'])
+        self.assertEqual(names(self.digital), ['手机', '手机壳'])
+        self.assertEqual(names(self.cases), ['手机壳'])
+        with self.assertNumQueries(3):  # 分类(带是否有子分类) + count + 商品页, 关联商品索引已缓存
+            self.client.get(url, {'category': self.digital.pk, 'page_size': 1})
+        self.assertEqual(self.client.get(url, {'category': 999}).status_code, 400)
+
+    def test_product_in_subcategory_invalidates_ancestor_lists(self):
+        url = reverse('product-list')
+        digital = self.client.get(url, {'category': self.digital.pk})
+        books = self.client.get(url, {'category': self.books.pk})
+        categories = self.client.get(reverse('productcategory-list'))
+
+        Product.objects.create(category=self.cases, name='贴膜', price=Decimal('9'))
+
+        self.assertNotEqual(self.client.get(url, {'category': self.digital.pk})['ETag'], digital['ETag'])
+        self.assertEqual(self.client.get(url, {'category': self.books.pk})['ETag'], books['ETag'])
+        response = self.client.get(reverse('productcategory-list'))
+        self.assertNotEqual(response['ETag'], categories['ETag'])
+        self.assertEqual([item['product_count'] for item in response.json()][:3], [3, 3, 2])
+
+    def test_category_list_is_tree_ordered_and_filterable(self):
+        url = reverse('productcategory-list')
+        self.assertEqual([item['name'] for item in self.client.get(url).json()], ['数码', '手机', '手机壳', '图书'])
+        self.assertEqual([item['name'] for item in self.client.get(url, {'parent__isnull': 'true'}).json()], ['数码', '图书'])
+        self.assertEqual([item['name'] for item in self.client.get(url, {'parent': self.phones.pk}).json()], ['手机壳'])
+        self.assertEqual([item['name'] for item in self.client.get(url, {'subtree': self.phones.pk}).json()], ['手机', '手机壳'])
+
+    def test_rebuild_fixes_drift(self):
+        Product.objects.filter(pk=self.book.pk).update(category=self.cases)    # update() 不触发信号
+        ProductCategory.objects.filter(pk=self.books.pk).update(path='', depth=3)
+        expected = {'数码': (3, 1), '手机': (3, 1), '手机壳': (2, 0), '图书': (0, 0)}
+        call_command('rebuild_category_tree', stdout=StringIO())
+        self.assertEqual(self.counts(), expected)
+        self.books.refresh_from_db()
+        self.assertEqual((self.books.path, self.books.depth), (tree.segment(self.books.pk), 0))
+        self.assertEqual(tree.rebuild(), 0)
+
+
+class ProductFacetTests(TestCase):
+    """商品列表的范围筛选和分面统计"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.digital = ProductCategory.objects.create(name='数码')
+        cls.phones = ProductCategory.objects.create(name='手机', parent=cls.digital)
+        cls.books = ProductCategory.objects.create(name='图书')
+        for price, stock, on_sale in (('99.99', 0, True), ('100', 5, False), ('999', 10, True), ('6000', 1, False)):
+            Product.objects.create(category=cls.phones, name=f'手机 {price}', price=Decimal(price), stock=stock, is_on_sale=on_sale)
+        Product.objects.create(category=cls.books, name='小说', price=Decimal('39'), stock=3)
+
+    def setUp(self):
+        cache.clear()
+        related_index.clear()
+
+    def get(self, **params):
+        response = self.client.get(reverse('product-list'), params)
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_range_filters(self):
+        self.assertEqual(self.get(price__gte='100', price__lt='1000')['count'], 2)
+        self.assertEqual(self.get(stock__gte='3', stock__lte='5')['count'], 2)
+        self.assertEqual(self.client.get(reverse('product-list'), {'price__gte': 'abc'}).status_code, 400)
+
+    @override_settings(PRODUCT_FACETS={'PRICE_BUCKETS': [100, 1000]})
+    def test_facets_follow_current_filters(self):
+        self.assertNotIn('facets', self.get())
+        facets = self.get(facets='true')['facets']
+        self.assertEqual(facets['category'], [
+            {'id': self.digital.pk, 'count': 4}, {'id': self.phones.pk, 'count': 4}, {'id': self.books.pk, 'count': 1},
+        ])
+        self.assertEqual(facets['is_on_sale'], [{'value': True, 'count': 2}, {'value': False, 'count': 3}])
+        self.assertEqual(facets['price'], [
+            {'min': None, 'max': '100.00', 'count': 2},
+            {'min': '100.00', 'max': '1000.00', 'count': 2},
+            {'min': '1000.00', 'max': None, 'count': 1},
+        ])
+
+        facets = self.get(facets='true', search='手机', stock__gte='1', pagination='cursor')['facets']
+        self.assertEqual(facets['category'], [{'id': self.digital.pk, 'count': 3}, {'id': self.phones.pk, 'count': 3}])
+        self.assertEqual([bucket['count'] for bucket in facets['price']], [0, 2, 1])
+
+    def test_facets_cost_one_aggregate_query(self):
+        self.get(page_size=1, is_on_sale='true')    # 预热关联商品索引
+        cache.clear()
+        with CaptureQueriesContext(connection) as queries:
+            self.get(page_size=1, facets='true', is_on_sale='true')
+        # count + 商品页 + 分面聚合
+        self.assertEqual(len(queries), 3)
+        self.assertIn('GROUP BY', queries[-1]['sql'])
+
+
+@override_settings(CATALOG_SYNC={'BATCH_SIZE': 500, 'MAX_BATCH_SIZE': 2000, 'SETTLE_SECONDS': 0, 'TOMBSTONE_TTL': 3600})
+class CatalogSyncTests(TestCase):
+    """商品目录增量同步"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.phones = ProductCategory.objects.create(name='手机')
+        cls.books = ProductCategory.objects.create(name='图书', parent=cls.phones)
+        cls.products = [
+            Product.objects.create(category=cls.phones, name=f'手机{i}', price=Decimal(i), stock=i) for i in range(7)
+        ]
+
+    def sync(self, since=None, **params):
+        if since:
+            params['since'] = since
+        response = self.client.get(reverse('catalog-changes'), params)
+        self.assertEqual(response.status_code, 200, response.content)
+        return response.json()
+
+    def sync_all(self, since=None, limit=3):
+        products, categories, deleted, batches = {}, {}, [], 0
+        while True:
+            with self.assertNumQueries(3):  # 商品、分类、删除记录各一次范围查询
+                data = self.sync(since, limit=limit)
+            batches += 1
+            products.update((item['id'], item) for item in data['products'])
+            categories.update((item['id'], item) for item in data['categories'])
+            deleted.extend(data['deleted']['products'])
+            since = data['next']
+            if not data['has_more']:
+                return products, categories, deleted, since, batches
+
+    def test_full_then_incremental_sync(self):
+        products, categories, deleted, token, batches = self.sync_all()
+        self.assertEqual(set(products), {product.pk for product in self.products})
+        self.assertEqual(categories[self.books.pk]['parent'], self.phones.pk)
+        self.assertEqual(deleted, [])
+        self.assertEqual(batches, 3)
+        self.assertNotIn('stock', products[self.products[0].pk])
+
+        self.assertEqual(self.sync(token)['products'], [])
+        changed, removed_id = self.products[0], self.products[1].pk
+        changed.name = '新名称'
+        changed.save()
+        self.products[1].delete()
+        new = Product.objects.create(category=self.books, name='小说', price=Decimal('9'))
+
+        products, categories, deleted, _, _ = self.sync_all(token)
+        self.assertEqual(set(products), {changed.pk, new.pk})
+        self.assertEqual(products[changed.pk]['name'], '新名称')
+        self.assertEqual(deleted, [removed_id])
+        self.assertEqual(categories, {})
+
+    def test_recent_changes_wait_for_settle_window(self):
+        token = self.sync()['next']
+        self.products[0].save()
+        with self.settings(CATALOG_SYNC=dict(settings.CATALOG_SYNC, SETTLE_SECONDS=60)):
+            self.assertEqual(self.sync(token)['products'], [])
+        self.assertEqual([item['id'] for item in self.sync(token)['products']], [self.products[0].pk])
+
+    def test_recreated_id_clears_tombstone(self):
+        pk = self.products[-1].pk
+        self.products[-1].delete()
+        self.assertTrue(CatalogTombstone.objects.filter(kind=CatalogTombstone.KIND_PRODUCT, object_id=pk).exists())
+        Product.objects.create(pk=pk, category=self.phones, name='复用', price=Decimal('1'))
+        self.assertFalse(CatalogTombstone.objects.filter(kind=CatalogTombstone.KIND_PRODUCT, object_id=pk).exists())
+
+    def test_invalid_and_expired_tokens(self):
+        response = self.client.get(reverse('catalog-changes'), {'since': 'garbage'})
+        self.assertEqual(response.status_code, 400)
+        naive = sync.encode_token({key: (timezone.now().replace(tzinfo=None), None) for key in 'pct'})
+        response = self.client.get(reverse('catalog-changes'), {'since': naive})
+        self.assertEqual((response.status_code, list(response.json())), (400, ['since']))
+        response = self.client.get(reverse('catalog-changes'), {'limit': '0'})
+        self.assertEqual((response.status_code, list(response.json())), (400, ['limit']))
+        old = timezone.now() - timedelta(hours=2)
+        expired = sync.encode_token({'p': (old, None), 'c': (old, None), 't': (old, None)})
+        self.assertEqual(self.client.get(reverse('catalog-changes'), {'since': expired}).status_code, 410)
+
+        self.products[0].delete()
+        CatalogTombstone.objects.update(deleted_at=old)
+        call_command('prune_sync_tombstones', stdout=StringIO())
+        self.assertFalse(CatalogTombstone.objects.exists())
+
+
+class SparseFieldsTests(TestCase):
+    """?fields= / ?expand= 稀疏字段集"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.phones = ProductCategory.objects.create(name='手机')
+        for i in range(5):
+            Product.objects.create(category=cls.phones, name=f'手机{i}', description='很长的描述', price=Decimal(i))
+
+    def setUp(self):
+        cache.clear()
+        related_index.clear()
+
+    def get(self, url=None, **params):
+        response = self.client.get(url or reverse('product-list'), params)
+        self.assertEqual(response.status_code, 200, response.content)
+        return response.json()
+
+    def test_fields_trim_output_and_sql(self):
+        with CaptureQueriesContext(connection) as queries:
+            data = self.get(fields='id,name,price,image_variants')
+        self.assertEqual(list(data['results'][0]), ['id', 'image_variants', 'name', 'price'])
+        # count + 商品页, 不 JOIN 分类, 不查询关联商品, 也不读取描述
+        self.assertEqual(len(queries), 2)
+        self.assertNotIn('products_productcategory', queries[-1]['sql'])
+        self.assertNotIn('description', queries[-1]['sql'])
+
+    def test_expand_and_collapsed_relations(self):
+        item = self.get(fields='id,category')['results'][0]
+        self.assertEqual(item, {'id': item['id'], 'category': self.phones.pk})
+        item = self.get(fields='id', expand='category,related_products')['results'][0]
+        self.assertEqual(item['category']['name'], '手机')
+        self.assertEqual(len(item['related_products']), 4)
+        item = self.get(expand='category')['results'][0]
+        self.assertNotIn('related_products', item)
+        self.assertIn('description', item)
+
+    def test_empty_parameters_are_ignored(self):
+        full = self.get()
+        for params in ({'fields': ''}, {'fields': ' , '}, {'expand': ''}, {'fields': '', 'expand': ''}):
+            with self.subTest(params=params):
+                self.assertEqual(self.get(**params), full)
+        item = self.get(fields='', expand='category')['results'][0]
+        self.assertEqual(item['category']['name'], '手机')
+        self.assertIn('description', item)
+
+    def test_invalid_parameters(self):
+        for params in ({'fields': 'id,bogus'}, {'expand': 'name'}, {'fields': 'related_products'}):
+            with self.subTest(params=params):
+                self.assertEqual(self.client.get(reverse('product-list'), params).status_code, 400)
+
+    def test_serializer_and_compiled_paths_agree(self):
+        params = {'fields': 'id,name,category', 'expand': 'related_products', 'pagination': 'cursor', 'page_size': 2}
+        compiled = self.client.get(reverse('product-list'), params)
+        related_index.clear()
+        cache.clear()
+        with mock.patch.object(ProductViewSet, 'compiled_list', False):
+            expected = self.client.get(reverse('product-list'), params)
+        self.assertEqual(compiled.content, expected.content)
+        # 游标按未选中的 created_at 生成
+        self.assertEqual(len(self.get(compiled.json()['next'])['results']), 2)
+
+    def test_detail_and_parse_cache(self):
+        product = Product.objects.first()
+        self.assertEqual(self.get(reverse('product-detail', args=[product.pk]), fields='name'), {'name': product.name})
+        # 同样的参数组合直接复用解析结果
+        serializer_class = ProductViewSet.serializer_class
+        self.assertIs(sparse.parse(serializer_class, 'name', None), sparse.parse(serializer_class, 'name', None))
+
+
+class ProductBatchTests(TestCase):
+    """按 id 批量获取商品"""
+
+    @classmethod
+    def setUpTestData(cls):
+        category = ProductCategory.objects.create(name='手机')
+        cls.products = [Product.objects.create(category=category, name=f'手机{i}', price=Decimal(i)) for i in range(4)]
+
+    def setUp(self):
+        cache.clear()
+        related_index.clear()
+
+    def batch(self, ids, **params):
+        return self.client.get(reverse('product-batch'), {'ids': ids, **params})
+
+    def test_preserves_order_and_reports_missing(self):
+        first, second, third = (product.pk for product in self.products[:3])
+        response = self.batch(f'{third},999,{first},{third},{second}')
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual([item['id'] for item in data['results']], [third, first, second])
+        self.assertEqual(data['missing'], [999])
+        # 与详情接口的输出一致
+        detail = self.client.get(reverse('product-detail', args=[first])).json()
+        self.assertEqual(data['results'][1], detail)
+
+    def test_single_product_query(self):
+        ids = ','.join(str(product.pk) for product in self.products)
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.batch(ids, fields='id,name').status_code, 200)
+        self.assertEqual(len(queries), 1)
+        results = self.batch(ids, fields='id', expand='related_products').json()['results']
+        self.assertEqual([len(item['related_products']) for item in results], [3] * 4)
+
+    def test_invalid_ids(self):
+        for ids in ('', 'a,b', '1,99999999999999999999999', '0', ','.join(map(str, range(1, ProductViewSet.batch_max_ids + 2)))):
+            with self.subTest(ids=ids[:10]):
+                self.assertEqual(self.batch(ids).status_code, 400)
+
+
+class ProductAdminTests(TestCase):
+    """商品后台: 批量操作是一条 UPDATE, 手动维护分类商品数和缓存"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_superuser('admin', 'admin@example.com', 'password')
+        cls.digital = ProductCategory.objects.create(name='数码')
+        cls.phones = ProductCategory.objects.create(name='手机', parent=cls.digital)
+        cls.books = ProductCategory.objects.create(name='图书')
+        cls.phone = Product.objects.create(category=cls.phones, sku='PH-001', name='智能手机', price=Decimal('1000'))
+        cls.case = Product.objects.create(category=cls.phones, sku='PH-002', name='手机壳', price=Decimal('19.99'), is_on_sale=True)
+        cls.book = Product.objects.create(category=cls.books, sku='BK-001', name='小说', price=Decimal('39'))
+
+    def setUp(self):
+        cache.clear()
+        related_index.clear()
+        self.client.force_login(self.admin)
+
+    def run_action(self, action, products, follow=False, **params):
+        # * 缓存版本号在事务提交后才递增
+        with self.captureOnCommitCallbacks(execute=True):
+            return self.client.post(reverse('admin:products_product_changelist'), {
+                'action': action, '_selected_action': [product.pk for product in products], **params,
+            }, follow=follow)
+
+    def counts(self):
+        return {
+            name: (product_count, on_sale_count)
+            for name, product_count, on_sale_count in ProductCategory.objects.values_list('name', 'product_count', 'on_sale_count')
+        }
+
+    def test_adjust_price_is_single_update(self):
+        url = reverse('product-list')
+        digital = self.client.get(url, {'category': self.digital.pk})
+        books = self.client.get(url, {'category': self.books.pk})
+        before = Product.objects.get(pk=self.phone.pk).updated_at
+
+        with CaptureQueriesContext(connection) as queries:
+            self.run_action('adjust_price', [self.phone, self.case], percent='-10')
+        updates = [query['sql'] for query in queries if query['sql'].startswith('UPDATE "products_product"')]
+        self.assertEqual(len(updates), 1)
+        self.assertEqual(
+            dict(Product.objects.values_list('sku', 'price')),
+            {'PH-001': Decimal('900.00'), 'PH-002': Decimal('17.99'), 'BK-001': Decimal('39.00')},
+        )
+        self.assertGreater(Product.objects.get(pk=self.phone.pk).updated_at, before)    # 增量同步能看到变化
+        # * 子分类商品的变化也会让祖先分类的列表失效
+        self.assertNotEqual(self.client.get(url, {'category': self.digital.pk})['ETag'], digital['ETag'])
+        self.assertEqual(self.client.get(url, {'category': self.books.pk})['ETag'], books['ETag'])
+
+    def test_on_sale_actions_keep_counts(self):
+        self.run_action('mark_on_sale', [self.phone, self.case, self.book])
+        self.assertEqual(self.counts(), {'数码': (2, 2), '手机': (2, 2), '图书': (1, 1)})
+        self.run_action('mark_not_on_sale', [self.case])
+        self.assertEqual(self.counts(), {'数码': (2, 1), '手机': (2, 1), '图书': (1, 1)})
+        self.assertEqual(tree.rebuild(), 0)
+
+    def test_restock_requires_quantity(self):
+        response = self.run_action('restock', [self.phone, self.book], follow=True)
+        self.assertContains(response, '请填写补货数量')
+        books = self.client.get(reverse('product-list'), {'category': self.books.pk})
+        with self.captureOnCommitCallbacks() as callbacks:
+            stock.restock_many(Product.objects.filter(pk__in=[self.phone.pk, self.book.pk]), 5)
+        # 提交前缓存仍然有效, 否则并发的读请求会把旧库存缓存在新版本号下
+        self.assertEqual(self.client.get(reverse('product-list'), {'category': self.books.pk})['ETag'], books['ETag'])
+        for callback in callbacks:
+            callback()
+        self.assertNotEqual(self.client.get(reverse('product-list'), {'category': self.books.pk})['ETag'], books['ETag'])
+        self.run_action('restock', [self.phone, self.book], quantity='5')
+        self.assertEqual(dict(Product.objects.values_list('sku', 'stock')), {'PH-001': 10, 'PH-002': 0, 'BK-001': 10})
+
+    def test_changelist_search(self):
+        url = reverse('admin:products_product_changelist')
+        names = lambda query: [product.name for product in self.client.get(url, {'q': query}).context['cl'].result_list]
+        self.assertEqual(sorted(names('PH-')), ['手机壳', '智能手机'])
+        self.assertEqual(names('小说'), ['小说'])
+        # * 搜索结果上的批量操作同样是一条 UPDATE
+        self.client.post(f'{url}?q=手机', {'action': 'mark_on_sale', 'select_across': '1', '_selected_action': [self.phone.pk]})
+        self.assertEqual(self.counts(), {'数码': (2, 2), '手机': (2, 2), '图书': (1, 0)})
@@ -0,0 +1,196 @@
+"""
+商品分类树
+
+分类用物化路径保存层级: path 是从根分类到自身每一级主键补零后用 / 连接起来的字符串(例如 0000000001/0000000007/)。
+按字符串排序就是树的先序遍历, 一个分类的整棵子树是 path 上的一段连续区间, 一次索引范围扫描即可取出。
+
+product_count/on_sale_count 是包含所有子分类在内的商品数, 商品保存/删除时由信号增量更新自身和所有祖先分类;
+bulk_create/update() 等绕过信号的写入之后可以用 rebuild(或 rebuild_category_tree 命令)整体修正。
+"""
+from collections import defaultdict
+
+from django.db import transaction
+from django.db.models import CharField, Count, F, Q, Value
+from django.db.models.functions import Concat, Substr
+
+from .models import ProductCategory, Product
+
+PATH_DIGITS = 10    # 路径中每一级主键补零后的位数, 保证路径按字符串比较的顺序与树的先序一致
+
+
+class CategoryMoveError(ValueError):
+    """把分类移动到它自己或它的子分类下面"""
+
+
+def segment(pk):
+    return f'{pk:0{PATH_DIGITS}d}/'
+
+
+def ancestor_ids(path):
+    """路径上的所有分类 id, 从根分类到自身"""
+    return [int(part) for part in path.split('/') if part]
+
+
+def subtree_bounds(path):
+    """子树在 path 上的区间 [lower, upper), '/' 的下一个字符是 '0', 所以 upper 正好排除了兄弟分类"""
+    return path, path[:-1] + '0'
+
+
+def subtree_q(path, prefix=''):
+    lower, upper = subtree_bounds(path)
+    return Q(**{f'{prefix}path__gte': lower, f'{prefix}path__lt': upper})
+
+
+def subtree(category):
+    """分类自身及所有子分类"""
+    return ProductCategory.objects.filter(subtree_q(category.path))
+
+
+def is_in_subtree(path, root_path):
+    return bool(root_path) and path.startswith(root_path)
+
+
+def remember(category):
+    """
+    保存之前记录分类原来的路径、商品数和新父分类的路径(一次查询), 供 place 使用
+
+    父分类是自身或自身的子分类时抛出 CategoryMoveError。
+    """
+    category._tree_state = None
+    ids = [pk for pk in (category.pk, category.parent_id) if pk is not None]
+    rows = {
+        pk: (path, counts)
+        for pk, path, *counts in ProductCategory.objects.filter(pk__in=ids).values_list('pk', 'path', 'product_count', 'on_sale_count')
+    } if ids else {}
+    previous_path, counts = rows.get(category.pk, ('', (0, 0)))
+    parent_path = rows[category.parent_id][0] if category.parent_id in rows else ''
+    if category.parent_id is not None and (category.parent_id == category.pk or is_in_subtree(parent_path, previous_path)):
+        raise CategoryMoveError('不能把分类移动到它自己或它的子分类下面')
+    category._tree_state = (previous_path, parent_path, counts)
+
+
+def place(category):
+    """
+    分类保存后更新 path/depth
+
+    新建的分类只更新自身; 换了父分类时用一条 UPDATE 移动整棵子树, 子树的商品数从旧的祖先转到新的祖先。
+    """
+    previous_path, parent_path, (products, on_sale) = category._tree_state
+    path = parent_path + segment(category.pk)
+    depth = path.count('/') - 1
+    if path == previous_path:
+        return
+    if not previous_path:
+        ProductCategory.objects.filter(pk=category.pk).update(path=path, depth=depth)
+    else:
+        lower, upper = subtree_bounds(previous_path)
+        ProductCategory.objects.filter(path__gte=lower, path__lt=upper).update(
+            path=Concat(Value(path), Substr('path', len(previous_path) + 1), output_field=CharField()),
+            depth=F('depth') + (depth - previous_path.count('/') + 1),
+        )
+        deltas = defaultdict(lambda: (0, 0))
+        for pk in ancestor_ids(previous_path)[:-1]:
+            deltas[pk] = (-products, -on_sale)
+        for pk in ancestor_ids(path)[:-1]:
+            old = deltas[pk]
+            deltas[pk] = (old[0] + products, old[1] + on_sale)
+        add_counts(deltas)
+    category.path, category.depth = path, depth
+
+
+def add_counts(deltas):
+    """deltas 为 {分类 id: (商品数变化, 促销商品数变化)}, 变化量相同的分类合并成一条 UPDATE"""
+    groups = defaultdict(list)
+    for pk, delta in deltas.items():
+        if delta != (0, 0):
+            groups[delta].append(pk)
+    for (products, on_sale), pks in groups.items():
+        ProductCategory.objects.filter(pk__in=pks).update(
+            product_count=F('product_count') + products, on_sale_count=F('on_sale_count') + on_sale,
+        )
+
+
+def update_counts(changes):
+    """
+    商品变更后增量更新分类及其祖先的商品数
+
+    changes 为 [(变更前, 变更后)], 每一项是 (分类 id, 是否促销), 新建时变更前为 None, 删除时变更后为 None。
+    返回受影响的分类 id(包括祖先), 即使商品数没有变化, 这些分类下的商品列表也变了。
+    """
+    deltas = defaultdict(lambda: (0, 0))
+    for change in changes:
+        for state, sign in zip(change, (-1, 1)):
+            if state is not None:
+                category_id, on_sale = state
+                products, sale = deltas[category_id]
+                deltas[category_id] = (products + sign, sale + sign * bool(on_sale))
+    return shift_counts(deltas)
+
+
+def shift_counts(deltas):
+    """
+    deltas 为 {分类 id: (商品数变化, 促销商品数变化)}, 把变化量累加到分类及其所有祖先上
+
+    返回受影响的分类 id(包括祖先); 变化量为 (0, 0) 的分类不更新, 但也计入返回值(商品的其他字段变了, 缓存同样要失效)。
+    """
+    paths = dict(ProductCategory.objects.filter(pk__in=deltas).values_list('pk', 'path')) if deltas else {}
+    totals = defaultdict(lambda: (0, 0))
+    for category_id, (products, on_sale) in deltas.items():
+        for pk in ancestor_ids(paths.get(category_id, '')):
+            total_products, total_on_sale = totals[pk]
+            totals[pk] = (total_products + products, total_on_sale + on_sale)
+    add_counts(totals)
+    return set(deltas).union(totals)
+
+
+def assign_root_paths(categories):
+    """bulk_create 出来的根分类不会触发信号, 补上 path"""
+    for category in categories:
+        category.path, category.depth = segment(category.pk), 0
+    ProductCategory.objects.bulk_update(categories, ['path', 'depth'])
+
+
+def rebuild():
+    """
+    按 parent 重新计算所有分类的 path/depth 和商品数, 只写回有偏差的分类, 返回修正的分类数量
+
+    从根分类不可达的分类(parent 成环)会被断开成为根分类。
+    """
+    with transaction.atomic():
+        categories = {
+            category.pk: category
+            for category in ProductCategory.objects.only('id', 'parent_id', 'path', 'depth', 'product_count', 'on_sale_count')
+        }
+        children = defaultdict(list)
+        for category in categories.values():
+            children[category.parent_id].append(category.pk)
+
+        paths, parents = {}, {pk: category.parent_id for pk, category in categories.items()}
+        roots = children[None]
+        while roots:
+            stack = [(pk, '') for pk in roots]
+            while stack:
+                pk, parent_path = stack.pop()
+                paths[pk] = parent_path + segment(pk)
+                stack.extend((child, paths[pk]) for child in children[pk] if child not in paths)
+            roots = [min(pk for pk in categories if pk not in paths)] if len(paths) < len(categories) else []
+            for pk in roots:
+                parents[pk] = None
+
+        totals = defaultdict(lambda: (0, 0))
+        direct = Product.objects.values_list('category_id').annotate(
+            total=Count('id'), on_sale=Count('id', filter=Q(is_on_sale=True)),
+        ).order_by()
+        for category_id, total, on_sale in direct:
+            for pk in ancestor_ids(paths.get(category_id, '')):
+                products, sale = totals[pk]
+                totals[pk] = (products + total, sale + on_sale)
+
+        changed = []
+        for pk, category in categories.items():
+            expected = (parents[pk], paths[pk], paths[pk].count('/') - 1, *totals[pk])
+            if (category.parent_id, category.path, category.depth, category.product_count, category.on_sale_count) != expected:
+                category.parent_id, category.path, category.depth, category.product_count, category.on_sale_count = expected
+                changed.append(category)
+        ProductCategory.objects.bulk_update(changed, ['parent', 'path', 'depth', 'product_count', 'on_sale_count'], batch_size=500)
+    return len(changed)
@@ -1,11 +1,17 @@
 from django.urls import path, include
 from rest_framework import routers
-from . import views
+from . import views, async_views
 
 router = routers.DefaultRouter()
 router.register(r'product-categories', views.ProductCategoryViewSet) #  注册商品分类的路由
 router.register(r'products', views.ProductViewSet) # 注册商品的路由
+router.register(r'reservations', views.StockReservationViewSet) # 注册库存预留的路由
 
 urlpatterns = [
     path('', include(router.urls)),
+    path('catalog/changes/', views.CatalogChangesView.as_view(), name='catalog-changes'),     # 商品目录增量同步
+    # * ASGI 原生的只读接口, 输出与上面对应的 list/retrieve 一致
+    path('async/products/', async_views.product_list, name='async-product-list'),
+    path('async/products/<int:pk>/', async_views.product_detail, name='async-product-detail'),
+    path('async/product-categories/', async_views.category_list, name='async-productcategory-list'),
 ]
\ No newline at end of file
@@ -1,14 +1,30 @@
-from rest_framework import viewsets, permissions, filters, pagination
+from django.conf import settings
+from django.http import StreamingHttpResponse
+from rest_framework import viewsets, permissions, pagination, status, mixins, serializers
+from rest_framework.decorators import action
+from rest_framework.response import Response
+from rest_framework.views import APIView
 from django_filters.rest_framework import DjangoFilterBackend
-from .models import ProductCategory, Product
-from .serializers import ProductCategorySerializer, ProductSerializer
+from core.compiled import CompiledListMixin, CompiledSerializer
+from core.db import ReplicaReadMixin
+from core.sparse import SparseFieldsViewMixin
+from .models import ProductCategory, Product, StockReservation
+from .serializers import ProductCategorySerializer, ProductSerializer, StockReservationSerializer, ReservationCreateSerializer
+from .cache import CatalogCacheMixin
+from .facets import FacetMixin
+from .filters import ProductCategoryFilter, ProductFilter, ProductSearchFilter, ProductOrderingFilter
+from .pagination import ProductCursorPagination
+from . import bulk, stock, sync
 
-class ProductCategoryViewSet(viewsets.ModelViewSet):
+class ProductCategoryViewSet(CatalogCacheMixin, CompiledListMixin, viewsets.ModelViewSet):
     """
     商品分类 API 接口
     """
-    queryset = ProductCategory.objects.all()
+    queryset = ProductCategory.objects.order_by('path')   # * 按路径排序即树的先序遍历, 子分类紧跟在父分类后面
     serializer_class = ProductCategorySerializer
+    filter_backends = [DjangoFilterBackend]
+    filterset_class = ProductCategoryFilter
+    # ! 分类带有商品数, 任意商品变更都会改变分类列表, 依赖商品版本号
     # permission_classes = [permissions.IsAdminUser] #  这里先设置只有管理员用户可以操作商品分类数据，后续根据需求调整权限
 
 class ProductPagination(pagination.PageNumberPagination):
@@ -17,16 +33,187 @@ class ProductPagination(pagination.PageNumberPagination):
     page_size_query_param = 'page_size' # * 允许客户端通过`page_size`参数自定义每页数量
     max_page_size = 100 # 客户端可设置的最大每页数量
 
-class ProductViewSet(viewsets.ModelViewSet):
+class ProductViewSet(ReplicaReadMixin, CatalogCacheMixin, FacetMixin, SparseFieldsViewMixin, CompiledListMixin, viewsets.ModelViewSet):
     """
     商品 API 接口
+
+    列表支持 facets=true, 在响应里附带当前筛选结果的分面统计(见 products.facets);
+    列表和详情支持 fields/expand 只输出需要的字段(见 core.sparse)。
     """
     queryset = Product.objects.all()
     serializer_class = ProductSerializer
+    # * 序列化器实际输出的字段, 分类通过 select_related 一次 JOIN 取出, 避免逐行访问外键
+    only_fields = [
+        'id', 'sku', 'name', 'description', 'price', 'image', 'image_variants', 'stock', 'is_on_sale', 'created_at', 'updated_at',
+        'category__id', 'category__name', 'category__description',
+    ]
+    # * 稀疏字段集时每个输出字段需要查询的列, 没有列出的字段就是同名的列
+    field_columns = {
+        'image_variants': ['image', 'image_variants'],  # 生成衍生图 URL 需要原图字段的 storage
+        'category': ['category__id', 'category__name', 'category__description'],
+        'related_products': ['category'],   # 按分类取关联商品
+    }
     # permission_classes = [permissions.IsAdminUser] # 这里先设置只有管理员用户可以操作商品数据，后续根据需求调整权限
-    filter_backends = [filters.SearchFilter, DjangoFilterBackend, filters.OrderingFilter]
-    search_fields = ['name', 'description']
-    filterset_fields = ['category', 'is_on_sale', 'price']  # 指定可以用于筛选的字段
+    filter_backends = [ProductSearchFilter, DjangoFilterBackend, ProductOrderingFilter]
+    search_fields = ['name', 'description']     # 由 PRODUCT_SEARCH_BACKEND 配置的全文索引负责搜索
+    filterset_class = ProductFilter  # 可以按 category(包含子分类)、is_on_sale、price(精确或范围)、stock(范围) 筛选
     ordering_fields = ['price', 'created_at', 'updated_at'] # 指定可以用于排序的字段
     ordering = ['-created_at']      # 默认排序字段，这里默认按照创建时间倒序排列
-    pagination_class = ProductPagination
\ No newline at end of file
+    pagination_class = ProductPagination
+    cursor_pagination_class = ProductCursorPagination   # * 客户端传 pagination=cursor 或 cursor 参数时使用游标分页
+    cache_category_param = 'category'   # 按分类筛选的列表只依赖该分类的缓存版本号(子分类的商品变更也会递增祖先的版本号)
+    batch_max_ids = 100     # 批量获取一次最多的商品数
+
+    @property
+    def paginator(self):
+        """默认页码分页, 客户端可以通过查询参数切换为游标分页"""
+        if not hasattr(self, '_paginator'):
+            params = self.request.query_params
+            if params.get('pagination') == 'cursor' or 'cursor' in params:
+                self._paginator = self.cursor_pagination_class()
+            else:
+                self._paginator = self.pagination_class()
+        return self._paginator
+
+    def get_queryset(self):
+        # ! 关联商品由 ProductListSerializer 按整页批量获取, 这里不需要再 prefetch
+        field_set = self.get_field_set()
+        if field_set is None:
+            return Product.objects.select_related('category').only(*self.only_fields)
+        # * 只查询选中的字段, 没有展开分类时不 JOIN 分类表
+        queryset = Product.objects.only(*field_set.columns(self.field_columns))
+        if 'category' in field_set.expand:
+            queryset = queryset.select_related('category')
+        return queryset
+
+    @action(detail=False, methods=['get'])
+    def batch(self, request):
+        """
+        按 id 批量获取商品, ?ids=3,1,2, 购物车/收藏夹一次请求取回所有商品
+
+        一条 id IN (...) 查询取出全部商品(关联商品整批计算), 按请求的顺序返回, 不存在的 id 列在 missing 里; 支持 fields/expand。
+        """
+        return self._cached_response('batch', request, lambda: self._batch(request))
+
+    def _batch(self, request):
+        # ! 超出 64 位整数范围的 id 传给数据库驱动会抛出 OverflowError, 先在这里校验
+        field = serializers.ListField(child=serializers.IntegerField(min_value=1, max_value=2 ** 63 - 1))
+        try:
+            ids = list(dict.fromkeys(field.run_validation([pk for pk in request.query_params.get('ids', '').split(',') if pk.strip()])))
+        except serializers.ValidationError:
+            return Response({'ids': ['请输入以逗号分隔的商品 id.']}, status=status.HTTP_400_BAD_REQUEST)
+        if not 1 <= len(ids) <= self.batch_max_ids:
+            return Response({'ids': [f'一次可以获取 1 到 {self.batch_max_ids} 个商品.']}, status=status.HTTP_400_BAD_REQUEST)
+        compiled = CompiledSerializer(self.get_serializer_class(), self.get_serializer_context())
+        rows = {row['id']: row for row in compiled.values(self.get_queryset().filter(pk__in=ids).order_by())}
+        found = [rows[pk] for pk in ids if pk in rows]
+        return Response({'results': compiled.serialize(found), 'missing': [pk for pk in ids if pk not in rows]})
+
+    @action(detail=False, methods=['post'], url_path='import', permission_classes=[permissions.IsAdminUser])
+    def bulk_import(self, request):
+        """批量导入商品, 上传 CSV/JSONL 文件, 按 sku 新增或更新, 返回逐行的错误报告"""
+        upload = request.FILES.get('file')
+        if upload is None:
+            return Response({'file': ['请上传 CSV 或 JSONL 文件.']}, status=status.HTTP_400_BAD_REQUEST)
+        file_format = request.data.get('file_format') or bulk.guess_format(upload.name)
+        if file_format not in bulk.FORMATS:
+            return Response({'file_format': [f'只支持 {", ".join(bulk.FORMATS)}.']}, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            batch_size = min(max(int(request.data.get('batch_size') or 500), 1), 5000)
+        except ValueError:
+            return Response({'batch_size': ['请输入一个整数.']}, status=status.HTTP_400_BAD_REQUEST)
+        importer = bulk.ProductImporter(
+            batch_size=batch_size,
+            create_categories=str(request.data.get('create_categories', '')).lower() in ('1', 'true'),
+        )
+        report = importer.run(bulk.read_rows(upload, file_format))
+        return Response(report, status=status.HTTP_200_OK)
+
+    @action(detail=False, methods=['get'], permission_classes=[permissions.IsAdminUser])
+    def export(self, request):
+        """流式导出商品(支持与列表相同的筛选参数), file_format 为 csv 或 jsonl"""
+        file_format = request.query_params.get('file_format', 'csv')
+        if file_format not in bulk.FORMATS:
+            return Response({'file_format': [f'只支持 {", ".join(bulk.FORMATS)}.']}, status=status.HTTP_400_BAD_REQUEST)
+        queryset = self.filter_queryset(Product.objects.all())
+        response = StreamingHttpResponse(
+            bulk.stream_export(queryset, file_format),
+            content_type='text/csv; charset=utf-8' if file_format == 'csv' else 'application/x-ndjson; charset=utf-8',
+        )
+        response['Content-Disposition'] = f'attachment; filename="products.{file_format}"'
+        return response
+
+    @action(detail=True, methods=['post'], permission_classes=[permissions.IsAdminUser])
+    def restock(self, request, pk=None):
+        """补货, 原子地增加库存"""
+        quantity = serializers.IntegerField(min_value=1).run_validation(request.data.get('quantity'))
+        product = self.get_object()
+        stock.restock(product, quantity)
+        product.refresh_from_db(fields=['stock'])
+        return Response({'id': product.pk, 'stock': product.stock})
+
+
+class StockReservationViewSet(mixins.CreateModelMixin, mixins.RetrieveModelMixin, viewsets.GenericViewSet):
+    """
+    库存预留 API 接口
+    """
+    queryset = StockReservation.objects.all()
+    serializer_class = StockReservationSerializer
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get_queryset(self):
+        # 只能查看和操作自己的预留
+        return StockReservation.objects.filter(user=self.request.user).prefetch_related('items')
+
+    def create(self, request, *args, **kwargs):
+        serializer = ReservationCreateSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        try:
+            reservation = stock.reserve(serializer.validated_data['items'], user=request.user)
+        except stock.InsufficientStock as exc:
+            return Response({'detail': '库存不足.', 'product': exc.product_id}, status=status.HTTP_409_CONFLICT)
+        return Response(self.get_serializer(reservation).data, status=status.HTTP_201_CREATED)
+
+    @action(detail=True, methods=['post'])
+    def confirm(self, request, pk=None):
+        """确认预留"""
+        return self._transition(stock.confirm)
+
+    @action(detail=True, methods=['post'])
+    def release(self, request, pk=None):
+        """取消预留, 库存退回"""
+        return self._transition(stock.release)
+
+    def _transition(self, operation):
+        reservation = self.get_object()
+        try:
+            operation(reservation)
+        except stock.ReservationStateError as exc:
+            return Response({'detail': str(exc)}, status=status.HTTP_409_CONFLICT)
+        return Response(self.get_serializer(reservation).data)
+
+
+class CatalogChangesView(APIView):
+    """
+    商品目录增量同步接口
+
+    GET ?since=<上一次返回的 next>&limit=<每批条数>, 不带 since 时全量同步。
+    has_more 为 true 时应立即用 next 继续拉取; 返回 410 时说明令牌太旧, 需要丢弃本地数据重新全量同步。
+    """
+    permission_classes = [permissions.AllowAny]
+
+    def get(self, request):
+        limit = request.query_params.get('limit')
+        if limit is not None:
+            try:
+                limit = serializers.IntegerField(min_value=1, max_value=settings.CATALOG_SYNC['MAX_BATCH_SIZE']).run_validation(limit)
+            except serializers.ValidationError as exc:
+                return Response({'limit': exc.detail}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            data = sync.changes(since=request.query_params.get('since') or None, limit=limit, context={'request': request})
+        except sync.InvalidSyncToken as exc:
+            return Response({'since': [str(exc)]}, status=status.HTTP_400_BAD_REQUEST)
+        except sync.SyncTokenExpired as exc:
+            return Response({'detail': str(exc)}, status=status.HTTP_410_GONE)
+        return Response(data)
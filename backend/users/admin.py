@@ -1,6 +1,9 @@
 from django.contrib import admin
 from django.contrib.auth.admin import UserAdmin as BaseUserAdmin #  重命名默认的 UserAdmin
 from django.contrib.auth.models import User
+from django.db.models import Q
+from django.db.models.functions import Lower
+from core.admin import LargeTableAdmin, prefix_q
 from .models import UserProfile # 导入 UserProfile 模型
 
 # 定义一个内联类，用于在 UserAdmin 中显示 UserProfile 信息
@@ -8,12 +11,42 @@ class UserProfileInline(admin.StackedInline):
     model = UserProfile
     can_delete = False #  不允许在 UserAdmin 中删除 UserProfile，UserProfile 的删除应该由 User 删除级联完成
     verbose_name_plural = '用户资料' #  在 UserAdmin 中显示的 Inline 名称
+    fields = ('avatar', 'address', 'phone_number')
 
 # 继承自默认的 UserAdmin
-class UserAdmin(BaseUserAdmin):
+class UserAdmin(LargeTableAdmin, BaseUserAdmin):
     inlines = (UserProfileInline,) #  将 UserProfileInline 添加到 UserAdmin 中
+    list_filter = ('is_staff', 'is_superuser', 'is_active') # * 去掉默认的用户组筛选, 它会查询所有用户组
+    sortable_by = ('username',) # 只允许按有索引的列排序
+    search_help_text = '用户名或邮箱前缀(邮箱不区分大小写)'
+
+    def get_search_results(self, request, queryset, search_term):
+        # * 用户名有唯一索引, 前缀搜索是一次索引范围扫描; 默认的 icontains 会扫描整张用户表
+        # * 邮箱走 LOWER(email) 上的部分唯一索引(users_user_email_ci_uniq), email > '' 与索引条件一致才可用
+        search_term = search_term.strip()
+        if not search_term:
+            return queryset, False
+        by_email = prefix_q('email_lower', search_term.lower()) & Q(email__gt='')
+        return queryset.alias(email_lower=Lower('email')).filter(prefix_q('username', search_term) | by_email), False
+
+# 单独管理用户资料, 用户选择框改为自动补全, 不会把所有用户渲染进 <select>
+class UserProfileAdmin(LargeTableAdmin, admin.ModelAdmin):
+    list_display = ('user', 'phone_number', 'address')
+    list_select_related = ('user',) # __str__ 里用到了用户名
+    autocomplete_fields = ('user',)
+    search_fields = ('phone_number', 'user__username')
+    search_help_text = '手机号, 或用户名前缀'
+
+    def get_search_results(self, request, queryset, search_term):
+        # * 两个条件各走一个索引(SQLite 的 MULTI-INDEX OR): phone_number__gt='' 与部分索引的条件一致, 索引才可用;
+        # * 用户名写成子查询, 在 auth_user 的唯一索引上做范围扫描, 再按 user_id 的唯一索引取资料
+        search_term = search_term.strip()
+        if not search_term:
+            return queryset, False
+        users = User.objects.filter(prefix_q('username', search_term)).values('pk')
+        return queryset.filter(Q(phone_number=search_term, phone_number__gt='') | Q(user__in=users)), False
 
 # 重新注册 User 模型，使用我们自定义的 UserAdmin
 admin.site.unregister(User) #  先取消默认的注册
 admin.site.register(User, UserAdmin) #  再使用我们自定义的 UserAdmin 重新注册
-admin.site.register(UserProfile) #  注册 UserProfile 模型，方便单独管理，虽然通常我们通过 UserAdmin 管理 UserProfile
\ No newline at end of file
+admin.site.register(UserProfile, UserProfileAdmin) #  注册 UserProfile 模型，方便单独管理，虽然通常我们通过 UserAdmin 管理 UserProfile
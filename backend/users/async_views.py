@@ -0,0 +1,34 @@
+"""用户资料的 ASGI 原生只读接口, 输出与 UserViewSet.profile_detail 一致"""
+from django.http import HttpResponse
+from django.views.decorators.http import require_GET
+
+from core.renderers import FastJSONRenderer
+
+from .authentication import KEYWORD, aget_user
+from .models import UserProfile
+from .tokens import InvalidToken
+from .serializers import UserProfileSerializer
+
+
+def json_response(data, status=200):
+    return HttpResponse(FastJSONRenderer().render(data), status=status, content_type='application/json')
+
+
+@require_GET
+async def profile_detail(request, pk):
+    """获取用户详细Profile信息, 与 UserViewSet 一样只允许管理员访问"""
+    try:
+        user = await aget_user(request)
+    except InvalidToken as exc:
+        response = json_response({'detail': str(exc)}, status=401)
+        response['WWW-Authenticate'] = KEYWORD
+        return response
+    if not user.is_authenticated:
+        return json_response({'detail': 'Authentication credentials were not provided.'}, status=403)
+    if not user.is_staff:
+        return json_response({'detail': 'You do not have permission to perform this action.'}, status=403)
+    try:
+        profile = await UserProfile.objects.aget(user_id=pk)
+    except UserProfile.DoesNotExist:
+        return json_response({'detail': 'No User matches the given query.'}, status=404)
+    return json_response(UserProfileSerializer(profile, context={'request': request}).data)
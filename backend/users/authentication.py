@@ -0,0 +1,43 @@
+from rest_framework import authentication, exceptions
+
+from .tokens import InvalidToken, aauthenticate_access, authenticate_access
+
+KEYWORD = 'Bearer'
+
+
+def get_bearer_token(request):
+    """从 Authorization: Bearer <token> 请求头里取出令牌, 没有时返回 None"""
+    header = request.META.get('HTTP_AUTHORIZATION', '').split()
+    if len(header) != 2 or header[0] != KEYWORD:
+        return None
+    return header[1]
+
+
+class SignedTokenAuthentication(authentication.BaseAuthentication):
+    """
+    签名令牌认证
+
+    只校验签名并读取缓存, 不查 django_session, 用户对象缓存命中时整个认证过程没有数据库查询。
+    没有带 Bearer 令牌的请求交给后面的 SessionAuthentication 处理(后台管理仍然使用会话登录)。
+    """
+
+    def authenticate(self, request):
+        token = get_bearer_token(request)
+        if token is None:
+            return None
+        try:
+            return authenticate_access(token)
+        except InvalidToken as exc:
+            raise exceptions.AuthenticationFailed(str(exc))
+
+    def authenticate_header(self, request):
+        return KEYWORD
+
+
+async def aget_user(request):
+    """异步视图使用: 带了 Bearer 令牌时按令牌认证, 否则退回会话认证; 令牌无效时抛出 InvalidToken"""
+    token = get_bearer_token(request)
+    if token is None:
+        return await request.auser()
+    user, _ = await aauthenticate_access(token)
+    return user
@@ -0,0 +1,41 @@
+from django.contrib.auth import get_user_model
+from django.contrib.auth.backends import ModelBackend
+from django.db.models.functions import Lower
+
+UserModel = get_user_model()
+
+
+def find_user_by_email(email):
+    """
+    按邮箱查找用户, 不区分大小写
+
+    ! 查询条件必须写成 LOWER(email) = ? AND email > '' 才能命中 users 0004 迁移里的唯一表达式索引
+    """
+    return UserModel._default_manager.alias(email_lower=Lower('email')).filter(
+        email_lower=email.lower(), email__gt='',
+    ).first()
+
+
+class EmailOrUsernameBackend(ModelBackend):
+    """
+    支持用户名或邮箱登录的认证后端
+
+    找不到用户时仍然计算一次密码哈希, 让"用户不存在"和"密码错误"的耗时一致, 避免通过响应时间枚举账号。
+    """
+
+    def authenticate(self, request, username=None, password=None, email=None, **kwargs):
+        if password is None:
+            return None
+        if email:
+            user = find_user_by_email(email)
+        elif username:
+            user = UserModel._default_manager.filter(**{UserModel.USERNAME_FIELD: username}).first()
+        else:
+            return None
+
+        if user is None:
+            UserModel().set_password(password)  # 计算一次哑哈希, 与正常校验耗时一致
+            return None
+        if user.check_password(password) and self.user_can_authenticate(user):
+            return user
+        return None
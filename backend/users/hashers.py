@@ -0,0 +1,14 @@
+from django.conf import settings
+from django.contrib.auth.hashers import PBKDF2PasswordHasher
+
+
+class ConfigurablePBKDF2PasswordHasher(PBKDF2PasswordHasher):
+    """
+    迭代次数可以通过 PASSWORD_PBKDF2_ITERATIONS 配置的 PBKDF2 哈希
+
+    算法名与 Django 默认的 pbkdf2_sha256 相同, 已有的密码可以直接校验; 迭代次数变化后用户下次登录时自动按新次数重新哈希。
+    """
+
+    @property
+    def iterations(self):
+        return settings.PASSWORD_PBKDF2_ITERATIONS
@@ -0,0 +1,18 @@
+# Generated by Django 5.1.15 on 2026-10-18 05:43
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0002_userprofile_address'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='userprofile',
+            name='avatar_variants',
+            field=models.JSONField(blank=True, default=dict, editable=False, verbose_name='头像衍生图'),
+        ),
+    ]
@@ -0,0 +1,23 @@
+from django.conf import settings
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+    """
+    在 auth_user 上建立不区分大小写的邮箱唯一索引
+
+    auth_user 属于 django.contrib.auth, 不能在模型上声明索引, 这里用 RunSQL 创建;
+    空邮箱(例如 createsuperuser 时没填)不参与唯一约束。
+    """
+
+    dependencies = [
+        ('users', '0003_userprofile_avatar_variants'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RunSQL(
+            sql="CREATE UNIQUE INDEX users_user_email_ci_uniq ON auth_user (LOWER(email)) WHERE email > ''",
+            reverse_sql='DROP INDEX users_user_email_ci_uniq',
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 5.1.15 on 2026-10-18 05:52
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0004_user_email_ci_index'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddConstraint(
+            model_name='userprofile',
+            constraint=models.UniqueConstraint(condition=models.Q(('phone_number__gt', '')), fields=('phone_number',), name='users_profile_phone_uniq'),
+        ),
+    ]
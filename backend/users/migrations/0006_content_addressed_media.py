@@ -0,0 +1,19 @@
+# Generated by Django 5.1.15 on 2026-10-18 06:28
+
+import core.media
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0005_userprofile_phone_number_unique'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='userprofile',
+            name='avatar',
+            field=core.media.ContentAddressedImageField(blank=True, null=True, upload_to='avatars/', verbose_name='头像'),
+        ),
+    ]
@@ -1,12 +1,16 @@
 from django.db import models
 from django.contrib.auth.models import User
 
+from core.media import ContentAddressedImageField
+
 class UserProfile(models.Model):
     """用户的扩展信息"""
     # * 与默认用户模型建立一对一关系
     user = models.OneToOneField(User, on_delete=models.CASCADE, related_name='profile')
-    # * 用户头像，上传到avatars目录
-    avatar = models.ImageField(upload_to='avatars/', null=True, blank=True, verbose_name='头像')
+    # * 用户头像，按内容的摘要命名, 上传到avatars目录
+    avatar = ContentAddressedImageField(upload_to='avatars/', null=True, blank=True, verbose_name='头像')
+    # * 头像的缩略图/WebP 等衍生图路径, 由后台线程生成
+    avatar_variants = models.JSONField(default=dict, blank=True, editable=False, verbose_name='头像衍生图')
     address = models.CharField(max_length=50, null=True, blank=True, verbose_name='地址')
     # * 用户电话号码
     phone_number = models.CharField(max_length=20, null=True, blank=True, verbose_name='电话号码')
@@ -14,6 +18,12 @@ class UserProfile(models.Model):
     class Meta:
         verbose_name = '用户资料'
         verbose_name_plural = verbose_name
+        constraints = [
+            # * 手机号唯一, 没填手机号的用户不参与约束; 注册校验按手机号查询时也会用到这个索引
+            models.UniqueConstraint(
+                fields=['phone_number'], condition=models.Q(phone_number__gt=''), name='users_profile_phone_uniq',
+            ),
+        ]
 
     def __str__(self):
         return f'{self.user.username}的资料'
@@ -1,20 +1,53 @@
 import email
 from pydantic import ValidationError
 from rest_framework import serializers
+from core.fields import ImageVariantsField
+from core.sparse import SparseFieldsMixin
 from django.contrib.auth.models import User
 from .models import UserProfile
 from django.contrib.auth import password_validation, authenticate
+from django.db import IntegrityError, transaction
+from django.db.models import Value
+from django.db.models.functions import Lower
+
+UNIQUE_MESSAGES = {
+    'username': '用户名已存在.',
+    'email': '邮箱已存在.',
+    'phone_number': '手机号已存在.',
+}
+
+
+def conflicting_fields(username, email, phone_number=None):
+    """
+    返回已被占用的注册字段名
+
+    三个检查用 UNION 合并成一条查询, 每个分支都能命中唯一索引; 邮箱不区分大小写, 与 users 0004 迁移里的索引一致。
+    """
+    queries = [
+        User.objects.filter(username=username).annotate(field=Value('username')),
+        User.objects.alias(email_lower=Lower('email')).filter(email_lower=email.lower(), email__gt='')
+        .annotate(field=Value('email')),
+    ]
+    if phone_number:
+        # ! 条件里要带上 phone_number > '', SQLite 才会使用部分索引 users_profile_phone_uniq
+        queries.append(
+            UserProfile.objects.filter(phone_number=phone_number, phone_number__gt='').annotate(field=Value('phone_number'))
+        )
+    first, *rest = [query.values_list('field', flat=True) for query in queries]
+    return set(first.union(*rest, all=True))
 
 class UserProfileSerializer(serializers.ModelSerializer): #  为 UserProfile 创建一个 Serializer
     avatar = serializers.ImageField(required=False) #  ImageField 需要特别声明,  required=False 表示头像不是必须的
+    avatar_variants = ImageVariantsField(image_field='avatar') # 头像各尺寸/格式衍生图的 URL
 
     class Meta:
         model = UserProfile
-        fields = ['avatar', 'address', 'phone_number']
+        fields = ['avatar', 'avatar_variants', 'address', 'phone_number']
 
 
-class UserSerializer(serializers.ModelSerializer):
+class UserSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     profile = UserProfileSerializer(read_only=True) #  嵌套 UserProfileSerializer，用于展示用户资料
+    expandable_fields = {'profile': None}   # * 稀疏字段集(?fields=/?expand=)时只有 expand=profile 才查询和输出资料
     class Meta:
         model = User
         fields = ['id', 'username', 'email', 'first_name', 'last_name', 'is_staff', 'profile'] #  添加 'profile' 字段
@@ -43,35 +76,39 @@ class RegisterSerializer(serializers.Serializer):
         # ? 验证两次密码输入是否一致
         if data['password'] != data['password2']:
             raise serializers.ValidationError({"password": "两次密码输入不一致."})
-        # ? 验证用户名是否已经存在
-        if User.objects.filter(username=data['username']).exists():
-            raise serializers.ValidationError({"username": "用户名已存在."})
-        # ? 验证邮箱是否已存在
-        if User.objects.filter(email=data['email']).exists():
-            raise serializers.ValidationError({"email": "邮箱已存在."})
-        # ? 验证手机号是否已存在, 这里要检查的是UserProfile模型
-        if UserProfile.objects.filter(phone_number=data['phone_number']).exists():
-            raise serializers.ValidationError({"phone_number": "手机号已存在."})
+        # ? 用户名、邮箱、手机号是否已存在, 一条查询检查完
+        conflicts = conflicting_fields(data['username'], data['email'], data.get('phone_number'))
+        if conflicts:
+            raise serializers.ValidationError({field: UNIQUE_MESSAGES[field] for field in conflicts})
         return data
-    
+
     def create(self, validated_data):
         """创建用户和用户资料"""
-        user = User.objects.create_user(    # ! 使用create_user方法创建用户会自动对密码进行哈希加密
-            username=validated_data['username'],
-            email=validated_data['email'],
-            # 使用get方法, 如果validated——data里面没用first——name字段，则使用默认值''
-            first_name=validated_data.get('first_name', ''),
-            last_name=validated_data.get('last_name', '')
-        )
-        user.set_password(validated_data['password'])   # ! 显式设置密码
-        user.save()
-
-        UserProfile.objects.create(     # 创建UserProfile对象
-            user=user,
-            avatar=validated_data.get('avatar'),
-            address=validated_data.get('address'),
-            phone_number=validated_data.get('phone_number')
-        )
+        # ! validate 只是提前给出友好的错误, 并发注册时真正的保证是数据库上的唯一索引
+        try:
+            with transaction.atomic():
+                user = User.objects.create_user(    # ! 传入 password, create_user 只会计算一次哈希
+                    username=validated_data['username'],
+                    email=validated_data['email'],
+                    password=validated_data['password'],
+                    # 使用get方法, 如果validated——data里面没用first——name字段，则使用默认值''
+                    first_name=validated_data.get('first_name', ''),
+                    last_name=validated_data.get('last_name', '')
+                )
+                UserProfile.objects.create(     # 创建UserProfile对象
+                    user=user,
+                    avatar=validated_data.get('avatar'),
+                    address=validated_data.get('address'),
+                    phone_number=validated_data.get('phone_number')
+                )
+        except IntegrityError:
+            # 事务已经回滚, 重新查一次是哪个字段冲突
+            conflicts = conflicting_fields(
+                validated_data['username'], validated_data['email'], validated_data.get('phone_number'),
+            )
+            if not conflicts:
+                raise
+            raise serializers.ValidationError({field: UNIQUE_MESSAGES[field] for field in conflicts})
         return user
     
 class LoginSerializer(serializers.Serializer):      # 创建登录 Serializer
@@ -89,11 +126,12 @@ class LoginSerializer(serializers.Serializer):      # 创建登录 Serializer
             raise serializers.ValidationError({"error": "用户名或邮箱必须提供一个."})
         
         user = None     # 初始化user
+        request = self.context.get('request')
         if email:
-            # 使用django的authenticate方法验证用户
-            user = authenticate(email=email, password=password)
+            # 使用django的authenticate方法验证用户, 邮箱由 users.backends.EmailOrUsernameBackend 处理
+            user = authenticate(request, email=email, password=password)
         elif username:
-            user = authenticate(username=username, password=password)
+            user = authenticate(request, username=username, password=password)
 
         if not user:
             # ! 如果验证失败，authenticate会返回None
@@ -0,0 +1,21 @@
+from django.contrib.auth.models import User
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from core.images import schedule_variants
+
+from .models import UserProfile
+from .tokens import forget_principal
+
+
+@receiver(post_save, sender=UserProfile)
+def build_avatar_variants(sender, instance, **kwargs):
+    """头像变化后在后台生成缩略图和 WebP/AVIF 衍生图"""
+    schedule_variants(instance, 'avatar', 'avatar_variants')
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def forget_cached_principal(sender, instance, **kwargs):
+    """用户信息(权限、是否激活、密码等)变更后清除令牌认证缓存的认证信息"""
+    forget_principal(instance.pk)
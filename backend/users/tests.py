@@ -1,3 +1,327 @@
-from django.test import TestCase
+from unittest import mock
 
-# Create your tests here.
+from django.conf import settings
+from django.contrib import admin
+from django.contrib.auth.models import User
+from django.contrib.sessions.models import Session
+from django.core.cache import cache
+from django.db import IntegrityError, connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from rest_framework.exceptions import ValidationError
+
+from . import tokens
+from .models import UserProfile
+from .serializers import RegisterSerializer
+from .views import UserViewSet
+
+
+class AsyncProfileTests(TestCase):
+    """ASGI 原生的用户资料接口"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_user('admin', 'admin@example.com', 'pass', is_staff=True)
+        cls.user = User.objects.create_user('user', 'user@example.com', 'pass')
+        UserProfile.objects.create(user=cls.user, address='上海', phone_number='13800000000')
+
+    async def test_matches_profile_detail_action(self):
+        await self.async_client.aforce_login(self.admin)
+        async_response = await self.async_client.get(reverse('async-user-profile-detail', args=[self.user.pk]))
+        sync_response = await self.async_client.get(reverse('user-profile-detail', args=[self.user.pk]))
+        self.assertEqual(async_response.json(), sync_response.json())
+
+    async def test_requires_staff(self):
+        await self.async_client.aforce_login(self.user)
+        response = await self.async_client.get(reverse('async-user-profile-detail', args=[self.user.pk]))
+        self.assertEqual(response.status_code, 403)
+
+
+@override_settings(PASSWORD_PBKDF2_ITERATIONS=1000)
+class LoginTests(TestCase):
+    """用户名/邮箱登录与登录限流"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('alice', 'Alice@Example.com', 'correct-horse')
+
+    def setUp(self):
+        cache.clear()
+
+    def login(self, **data):
+        return self.client.post(reverse('login'), data, content_type='application/json')
+
+    def test_email_login_is_case_insensitive(self):
+        response = self.login(email='alice@example.COM', password='correct-horse')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['user']['username'], 'alice')
+        self.assertEqual(self.login(username='alice', password='correct-horse').status_code, 200)
+
+    def test_wrong_password_and_unknown_account(self):
+        self.assertEqual(self.login(email='alice@example.com', password='wrong').status_code, 400)
+        self.assertEqual(self.login(email='nobody@example.com', password='wrong').status_code, 400)
+
+    def test_email_lookup_uses_case_insensitive_index(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.login(email='alice@example.com', password='correct-horse')
+        lookup = queries.captured_queries[0]['sql']
+        with connection.cursor() as cursor:
+            cursor.execute('EXPLAIN QUERY PLAN ' + lookup)
+            plan = ' '.join(str(row) for row in cursor.fetchall())
+        self.assertIn('users_user_email_ci_uniq', plan)
+
+    def test_email_unique_ignoring_case(self):
+        with self.assertRaises(IntegrityError):
+            User.objects.create_user('alice2', 'ALICE@example.com', 'x')
+
+    def test_account_throttle_rejects_before_hashing(self):
+        for _ in range(10):
+            self.login(email='alice@example.com', password='wrong')
+        with self.assertNumQueries(0):
+            response = self.login(email='ALICE@example.com', password='correct-horse')
+        self.assertEqual(response.status_code, 429)
+
+
+@override_settings(PASSWORD_PBKDF2_ITERATIONS=1000)
+class RegisterTests(TestCase):
+    """注册: 一条查询完成唯一性校验, 用户和资料在同一个事务里创建"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.existing = User.objects.create_user('alice', 'Alice@Example.com', 'correct-horse')
+        UserProfile.objects.create(user=cls.existing, phone_number='13800000000')
+
+    def register(self, **overrides):
+        data = {
+            'username': 'bob', 'email': 'bob@example.com', 'phone_number': '13900000000',
+            'password': 'Str0ng-passw0rd', 'password2': 'Str0ng-passw0rd',
+        }
+        data.update(overrides)
+        return self.client.post(reverse('register'), data)
+
+    def test_register_creates_user_and_profile(self):
+        # 唯一性校验 1 条 + 事务(savepoint/INSERT user/INSERT profile/release) 4 条
+        with self.assertNumQueries(5):
+            response = self.register()
+        self.assertEqual(response.status_code, 201)
+        user = User.objects.get(username='bob')
+        self.assertTrue(user.check_password('Str0ng-passw0rd'))
+        self.assertEqual(user.profile.phone_number, '13900000000')
+
+    def test_duplicate_fields_reported_together(self):
+        with self.assertNumQueries(1):
+            response = self.register(username='alice', email='ALICE@example.com', phone_number='13800000000')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(set(response.json()), {'username', 'email', 'phone_number'})
+
+    def test_blank_phone_numbers_do_not_conflict(self):
+        UserProfile.objects.filter(user=self.existing).update(phone_number='')
+        self.assertEqual(self.register(phone_number='').status_code, 201)
+
+    def test_integrity_error_maps_to_field_error(self):
+        # 模拟并发: 校验通过之后另一个请求抢先注册了同样的邮箱
+        serializer = RegisterSerializer(data={
+            'username': 'carol', 'email': 'carol@example.com',
+            'password': 'Str0ng-passw0rd', 'password2': 'Str0ng-passw0rd',
+        })
+        self.assertTrue(serializer.is_valid())
+        User.objects.create_user('carol2', 'CAROL@example.com', 'x')
+        with self.assertRaises(ValidationError) as raised:
+            serializer.save()
+        self.assertEqual(set(raised.exception.detail), {'email'})
+        self.assertFalse(User.objects.filter(username='carol').exists())
+
+    def test_phone_lookup_uses_unique_index(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.register(username='alice')
+        with connection.cursor() as cursor:
+            cursor.execute('EXPLAIN QUERY PLAN ' + queries.captured_queries[0]['sql'])
+            plan = ' '.join(str(row) for row in cursor.fetchall())
+        self.assertIn('users_profile_phone_uniq', plan)
+        self.assertIn('users_user_email_ci_uniq', plan)
+
+
+@override_settings(PASSWORD_PBKDF2_ITERATIONS=1000)
+class TokenAuthTests(TestCase):
+    """签名令牌认证: 登录不建会话, 带令牌的请求不查 django_session 和 auth_user"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_user('admin', 'admin@example.com', 'correct-horse', is_staff=True)
+        UserProfile.objects.create(user=cls.admin, phone_number='13800000000')
+
+    def setUp(self):
+        cache.clear()
+
+    def login(self):
+        response = self.client.post(reverse('login'), {'username': 'admin', 'password': 'correct-horse'})
+        self.assertEqual(response.status_code, 200)
+        return response.json()['tokens']
+
+    def get_profile(self, access):
+        return self.client.get(
+            reverse('user-profile-detail', args=[self.admin.pk]), HTTP_AUTHORIZATION=f'Bearer {access}',
+        )
+
+    def test_login_issues_tokens_without_session(self):
+        self.login()
+        self.assertFalse(Session.objects.exists())
+        self.assertNotIn('sessionid', self.client.cookies)
+
+    def test_bearer_request_skips_session_and_user_queries(self):
+        access = self.login()['access']
+        # 只剩视图本身的两条查询(用户、资料), 认证不访问数据库
+        with CaptureQueriesContext(connection) as queries:
+            response = self.get_profile(access)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(queries), 2)
+        self.assertFalse(any('django_session' in query['sql'] for query in queries.captured_queries))
+
+        self.client.force_login(self.admin)
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(reverse('user-profile-detail', args=[self.admin.pk]))
+        self.assertEqual(len(queries), 4)
+
+    def test_cache_holds_only_authentication_fields(self):
+        access = self.login()['access']
+        principal = tokens.get_token_cache().get(tokens.PRINCIPAL_KEY.format(self.admin.pk))
+        self.assertEqual(set(principal), {*tokens.PRINCIPAL_FIELDS, 'pwd'})
+        self.assertNotIn(self.admin.password, principal.values())
+        # 其余字段在访问时才查询
+        response = self.client.get(reverse('user-me'), HTTP_AUTHORIZATION=f'Bearer {access}')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['username'], 'admin')
+
+    def test_me_with_bearer_token_is_one_query(self):
+        access = self.login()['access']
+        for url in (reverse('user-me'), reverse('user-me') + '?fields=id,username'):
+            with self.subTest(url=url), CaptureQueriesContext(connection) as queries:
+                response = self.client.get(url, HTTP_AUTHORIZATION=f'Bearer {access}')
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.json()['username'], 'admin')
+            self.assertEqual(len(queries), 1)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(
+                reverse('compound'), {'requests': [{'path': reverse('user-me')}]}, content_type='application/json',
+                HTTP_AUTHORIZATION=f'Bearer {access}',
+            )
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertEqual(len(queries), 1)
+
+    def test_invalid_token_is_rejected(self):
+        response = self.get_profile('not-a-token')
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(response['WWW-Authenticate'], 'Bearer')
+        # refresh 令牌不能当 access 令牌用
+        self.assertEqual(self.get_profile(self.login()['refresh']).status_code, 401)
+
+    def test_expired_access_token(self):
+        access = self.login()['access']
+        with override_settings(AUTH_TOKENS={**settings.AUTH_TOKENS, 'ACCESS_TTL': -1}):
+            self.assertEqual(self.get_profile(access).status_code, 401)
+
+    def test_refresh_rotates_tokens(self):
+        refresh = self.login()['refresh']
+        response = self.client.post(reverse('token-refresh'), {'refresh': refresh})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.get_profile(response.json()['tokens']['access']).status_code, 200)
+        # 用过的 refresh 令牌立即失效
+        self.assertEqual(self.client.post(reverse('token-refresh'), {'refresh': refresh}).status_code, 401)
+
+    def test_logout_revokes_tokens(self):
+        issued = self.login()
+        response = self.client.post(
+            reverse('logout'), {'refresh': issued['refresh']}, HTTP_AUTHORIZATION=f'Bearer {issued["access"]}',
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.get_profile(issued['access']).status_code, 401)
+        self.assertEqual(self.client.post(reverse('token-refresh'), {'refresh': issued['refresh']}).status_code, 401)
+
+    def test_password_change_invalidates_tokens(self):
+        access = self.login()['access']
+        self.admin.set_password('new-password')
+        self.admin.save()
+        self.assertEqual(self.get_profile(access).status_code, 401)
+
+    def test_losing_staff_takes_effect_immediately(self):
+        access = self.login()['access']
+        admin = User.objects.get(pk=self.admin.pk)
+        admin.is_staff = False
+        admin.save()
+        self.assertEqual(self.get_profile(access).status_code, 403)
+
+    async def test_async_profile_accepts_bearer_token(self):
+        response = await self.async_client.post(
+            reverse('login'), {'username': 'admin', 'password': 'correct-horse'}, content_type='application/json',
+        )
+        access = response.json()['tokens']['access']
+        url = reverse('async-user-profile-detail', args=[self.admin.pk])
+        response = await self.async_client.get(url, headers={'Authorization': f'Bearer {access}'})
+        self.assertEqual(response.status_code, 200)
+        response = await self.async_client.get(url, headers={'Authorization': 'Bearer bogus'})
+        self.assertEqual(response.status_code, 401)
+
+
+class CompiledUserListTests(TestCase):
+    """用户列表的编译序列化器, 没有资料的用户输出 profile: null"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_user('admin', 'admin@example.com', 'pass', is_staff=True)
+        for i in range(3):
+            user = User.objects.create_user(f'用户{i}', f'u{i}@example.com', 'pass', first_name='名\u2028')
+            UserProfile.objects.create(user=user, phone_number=f'1380000000{i}', address='地址')
+
+    def test_matches_serializer_output(self):
+        self.client.force_login(self.admin)
+        compiled = self.client.get(reverse('user-list'))
+        with mock.patch.object(UserViewSet, 'compiled_list', False):
+            expected = self.client.get(reverse('user-list'))
+        self.assertEqual(compiled.status_code, 200)
+        self.assertEqual(compiled.content, expected.content)
+        self.assertIsNone(next(user for user in compiled.json() if user['username'] == 'admin')['profile'])
+
+    def test_sparse_fields_skip_profile_join(self):
+        self.client.force_login(self.admin)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('user-list'), {'fields': 'id,username'})
+        self.assertEqual(list(response.json()[0]), ['id', 'username'])
+        self.assertNotIn('users_userprofile', queries[-1]['sql'])
+        users = self.client.get(reverse('user-list'), {'fields': 'username', 'expand': 'profile'}).json()
+        self.assertEqual(next(user for user in users if user['username'] == '用户0')['profile']['address'], '地址')
+        self.assertEqual(self.client.get(reverse('user-list'), {'fields': 'profile'}).status_code, 400)
+
+
+class UserAdminSearchTests(TestCase):
+    """用户后台按用户名前缀/手机号搜索, 不做全表 icontains"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_superuser('admin', 'admin@example.com', 'pass')
+        for name, phone in (('alice', '13800000001'), ('alex', '13800000002'), ('bob', '')):
+            UserProfile.objects.create(user=User.objects.create_user(name, f'{name}@example.com', 'pass'), phone_number=phone)
+
+    def setUp(self):
+        self.client.force_login(self.admin)
+
+    def search(self, url_name, query):
+        response = self.client.get(reverse(url_name), {'q': query})
+        self.assertEqual(response.status_code, 200)
+        return sorted(str(obj) for obj in response.context['cl'].result_list)
+
+    def test_username_prefix(self):
+        self.assertEqual(self.search('admin:auth_user_changelist', 'al'), ['alex', 'alice'])
+        self.assertEqual(self.search('admin:auth_user_changelist', 'lice'), [])
+
+    def test_email_prefix(self):
+        self.assertEqual(self.search('admin:auth_user_changelist', 'Alice@EXAMPLE'), ['alice'])
+        self.assertEqual(self.search('admin:auth_user_changelist', 'bob@example.com'), ['bob'])
+        queryset, _ = admin.site._registry[User].get_search_results(None, User.objects.all(), 'alice@')
+        plan = queryset.explain()
+        self.assertIn('users_user_email_ci_uniq', plan)
+        self.assertNotIn('SCAN auth_user', plan)
+
+    def test_profile_by_phone_or_username(self):
+        self.assertEqual(self.search('admin:users_userprofile_changelist', '13800000002'), ['alex的资料'])
+        self.assertEqual(self.search('admin:users_userprofile_changelist', 'bo'), ['bob的资料'])
@@ -0,0 +1,21 @@
+from rest_framework.throttling import SimpleRateThrottle
+
+
+class LoginIPThrottle(SimpleRateThrottle):
+    """按客户端 IP 限制登录尝试次数, 在计算密码哈希之前拒绝暴力破解"""
+    scope = 'login_ip'
+
+    def get_cache_key(self, request, view):
+        return self.cache_format % {'scope': self.scope, 'ident': self.get_ident(request)}
+
+
+class LoginAccountThrottle(SimpleRateThrottle):
+    """按账号(用户名或邮箱, 不区分大小写) 限制登录尝试次数, 防止换 IP 撞同一个账号"""
+    scope = 'login_account'
+
+    def get_cache_key(self, request, view):
+        data = request.data if hasattr(request.data, 'get') else {}
+        account = data.get('email') or data.get('username')
+        if not account or not isinstance(account, str):
+            return None     # 没有账号的请求由序列化器报错, 不计数
+        return self.cache_format % {'scope': self.scope, 'ident': account.strip().lower()}
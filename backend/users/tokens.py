@@ -0,0 +1,169 @@
+"""
+签名令牌
+
+access/refresh 令牌都是 django.core.signing 签名的 JSON, 校验签名和有效期只需要 SECRET_KEY, 不查数据库:
+
+- access 令牌有效期短(AUTH_TOKENS['ACCESS_TTL']), 每个 API 请求都带上;
+- refresh 令牌有效期长, 只用来换取新的一对令牌, 每次使用后立即作废(轮换)。
+
+认证需要的用户字段(见 PRINCIPAL_FIELDS)和密码指纹缓存在 AUTH_TOKENS['CACHE_ALIAS'] 里, 用户信息变更时由信号清除;
+! 不缓存整个用户对象, 共享缓存里不能出现密码哈希。令牌里带着密码哈希的指纹, 修改密码后旧令牌全部失效。登出/轮换时把令牌 id 写入吊销列表, 缓存过期时间等于令牌剩余有效期,
+过期的令牌本来就无法通过校验, 吊销列表不会无限增长。
+"""
+import time
+import uuid
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core import signing
+from django.core.cache import caches
+from django.db import router
+from django.utils.crypto import constant_time_compare, salted_hmac
+
+ACCESS = 'access'
+REFRESH = 'refresh'
+
+PRINCIPAL_KEY = 'users:principal:{}'    # 缓存的认证信息
+REVOKED_KEY = 'users:token:revoked:{}'  # 已吊销的令牌 id
+
+# * 认证和权限检查用到的用户字段, 其余字段在视图真正访问时才查询
+PRINCIPAL_FIELDS = ('id', 'is_active', 'is_staff', 'is_superuser')
+
+
+class InvalidToken(Exception):
+    """令牌签名错误、已过期、已吊销或者类型不对"""
+
+
+def get_token_cache():
+    return caches[settings.AUTH_TOKENS['CACHE_ALIAS']]
+
+
+def lifetime(kind):
+    return settings.AUTH_TOKENS['ACCESS_TTL' if kind == ACCESS else 'REFRESH_TTL']
+
+
+def password_fingerprint(user):
+    """密码哈希的短指纹, 密码变化后旧令牌随之失效"""
+    return salted_hmac('users.tokens.password', user.password).hexdigest()[:12]
+
+
+def make_token(user, kind):
+    payload = {'uid': user.pk, 'jti': uuid.uuid4().hex, 'iat': int(time.time()), 'pwd': password_fingerprint(user)}
+    return signing.dumps(payload, salt=f'users.tokens.{kind}')
+
+
+def issue_tokens(user):
+    """签发一对新的 access/refresh 令牌, 同时缓存用户的认证信息"""
+    cache_principal(user)
+    return {
+        'access': make_token(user, ACCESS),
+        'refresh': make_token(user, REFRESH),
+        'token_type': 'Bearer',
+        'expires_in': lifetime(ACCESS),
+    }
+
+
+def decode(token, kind):
+    """校验签名和有效期, 返回令牌内容; 只做本地计算"""
+    try:
+        return signing.loads(token, salt=f'users.tokens.{kind}', max_age=lifetime(kind))
+    except signing.BadSignature:
+        raise InvalidToken('令牌无效或已过期.')
+
+
+def principal_of(user):
+    """用户的认证信息: PRINCIPAL_FIELDS 加上密码指纹, 没有用户时返回 None"""
+    if user is None:
+        return None
+    return {**{name: getattr(user, name) for name in PRINCIPAL_FIELDS}, 'pwd': password_fingerprint(user)}
+
+
+def principal_user(principal):
+    """由认证信息构造用户对象, 其余字段是延迟加载的, 与 .only(*PRINCIPAL_FIELDS) 查出来的一样"""
+    model = get_user_model()
+    names = [field.attname for field in model._meta.concrete_fields if field.attname in PRINCIPAL_FIELDS]
+    return model.from_db(router.db_for_read(model), names, [principal[name] for name in names])
+
+
+def principal_queryset(user_id):
+    return get_user_model()._default_manager.filter(pk=user_id).only(*PRINCIPAL_FIELDS, 'password')
+
+
+def cache_principal(user):
+    get_token_cache().set(PRINCIPAL_KEY.format(user.pk), principal_of(user), lifetime(ACCESS))
+
+
+def forget_principal(user_id):
+    get_token_cache().delete(PRINCIPAL_KEY.format(user_id))
+
+
+def check_principal(payload, principal):
+    if principal is None or not principal['is_active'] or not constant_time_compare(payload['pwd'], principal['pwd']):
+        raise InvalidToken('令牌无效或已过期.')
+
+
+def authenticate_access(token):
+    """
+    校验 access 令牌并返回用户
+
+    吊销列表和认证信息用一次 get_many 取出, 缓存未命中时才查一次数据库。
+    """
+    payload = decode(token, ACCESS)
+    principal_key, revoked_key = PRINCIPAL_KEY.format(payload['uid']), REVOKED_KEY.format(payload['jti'])
+    cache = get_token_cache()
+    cached = cache.get_many([principal_key, revoked_key])
+    if revoked_key in cached:
+        raise InvalidToken('令牌已被吊销.')
+    principal = cached.get(principal_key)
+    if principal is None:
+        principal = principal_of(principal_queryset(payload['uid']).first())
+        if principal is not None:
+            cache.set(principal_key, principal, lifetime(ACCESS))
+    check_principal(payload, principal)
+    return principal_user(principal), payload
+
+
+async def aauthenticate_access(token):
+    """authenticate_access 的异步版本, 供 ASGI 视图使用"""
+    payload = decode(token, ACCESS)
+    principal_key, revoked_key = PRINCIPAL_KEY.format(payload['uid']), REVOKED_KEY.format(payload['jti'])
+    cache = get_token_cache()
+    cached = await cache.aget_many([principal_key, revoked_key])
+    if revoked_key in cached:
+        raise InvalidToken('令牌已被吊销.')
+    principal = cached.get(principal_key)
+    if principal is None:
+        principal = principal_of(await principal_queryset(payload['uid']).afirst())
+        if principal is not None:
+            await cache.aset(principal_key, principal, lifetime(ACCESS))
+    check_principal(payload, principal)
+    return principal_user(principal), payload
+
+
+def remaining_lifetime(payload, kind):
+    return max(payload['iat'] + lifetime(kind) - int(time.time()) + 1, 1)
+
+
+def revoke(token, kind):
+    """吊销一个令牌; 已经无效的令牌直接忽略"""
+    try:
+        payload = decode(token, kind)
+    except InvalidToken:
+        return
+    revoke_payload(payload, kind)
+
+
+def revoke_payload(payload, kind):
+    get_token_cache().set(REVOKED_KEY.format(payload['jti']), 1, remaining_lifetime(payload, kind))
+
+
+def rotate(refresh_token):
+    """用 refresh 令牌换取一对新令牌, 旧的 refresh 令牌立即吊销"""
+    payload = decode(refresh_token, REFRESH)
+    # ! add 是原子的, 同一个 refresh 令牌并发使用时只有一个请求能成功
+    if not get_token_cache().add(REVOKED_KEY.format(payload['jti']), 1, remaining_lifetime(payload, REFRESH)):
+        raise InvalidToken('令牌已被吊销.')
+    # 刷新的频率很低, 这里直接查数据库, 确保用户仍然有效
+    user = get_user_model()._default_manager.filter(pk=payload['uid']).first()
+    check_principal(payload, principal_of(user))
+    return issue_tokens(user)
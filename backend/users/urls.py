@@ -1,6 +1,6 @@
 from django.urls import path, include
 from rest_framework import routers
-from . import views
+from . import views, async_views
 
 router = routers.DefaultRouter()
 # 注册users路由到ViewSet
@@ -11,4 +11,6 @@ urlpatterns = [
     path('register/', views.RegisterView.as_view(), name='register'),    # 注册API
     path('login/', views.LoginView.as_view(), name='login'),             # 登录API
     path('logout/', views.LogoutView.as_view(), name='logout'),          # 登出API
+    path('token/refresh/', views.TokenRefreshView.as_view(), name='token-refresh'),  # 刷新令牌
+    path('async/users/<int:pk>/profile/', async_views.profile_detail, name='async-user-profile-detail'),  # ASGI 原生的用户资料接口
 ]
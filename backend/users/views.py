@@ -6,18 +6,39 @@ from rest_framework.views import APIView     # 导入API View
 from rest_framework.generics import GenericAPIView
 from rest_framework import mixins
 from django.contrib.auth.models import User
+from core.compiled import CompiledListMixin
+from core.sparse import SparseFieldsViewMixin
+from .throttles import LoginIPThrottle, LoginAccountThrottle
 from .serializers import LoginSerializer, UserSerializer, UserProfileSerializer, RegisterSerializer
+from django.conf import settings
 from django.contrib.auth import login, logout
+from django.contrib.auth.signals import user_logged_in
+from . import tokens
 
-class UserViewSet(viewsets.ModelViewSet):
-    """用户API接口"""
+class UserViewSet(SparseFieldsViewMixin, CompiledListMixin, viewsets.ModelViewSet):
+    """用户API接口, 支持 fields/expand 稀疏字段集(见 core.sparse)"""
     queryset = User.objects.all().order_by('-date_joined')  # 按照加入时间倒序排列
     serializer_class = UserSerializer
     permission_classes = [permissions.IsAdminUser]
 
     def get_queryset(self):
-        return User.objects.all().prefetch_related('profile').order_by('-date_joined')
-    
+        field_set = self.get_field_set()
+        if field_set is None:
+            return User.objects.all().prefetch_related('profile').order_by('-date_joined')
+        # * 没有 expand=profile 时不预取用户资料
+        queryset = User.objects.only(*field_set.columns({'profile': []})).order_by('-date_joined')
+        return queryset.prefetch_related('profile') if 'profile' in field_set.expand else queryset
+
+    @action(detail=False, methods=['get'], permission_classes=[permissions.IsAuthenticated])
+    def me(self, request):
+        """当前登录用户的信息, 普通用户也可以访问, 同样支持 fields/expand"""
+        # ! 令牌认证的 request.user 只加载了认证用的字段(见 users.tokens), 直接序列化会逐个字段延迟查询, 这里重新查一次
+        if self.get_field_set() is None:
+            queryset = User.objects.select_related('profile')
+        else:
+            queryset = self.get_queryset()
+        return Response(self.get_serializer(queryset.get(pk=request.user.pk)).data)
+
     @action(detail=True, methods=['get'])   # * 添加一个action，用于获取用户的详细profile信息
     def profile_detail(self, request, pk=None):
         """获取用户详细Profile信息"""
@@ -42,26 +63,51 @@ class RegisterView(GenericAPIView):         # * GenericAPIView提供了serialize
     
 class LoginView(GenericAPIView):
     serializer_class = LoginSerializer
-    serializer_classes = [permissions.AllowAny]
+    permission_classes = [permissions.AllowAny]
+    throttle_classes = [LoginIPThrottle, LoginAccountThrottle]  # * 在校验密码之前限流, 暴力破解请求不会消耗哈希计算
 
     def post(self, request, *args, **kwargs):
         serializer = self.get_serializer(data=request.data)
         serializer.is_valid(raise_exception=True)
         user = serializer.validated_data['user']
-        login(request, user)
+        if settings.AUTH_TOKENS['SESSION_LOGIN']:
+            login(request, user)    # 兼容旧客户端, 同时建立会话
+        else:
+            # * 令牌模式不写 django_session, 只发送登录信号更新 last_login
+            user_logged_in.send(sender=user.__class__, request=request, user=user)
         user_serializer = UserSerializer(user)
         return Response({
             "user": user_serializer.data,
+            "tokens": tokens.issue_tokens(user),
             "message": "用户登录成功",
         }, status=status.HTTP_200_OK)   # 登陆成功返回200
-    
+
+
+class TokenRefreshView(APIView):
+    """用 refresh 令牌换取新的一对令牌, 旧的 refresh 令牌随即失效"""
+    permission_classes = [permissions.AllowAny]
+    authentication_classes = []
+
+    def post(self, request, *args, **kwargs):
+        try:
+            issued = tokens.rotate(request.data.get('refresh', ''))
+        except tokens.InvalidToken as exc:
+            return Response({"error": str(exc)}, status=status.HTTP_401_UNAUTHORIZED)
+        return Response({"tokens": issued}, status=status.HTTP_200_OK)
+
+
 class LogoutView(APIView):
     permission_classes = [permissions.IsAuthenticated]
 
     def post(self, request, *args, **kwargs):
-        logout(request)     # 使用Django的logout方法清除session
+        if isinstance(request.auth, dict):
+            # 令牌登录: 吊销当前的 access 令牌, 如果带了 refresh 令牌也一并吊销
+            tokens.revoke_payload(request.auth, tokens.ACCESS)
+            tokens.revoke(request.data.get('refresh', ''), tokens.REFRESH)
+        else:
+            logout(request)     # 使用Django的logout方法清除session
         return Response({
             "message": "用户登出成功."
         }, status=status.HTTP_200_OK)
 
-# TODO 完成账户激活，密码重置API
\ No newline at end of file
+# TODO 完成账户激活，密码重置API; 邮件通过后台任务 core.tasks.send_email 发送, 不要在请求里直接连接 SMTP
\ No newline at end of file